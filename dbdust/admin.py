@@ -12,17 +12,36 @@
 import argparse
 import traceback
 import collections
+import concurrent.futures
 import configparser
 import datetime
+import functools
+import hashlib
+import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
+import dbdust.cacheio
+import dbdust.catalog
+import dbdust.continuous
+import dbdust.crypto
 import dbdust.dumper
+import dbdust.journal
+import dbdust.pack
+import dbdust.pipeline
+import dbdust.replicas
+import dbdust.rotation
 import dbdust.storage
+import dbdust.throttle
+import dbdust.utils
+import dbdust.verify
+import dbdust.workqueue
 
 logger = logging.getLogger('dbdust')
 formatter = logging.Formatter(fmt="%(asctime)s - %(levelname)s - %(message)s")
@@ -51,8 +70,23 @@ def create_cmd_line_parser():
     """
     parser = argparse.ArgumentParser(description='trigger the backup of the database, store the '
                                                  'backup and clean old ones')
+    parser.add_argument('command', nargs='?', default='backup',
+                        choices=['backup', 'resume', 'verify', 'decrypt', 'unpack', 'worker', 'rotate'],
+                        help='backup (default), resume the upload of the dumps (or the segments) kept by failed '
+                             'runs, verify the stored backups, decrypt a downloaded backup, extract the dumps of a '
+                             'pack, run the jobs of a work queue or rotate the backups of the job (or of all the '
+                             'jobs of a work queue)')
     parser.add_argument('-c', '--config', type=validate_config_file, dest='config_file',
                         help='config file, if not read config from environment')
+    parser.add_argument('-w', '--workers', type=int, dest='workers', default=None,
+                        help='max number of backups verified (or segments decrypted) at the same time '
+                             '(default to the number of cpu), number of jobs run at the same time by a worker '
+                             '(default to 1)')
+    parser.add_argument('-i', '--input', dest='input',
+                        help='encrypted file to decrypt, pack file (or name of a stored pack) to extract')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='path of the decrypted file, directory of the extracted dumps')
+    parser.add_argument('-q', '--queue', dest='queue', help='work queue directory shared by the workers')
     parser.add_argument('-v ', '--verbose', dest='verbose', help="increase output verbosity",
                         action="store_true")
     return parser
@@ -109,7 +143,15 @@ def get_dump_config(dump_type, dbdust_conf):
     :return: a named tuple of all settings for the dump operation
     :rtype: collections.namedtuple
     """
-    DumpConfig = collections.namedtuple('DumpConfig', 'type bin_path file_ext cli_func cli_conf zip_path')
+    DumpConfig = collections.namedtuple('DumpConfig', 'type bin_path file_ext cli_func cli_conf zip_path '
+                                                      'read_rate nice ionice_class ionice_level cgroup '
+                                                      'codec compression_level compression_min_level '
+                                                      'compression_max_level chunk_size size_estimator checksum '
+                                                      'encryption_key encryption_segment_size buffer_pool_size '
+                                                      'table_indicators table_checksum native_dumper '
+                                                      'key_ranges key_range_count key_range_workers '
+                                                      'segment_retries segment_retry_delay pack_databases io_conf '
+                                                      'replicas max_replica_lag replica_status')
 
     dumper_config = dbdust.dumper.dumper_config.get(dump_type)
 
@@ -119,13 +161,38 @@ def get_dump_config(dump_type, dbdust_conf):
     cli_func = dumper_config.get('cli_builder')
     cli_conf = dict(dbdust_conf.items(dump_type))
 
-    bin_path = shutil.which(bin_name)
-    if bin_path is None:
-        current_dir_bin_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bin', bin_name)
-        bin_path = current_dir_bin_path if os.path.exists(current_dir_bin_path) else None
-    if bin_path is None:
-        raise Exception('{} not found on the system'.format(bin_name))
-    logger.debug('{} found at {}'.format(bin_name, bin_path))
+    # the candidate replicas are not settings of the dump command
+    replicas = dbdust.replicas.parse_hosts(cli_conf.pop('replicas', None))
+    max_replica_lag = float(cli_conf.pop('max_replica_lag', dbdust.replicas.DEFAULT_MAX_LAG))
+    replica_status = None
+    if replicas:
+        replica_status = dumper_config.get('replica_status')
+        if replica_status is None:
+            raise Exception('replicas not supported by {} database'.format(dump_type))
+        if cli_conf.get('uri'):
+            raise Exception('replicas not supported with an uri')
+
+    native_dumper = dumper_config.get('native_dumper')
+    # a native dumper has no compressor to pipe to, dbdust compresses its output
+    codec = dumper_config.get('codec') if native_dumper is not None else None
+    compression_level = dbdust_conf.get('general', 'compression_level', fallback=None)
+    if compression_level is not None:
+        codec = dumper_config.get('codec')
+        if codec is None:
+            raise Exception('compression_level not supported by {} database'.format(dump_type))
+        # dbdust compresses the output itself, the dumper must not pipe to a compressor
+        cli_func = dumper_config.get('stream_cli_builder')
+        zip_name = None
+
+    bin_path = None
+    if bin_name is not None:
+        bin_path = shutil.which(bin_name)
+        if bin_path is None:
+            current_dir_bin_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bin', bin_name)
+            bin_path = current_dir_bin_path if os.path.exists(current_dir_bin_path) else None
+        if bin_path is None:
+            raise Exception('{} not found on the system'.format(bin_name))
+        logger.debug('{} found at {}'.format(bin_name, bin_path))
 
     zip_path = None
     if zip_name is not None:
@@ -133,8 +200,79 @@ def get_dump_config(dump_type, dbdust_conf):
         if zip_path is None:
             raise Exception('{} not found on the system'.format(zip_name))
 
+    read_rate = dbdust.utils.parse_size(dbdust_conf.get('general', 'dump_rate', fallback=None))
+    nice = dbdust_conf.get('general', 'nice', fallback=None)
+    ionice_class = dbdust_conf.get('general', 'ionice_class', fallback=None)
+    ionice_level = dbdust_conf.get('general', 'ionice_level', fallback=None)
+    cgroup = dbdust_conf.get('general', 'cgroup', fallback=None)
+    compression_min_level = dbdust_conf.get('general', 'compression_min_level', fallback=None)
+    compression_max_level = dbdust_conf.get('general', 'compression_max_level', fallback=None)
+    chunk_size = dbdust.utils.parse_size(dbdust_conf.get('general', 'chunk_size', fallback=None))
+    buffer_pool_size = dbdust.utils.parse_size(dbdust_conf.get('general', 'buffer_pool_size', fallback=None))
+
+    encryption_key = None
+    encryption_key_file = dbdust_conf.get('general', 'encryption_key', fallback=None)
+    if encryption_key_file is not None:
+        encryption_key = dbdust.crypto.load_key(encryption_key_file)
+        file_ext = '{}.{}'.format(file_ext, dbdust.crypto.FILE_EXT)
+    encryption_segment_size = dbdust.utils.parse_size(dbdust_conf.get('general', 'encryption_segment_size',
+                                                                      fallback=None))
+
+    table_indicators = None
+    if dbdust_conf.getboolean('general', 'skip_unchanged_tables', fallback=False):
+        table_indicators = dumper_config.get('table_indicators')
+        if table_indicators is None:
+            raise Exception('skip_unchanged_tables not supported by {} database'.format(dump_type))
+        if encryption_key is not None:
+            raise Exception('skip_unchanged_tables not supported with encryption')
+
+    key_ranges = None
+    key_range_count = dbdust_conf.getint('general', 'key_ranges', fallback=None)
+    if key_range_count is not None and key_range_count > 1:
+        key_ranges = dumper_config.get('key_ranges')
+        if key_ranges is None:
+            raise Exception('key_ranges not supported by {} database'.format(dump_type))
+        if encryption_key is not None:
+            raise Exception('key_ranges not supported with encryption')
+    key_range_workers = dbdust_conf.getint('general', 'key_range_workers', fallback=None) or key_range_count
+
+    pack_databases = dbdust_conf.get('general', 'pack_databases', fallback='')
+    pack_databases = [database.strip() for database in pack_databases.split(',') if database.strip()]
+    if pack_databases:
+        if table_indicators is not None or key_ranges is not None:
+            raise Exception('pack_databases not supported with skip_unchanged_tables or key_ranges')
+        file_ext = '{}.{}'.format(file_ext, dbdust.pack.FILE_EXT)
+
     return DumpConfig(type=dump_type, bin_path=bin_path, file_ext=file_ext, cli_func=cli_func,
-                      cli_conf=cli_conf, zip_path=zip_path)
+                      cli_conf=cli_conf, zip_path=zip_path, read_rate=read_rate, nice=nice,
+                      ionice_class=ionice_class, ionice_level=ionice_level, cgroup=cgroup,
+                      codec=codec, compression_level=compression_level,
+                      compression_min_level=compression_min_level, compression_max_level=compression_max_level,
+                      chunk_size=chunk_size, size_estimator=dumper_config.get('size_estimator'),
+                      checksum=dbdust_conf.getboolean('general', 'checksum', fallback=False),
+                      encryption_key=encryption_key, encryption_segment_size=encryption_segment_size,
+                      buffer_pool_size=buffer_pool_size, table_indicators=table_indicators,
+                      table_checksum=dbdust_conf.getboolean('general', 'table_checksum', fallback=False),
+                      native_dumper=native_dumper, key_ranges=key_ranges, key_range_count=key_range_count,
+                      key_range_workers=key_range_workers,
+                      segment_retries=dbdust_conf.getint('general', 'segment_retries', fallback=0),
+                      segment_retry_delay=dbdust_conf.getfloat('general', 'segment_retry_delay',
+                                                               fallback=30),
+                      pack_databases=pack_databases, io_conf=get_io_config(dbdust_conf), replicas=replicas,
+                      max_replica_lag=max_replica_lag, replica_status=replica_status)
+
+
+def get_decryption_keys(dbdust_conf):
+    """ Load the keys able to decrypt the backups : the encryption key and the previous ones
+
+    :param dbdust_conf: config references for current dbdust process
+    :type dbdust_conf: dbdust.admin.DbDustConfig
+    :return: the keys indexed by key id
+    :rtype: dict
+    """
+    paths = [dbdust_conf.get('general', 'encryption_key', fallback='')]
+    paths.extend(dbdust_conf.get('general', 'decryption_keys', fallback='').split(','))
+    return dbdust.crypto.load_keys([path.strip() for path in paths if path.strip()])
 
 
 def get_storage_config(storage_type, dbdust_conf):
@@ -147,7 +285,8 @@ def get_storage_config(storage_type, dbdust_conf):
     :return: a named tuple of all settings for the storage operation
     :rtype: collections.namedtuple
     """
-    StorageConfig = collections.namedtuple('StorageConfig', 'type file_prefix date_format retain_conf impl_conf')
+    StorageConfig = collections.namedtuple('StorageConfig', 'type file_prefix date_format retain_conf impl_conf '
+                                                            'upload_rate split_size split_uploads io_conf rotate')
 
     file_prefix = dbdust_conf.get('general', 'file_prefix', fallback="backup-")
     date_format = dbdust_conf.get('general', 'date_format', fallback="%Y%m%d%H%M%S")
@@ -156,10 +295,70 @@ def get_storage_config(storage_type, dbdust_conf):
     monthly_retain = int(dbdust_conf.get('general', 'monthly', fallback=2))
     max_per_day = int(dbdust_conf.get('general', 'max', fallback=1))
     impl_conf = dict(dbdust_conf.items(storage_type))
+    upload_rate = dbdust.utils.parse_size(impl_conf.pop('upload_rate', None))
+    split_size = dbdust.utils.parse_size(dbdust_conf.get('general', 'split_size', fallback=None))
+    split_uploads = dbdust_conf.get('general', 'split_uploads', fallback=None)
 
     return StorageConfig(type=storage_type, file_prefix=file_prefix, date_format=date_format, impl_conf=impl_conf,
                          retain_conf={'daily_retain': daily_retain, 'weekly_retain': weekly_retain,
-                                      'monthly_retain': monthly_retain, 'max_per_day': max_per_day})
+                                      'monthly_retain': monthly_retain, 'max_per_day': max_per_day},
+                         upload_rate=upload_rate, split_size=split_size,
+                         split_uploads=int(split_uploads) if split_uploads is not None else None,
+                         io_conf=get_io_config(dbdust_conf),
+                         rotate=dbdust_conf.getboolean('general', 'rotate', fallback=True))
+
+
+def get_preflight_config(dbdust_conf):
+    """ Get all settings for the pre-flight checks
+
+    :param dbdust_conf: config references for current dbdust process
+    :type dbdust_conf: dbdust.admin.DbDustConfig
+    :return: a named tuple of all settings for the pre-flight checks
+    :rtype: collections.namedtuple
+    """
+    PreflightConfig = collections.namedtuple('PreflightConfig', 'enabled fallback_tmp_dirs margin')
+
+    enabled = dbdust_conf.getboolean('general', 'preflight', fallback=False)
+    fallback_tmp_dirs = [d.strip() for d in dbdust_conf.get('general', 'fallback_tmp_dirs', fallback='').split(',')
+                         if d.strip()]
+    margin = float(dbdust_conf.get('general', 'space_margin', fallback=1.2))
+
+    return PreflightConfig(enabled=enabled, fallback_tmp_dirs=fallback_tmp_dirs, margin=margin)
+
+
+def get_io_config(dbdust_conf):
+    """ Get the settings of the page cache use of the dump and storage files
+
+    :param dbdust_conf: config references for current dbdust process
+    :type dbdust_conf: dbdust.admin.DbDustConfig
+    :return: a named tuple of all settings for the file I/O
+    :rtype: collections.namedtuple
+    """
+    IOConfig = collections.namedtuple('IOConfig', 'mode sync_size report')
+
+    mode = dbdust_conf.get('general', 'io_mode', fallback='buffered')
+    if mode not in dbdust.cacheio.IO_MODES:
+        raise Exception('io_mode must be one of {}'.format(', '.join(dbdust.cacheio.IO_MODES)))
+    sync_size = dbdust.utils.parse_size(dbdust_conf.get('general', 'io_sync_size', fallback=None))
+
+    return IOConfig(mode=mode, sync_size=sync_size,
+                    report=dbdust_conf.getboolean('general', 'page_cache_report', fallback=False))
+
+
+def create_storage_handler(storage_conf):
+    """ Create the storage implementation and its handler
+
+    :param storage_conf : a named tuple of all settings for the storage operation
+    :type storage_conf: collections.namedtuple
+    :rtype: dbdust.storage.StorageHandler
+    """
+    storage_impl = dbdust.storage.StorageFactory.create(logger, storage_conf.type, **storage_conf.impl_conf)
+    storage_impl.bucket = dbdust.throttle.get_shared_bucket('upload:{}'.format(storage_conf.type),
+                                                            storage_conf.upload_rate)
+    storage_impl.io_mode = storage_conf.io_conf.mode
+    storage_impl.io_sync_size = storage_conf.io_conf.sync_size
+    return dbdust.storage.StorageHandler(storage_impl, storage_conf.file_prefix, storage_conf.date_format,
+                                         **storage_conf.retain_conf)
 
 
 class DbDustBackupHandler(object):
@@ -174,20 +373,35 @@ class DbDustBackupHandler(object):
     :type dump_conf: collections.namedtuple
     :param storage_conf : a named tuple of all settings for the storage operation
     :type storage_conf: collections.namedtuple
+    :param keep_failed_dump: keep the dump and an upload journal in the tmp dir if the storage task fails
+    :type keep_failed_dump: bool
+    :param catalog: catalog recording the report of each successful run
+    :type catalog: dbdust.catalog.Catalog
+    :param preflight_conf: a named tuple of all settings for the pre-flight checks
+    :type preflight_conf: collections.namedtuple
+    :param job: name of the job in the catalog (default to the file prefix)
+    :type job: str
     """
-    def __init__(self, logger_, dump_conf, storage_conf):
+    def __init__(self, logger_, dump_conf, storage_conf, keep_failed_dump=False, catalog=None, preflight_conf=None,
+                 job=None):
         self.logger = logger_
         self.dump_conf = dump_conf
         self.storage_conf = storage_conf
+        self.keep_failed_dump = keep_failed_dump
+        self.catalog = catalog
+        self.preflight_conf = preflight_conf
+        self.job = job or storage_conf.file_prefix
 
-        storage_impl = dbdust.storage.StorageFactory.create(logger, storage_conf.type, **storage_conf.impl_conf)
-        self.storage_handler = dbdust.storage.StorageHandler(storage_impl, storage_conf.file_prefix,
-                                                             storage_conf.date_format, **storage_conf.retain_conf)
+        self.storage_handler = create_storage_handler(storage_conf)
 
         now = datetime.datetime.utcnow()
         self.file_name = "{}{}.{}".format(self.storage_conf.file_prefix,
                                           now.strftime(self.storage_conf.date_format),
                                           self.dump_conf.file_ext)
+        self.report = {'job': self.job, 'database': dump_conf.type, 'storage': storage_conf.type,
+                       'file_name': self.file_name}
+        # connection settings of the replicas the segments are read from
+        self.sources = []
 
     def process(self, tmp_dir):
         """ Execute the backup and store tasks
@@ -195,15 +409,521 @@ class DbDustBackupHandler(object):
         :param tmp_dir: the directory where the temporary dump will be stored
         :type tmp_dir: str
         """
+        start_date = datetime.datetime.utcnow()
 
-        with tempfile.TemporaryDirectory(None, 'dbdust-', tmp_dir) as tmpdir_name:
+        streaming = False
+        if self.preflight_conf is not None and self.preflight_conf.enabled:
+            tmp_dir, streaming = self._preflight(tmp_dir)
+        self._select_replicas()
+
+        tmpdir_name = tempfile.mkdtemp(None, 'dbdust-', tmp_dir)
+        journal = None
+        try:
             tmp_file = os.path.join(tmpdir_name, self.file_name)
-            self.logger.info('backup temporary stored at {}'.format(tmp_file))
+            if streaming:
+                self._stream(tmp_dir, tmp_file)
+                self._rotate()
+            elif self.dump_conf.table_indicators is not None:
+                self._dump_tables(tmp_dir, tmp_file)
+                self._rotate()
+            elif self.dump_conf.key_ranges is not None:
+                self._dump_ranges(tmp_dir, tmp_file)
+                self._rotate()
+            elif self.storage_conf.split_size:
+                self._split(tmp_dir, tmp_file)
+                self._rotate()
+            else:
+                self.logger.info('backup temporary stored at {}'.format(tmp_file))
+                cached_before = dbdust.cacheio.cached_bytes() if self.dump_conf.io_conf.report else None
+                if self.dump_conf.pack_databases:
+                    self._dump_pack(tmp_dir, tmp_file)
+                else:
+                    self._dump(tmp_dir, tmp_file)
+                if self.dump_conf.io_conf.report:
+                    self._report_page_cache(tmp_file, cached_before)
+                if self.keep_failed_dump:
+                    journal = dbdust.journal.UploadJournal.create(tmp_dir, self.file_name, tmp_file=tmp_file,
+                                                                  report=self.report)
+                self._save(tmp_file, journal)
+        except Exception:
+            if journal is None:
+                shutil.rmtree(tmpdir_name, ignore_errors=True)
+            else:
+                self.logger.error('dump kept at {}, run `dbdust resume` to finish the upload'.format(tmp_file))
+            raise
+
+        shutil.rmtree(tmpdir_name, ignore_errors=True)
+        if journal is not None:
+            journal.delete()
+        self.report['job_duration'] = (datetime.datetime.utcnow() - start_date).total_seconds()
+        self._record()
+
+    def _rotate(self):
+        """ Rotate the backups of the job, unless the jobs are rotated together (`dbdust rotate -q`) """
+        if not self.storage_conf.rotate:
+            self.logger.info('rotation skipped')
+            return
+        self.storage_handler.rotate()
+        self.logger.info('rotation done successfully')
+
+    def _select_replicas(self):
+        """ Read the dump from the least loaded replica within the lag threshold (the segments are spread over
+        all of them), from the configured host if none
+        """
+        if not self.dump_conf.replicas:
+            return
+        self.sources = dbdust.replicas.select(self.logger, self.dump_conf.replicas, self.dump_conf.replica_status,
+                                              self.dump_conf.cli_conf, self.dump_conf.max_replica_lag)
+        if self.sources:
+            self.dump_conf = self.dump_conf._replace(cli_conf=dict(self.dump_conf.cli_conf, **self.sources[0]))
+        else:
+            self.logger.warning('replicas : no replica within {} seconds of lag, dump read from {}'.format(
+                self.dump_conf.max_replica_lag, self.dump_conf.cli_conf.get('host')))
+        self.report['source_host'] = self.dump_conf.cli_conf.get('host')
+
+    def _preflight(self, tmp_dir):
+        """ Check there is enough space for the dump before starting it
+
+        The dump size is estimated from the previous runs in the catalog or from the source
+        metadata. The first tmp dir with enough free space is used. If none, the dump is
+        streamed to the storage if supported.
+
+        :param tmp_dir: the configured tmp dir
+        :type tmp_dir: str
+        :raise Exception: if there is not enough space
+        :return: the tmp dir to use and whether the dump must be streamed to the storage
+        :rtype: tuple
+        """
+        estimate = self._estimate()
+        if estimate is None or not estimate.get('size'):
+            self.logger.info('pre-flight : no size estimate available, checks skipped')
+            return tmp_dir, False
+        required = int(estimate['size'] * self.preflight_conf.margin)
+        self.report['estimated_size'] = estimate['size']
+        self.logger.info('pre-flight : estimated dump size {} bytes, duration {} seconds'.format(
+            estimate['size'], estimate.get('duration')))
+
+        storage_impl = self.storage_handler.storage_impl
+        destination_free = storage_impl.free_space()
+        if destination_free is not None and destination_free < required:
+            raise Exception('pre-flight : {} bytes needed but only {} bytes free in storage'.format(
+                required, destination_free))
+
+        for candidate in [tmp_dir] + self.preflight_conf.fallback_tmp_dirs:
+            free = shutil.disk_usage(candidate).free
+            if free >= required:
+                if candidate != tmp_dir:
+                    self.logger.info('pre-flight : not enough space in {}, using {}'.format(tmp_dir, candidate))
+                return candidate, False
+            self.logger.debug('pre-flight : {} bytes needed but only {} bytes free in {}'.format(
+                required, free, candidate))
+
+        if storage_impl.supports_stream:
+            self.logger.info('pre-flight : not enough space in tmp dirs, dump streamed to storage')
+            return tmp_dir, True
+        raise Exception('pre-flight : {} bytes needed but not enough space in tmp dirs'.format(required))
+
+    def _estimate(self):
+        """ Estimate the size and duration of the dump
+
+        :return: dict with `size` and `duration` keys or None
+        :rtype: dict
+        """
+        if self.catalog is not None:
+            estimate = self.catalog.estimate(self.job)
+            if estimate is not None:
+                return estimate
+        if self.dump_conf.size_estimator is None:
+            return None
+        try:
+            return {'size': self.dump_conf.size_estimator(**self.dump_conf.cli_conf), 'duration': None}
+        except Exception as e:
+            self.logger.warning('pre-flight : source size estimation failed : {}'.format(str(e)))
+            return None
+
+    def _record(self):
+        """ Log the run report and add it to the catalog """
+        self.logger.info('run report : {}'.format(self.report))
+        if self.catalog is not None:
+            self.catalog.record(self.report)
+
+    def resume(self, journal):
+        """ Finish the storage task of a dump kept by a failed run
+
+        :param journal: the journal of the failed run
+        :type journal: dbdust.journal.UploadJournal
+        """
+        self.file_name = journal.state['file_name']
+        self.report = journal.state.get('report', self.report)
+        tmp_file = journal.state['tmp_file']
+        self.logger.info('resume storage of {}'.format(tmp_file))
+
+        self._save(tmp_file, journal)
+
+        shutil.rmtree(os.path.dirname(tmp_file), ignore_errors=True)
+        journal.delete()
+        self._record()
+
+    def _stream(self, tmp_dir, tmp_file):
+        """ Execute the dump task and send its output to the storage without a local dump file
+
+        If the dump fails, the partially stored file is removed.
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path (only used to create the pipe of the dump command)
+        :type tmp_file: str
+        """
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def store():
+            try:
+                with open(read_fd, 'rb') as stream:
+                    self.storage_handler.save_stream(stream, self.file_name)
+            except Exception as e:
+                errors.append(e)
+
+        store_thread = threading.Thread(target=store)
+        store_thread.start()
+        start_date = datetime.datetime.utcnow()
+        try:
+            # closing the write end ends the stream even if the dump fails before its pipeline runs
+            with open(write_fd, 'wb') as dest_file:
+                self._dump(tmp_dir, tmp_file, dest_file=dest_file)
+        except Exception:
+            store_thread.join()
+            try:
+                self.storage_handler.storage_impl.delete(self.file_name)
+            except Exception:
+                self.logger.warning('partially stored file {} could not be removed'.format(self.file_name))
+            if errors:
+                raise errors[0]
+            raise
+        store_thread.join()
+        if errors:
+            raise errors[0]
+        self.report['upload_duration'] = (datetime.datetime.utcnow() - start_date).total_seconds()
+        self.logger.info('file {} streamed to storage successfully'.format(self.file_name))
+
+    def _split(self, tmp_dir, tmp_file):
+        """ Execute the dump task and upload its output in parts while the dump is running
+
+        If the dump or an upload fails, the parts already stored are removed.
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path (the parts are written next to it)
+        :type tmp_file: str
+        """
+        writer = self.storage_handler.split_writer(tmp_file, self.storage_conf.split_size,
+                                                   self.storage_conf.split_uploads)
+        try:
+            self._dump(tmp_dir, tmp_file, dest_file=writer)
+            dump_end_date = datetime.datetime.utcnow()
+            manifest = writer.commit()
+        except Exception:
+            try:
+                writer.abort()
+            except Exception:
+                self.logger.warning('parts of {} could not be removed'.format(self.file_name))
+            raise
+        # uploads run during the dump, only the time spent after the end of the dump is left
+        self.report['upload_duration'] = (datetime.datetime.utcnow() - dump_end_date).total_seconds()
+        self.report['parts'] = len(manifest['parts'])
+        self.logger.info('file {} saved to storage in {} parts successfully'.format(
+            self.file_name, self.report['parts']))
+
+    def _dump_tables(self, tmp_dir, tmp_file):
+        """ Dump the changed tables only, the unchanged ones are shared with the previous backup
+
+        Each table is a part of the backup. The change indicators of each table are compared
+        to the ones recorded in the manifest of the previous backup : the part of an unchanged
+        table is not dumped again, the manifest refers to the part already stored.
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path (the parts are written next to it)
+        :type tmp_file: str
+        """
+        previous = self._previous_tables()
+        indicators = self.dump_conf.table_indicators(checksum=self.dump_conf.table_checksum,
+                                                     **self.dump_conf.cli_conf)
+        parts = {}
+        segments = []
+        for index, table in enumerate(sorted(indicators)):
+            part = previous.get(table)
+            if part is not None and self._table_unchanged(part['indicators'], indicators[table]):
+                self.logger.debug('table {} unchanged, {} reused'.format(table, part['file_name']))
+                parts[str(index)] = part
+            else:
+                segments.append({'index': index, 'settings': {'table': table},
+                                 'info': {'table': table, 'indicators': indicators[table]}})
+
+        checkpoint = dbdust.journal.SegmentJournal.create(tmp_dir, self.file_name, segments=segments, parts=parts,
+                                                          workers=1, flags={'tables': True}, report=self.report)
+        parts = self._dump_segments(tmp_dir, tmp_file, checkpoint)
+        dumped = len([part for part in parts if part['file_name'].startswith(self.file_name)])
+        self.report.update({'tables_dumped': dumped, 'tables_reused': len(parts) - dumped})
+        self.logger.info('file {} saved to storage, {} tables dumped, {} unchanged tables reused'.format(
+            self.file_name, dumped, len(parts) - dumped))
+
+    def _dump_ranges(self, tmp_dir, tmp_file):
+        """ Split the source in key ranges dumped concurrently, each range is a part of the backup
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path (the parts are written next to it)
+        :type tmp_file: str
+        """
+        ranges = self.dump_conf.key_ranges(self.dump_conf.key_range_count, **self.dump_conf.cli_conf)
+        segments = [{'index': index, 'settings': settings, 'info': {'range': settings}}
+                    for index, settings in enumerate(ranges)]
+        self.logger.info('{} key ranges dumped by {} workers'.format(
+            len(ranges), min(self.dump_conf.key_range_workers, len(ranges))))
+
+        checkpoint = dbdust.journal.SegmentJournal.create(tmp_dir, self.file_name, segments=segments, parts={},
+                                                          workers=self.dump_conf.key_range_workers,
+                                                          flags={'ranges': True}, report=self.report)
+        parts = self._dump_segments(tmp_dir, tmp_file, checkpoint)
+        self.logger.info('file {} saved to storage in {} key ranges'.format(self.file_name, len(parts)))
+
+    def resume_segments(self, tmp_dir, checkpoint):
+        """ Dump the segments not stored by a failed run and finish its backup
+
+        :param tmp_dir: the dbdust tmp dir
+        :type tmp_dir: str
+        :param checkpoint: the checkpoint of the failed run
+        :type checkpoint: dbdust.journal.SegmentJournal
+        """
+        self.file_name = checkpoint.state['file_name']
+        self.report = checkpoint.state.get('report', self.report)
+        self.logger.info('resume segments of {}, {} of {} stored'.format(
+            self.file_name, len(checkpoint.state['parts']),
+            len(checkpoint.state['parts']) + len(self._pending_segments(checkpoint))))
+
+        self._select_replicas()
+        tmpdir_name = tempfile.mkdtemp(None, 'dbdust-', tmp_dir)
+        try:
+            self._dump_segments(tmp_dir, os.path.join(tmpdir_name, self.file_name), checkpoint)
+        finally:
+            shutil.rmtree(tmpdir_name, ignore_errors=True)
+        self._rotate()
+        self._record()
+
+    @staticmethod
+    def _pending_segments(checkpoint):
+        return [segment for segment in checkpoint.state['segments']
+                if str(segment['index']) not in checkpoint.state['parts']]
+
+    def _dump_segments(self, tmp_dir, tmp_file, checkpoint):
+        """ Dump and store the segments not stored yet then store the manifest of the backup
+
+        Up to `workers` segments of the checkpoint are dumped at the same time, each one is
+        stored and recorded in the checkpoint as soon as it is dumped. If a segment still fails
+        after its retries, the segments not started are cancelled. The stored parts and the
+        checkpoint are kept for `dbdust resume` with `keep_failed_dump`, removed otherwise.
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path (the parts are written next to it)
+        :type tmp_file: str
+        :param checkpoint: the checkpoint of the backup
+        :type checkpoint: dbdust.journal.SegmentJournal
+        :return: the manifest parts of the backup
+        :rtype: dict[]
+        """
+        state = checkpoint.state
+        pending = self._pending_segments(checkpoint)
+        lock = threading.Lock()
+
+        def dump_segment(segment):
+            part = self._dump_segment(tmp_dir, tmp_file, segment)
+            with lock:
+                state['parts'][str(segment['index'])] = part
+                checkpoint.save()
+
+        start_date = datetime.datetime.utcnow()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(state['workers'], len(pending))))
+        try:
+            futures = [executor.submit(dump_segment, segment) for segment in pending]
+            concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                future.result()
+        except Exception:
+            executor.shutdown()
+            if self.keep_failed_dump:
+                self.logger.error('{} of {} segments of {} stored, run `dbdust resume` to dump the others'.format(
+                    len(state['parts']), len(state['parts']) + len(self._pending_segments(checkpoint)),
+                    self.file_name))
+            else:
+                self._delete_parts()
+                checkpoint.delete()
+            raise
+        executor.shutdown()
+
+        parts = [state['parts'][index] for index in sorted(state['parts'], key=int)]
+        self._save_manifest(tmp_file, parts, **state['flags'])
+        checkpoint.delete()
+
+        # the checksum of the last segment dumped is not the checksum of the backup
+        self.report.pop('sha256', None)
+        self.report.update({'dump_size': sum(part['size'] for part in parts
+                                             if part['file_name'].startswith(self.file_name)),
+                            'dump_duration': (datetime.datetime.utcnow() - start_date).total_seconds(),
+                            'parts': len(parts)})
+        return parts
+
+    def _dump_segment(self, tmp_dir, tmp_file, segment):
+        """ Dump and store a segment
+
+        :param segment: the segment (`index`, dump `settings` and manifest `info`)
+        :type segment: dict
+        :return: the manifest part of the segment
+        :rtype: dict
+        """
+        part_path = dbdust.storage.part_path(tmp_file, segment['index'])
+        cli_conf = dict(self.dump_conf.cli_conf)
+        if self.sources:
+            cli_conf.update(self.sources[segment['index'] % len(self.sources)])
+        cli_conf.update(segment['settings'])
+        self.logger.debug('segment {} : {} from {}'.format(segment['index'], segment['settings'],
+                                                           cli_conf.get('host')))
+
+        def dump_and_save():
+            self._dump(tmp_dir, part_path, cli_conf=cli_conf)
+            return self._save_part(part_path, **segment['info'])
+        return self._retry('segment {}'.format(segment['index']), part_path, dump_and_save)
 
-            self._dump(tmp_dir, tmp_file)
-            self._save(tmp_file)
+    def _retry(self, name, dump_path, func):
+        """ Call a function dumping to a file, retried with an exponential backoff
 
-    def _dump(self, tmp_dir, tmp_file):
+        :param name: name of the task in the logs
+        :type name: str
+        :param dump_path: file written by the function, removed before a retry
+        :type dump_path: str
+        :param func: the function
+        :type func: callable
+        :return: the result of the function
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if os.path.exists(dump_path):
+                    os.remove(dump_path)
+                if attempt >= self.dump_conf.segment_retries:
+                    raise
+                delay = self.dump_conf.segment_retry_delay * 2 ** attempt
+                attempt += 1
+                self.logger.warning('{} failed : {}, retry {} of {} in {} seconds'.format(
+                    name, str(e), attempt, self.dump_conf.segment_retries, delay))
+                time.sleep(delay)
+
+    def _dump_pack(self, tmp_dir, tmp_file):
+        """ Dump each database of `pack_databases` and write the dumps in a single pack file
+
+        :param tmp_dir: temp dir absolute path
+        :param tmp_file: temp file absolute path of the pack (the dumps are written next to it)
+        :type tmp_file: str
+        """
+        member_ext = self.dump_conf.file_ext[:-len(dbdust.pack.FILE_EXT) - 1]
+        writer = dbdust.pack.PackWriter(tmp_file, self._open_dump_file(tmp_file))
+        start_date = datetime.datetime.utcnow()
+        try:
+            for database in self.dump_conf.pack_databases:
+                name = '{}.{}'.format(database, member_ext)
+                member_path = os.path.join(os.path.dirname(tmp_file), name)
+                self._retry('database {}'.format(database), member_path, functools.partial(
+                    self._dump, tmp_dir, member_path, cli_conf=dict(self.dump_conf.cli_conf, database=database)))
+                writer.add(name, member_path, database=database)
+                os.remove(member_path)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+
+        # the report of the last database dumped is not the report of the pack
+        self.report.pop('sha256', None)
+        if self.dump_conf.checksum:
+            self.report['sha256'] = writer.sha256()
+        self.report.update({'dump_size': os.path.getsize(tmp_file),
+                            'dump_duration': (datetime.datetime.utcnow() - start_date).total_seconds(),
+                            'members': len(writer.members)})
+        self.logger.info('{} databases dumped in {}'.format(len(writer.members), self.file_name))
+
+    def _save_part(self, part_path, **info):
+        """ Store a part of the backup
+
+        :param part_path: the dumped part
+        :type part_path: str
+        :param info: information about the part kept in the manifest
+        :return: the manifest part
+        :rtype: dict
+        """
+        part_hash = hashlib.sha256()
+        with open(part_path, 'rb') as part_file:
+            for data in iter(lambda: part_file.read(1024 * 1024), b''):
+                part_hash.update(data)
+        part = dict(info, file_name=os.path.basename(part_path), size=os.path.getsize(part_path),
+                    sha256=part_hash.hexdigest())
+        self.storage_handler.save(part_path)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return part
+
+    def _save_manifest(self, tmp_file, parts, **flags):
+        """ Store the manifest of a backup made of parts
+
+        :param tmp_file: temp file absolute path (the manifest is written next to it)
+        :type tmp_file: str
+        :param parts: the manifest parts
+        :type parts: dict[]
+        :param flags: how the parts were made, kept in the manifest
+        """
+        manifest_path = '{}{}'.format(tmp_file, dbdust.storage.MANIFEST_SUFFIX)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(dict(flags, file_name=self.file_name, size=sum(part['size'] for part in parts), parts=parts),
+                      manifest_file)
+        self.storage_handler.save(manifest_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+    def _delete_parts(self):
+        """ Remove the parts of the backup already stored """
+        prefix = '{}.part'.format(self.file_name)
+        self.storage_handler.delete([item['id'] for item in self.storage_handler.storage_impl.list()
+                                     if item['file_name'].startswith(prefix)])
+
+    def _previous_tables(self):
+        """ Get the parts of the tables of the last backup dumped table by table
+
+        :return: the manifest part of each table
+        :rtype: dict
+        """
+        for item in self.storage_handler._get_sorted_backup_files_list():
+            if item.get('manifest') is None:
+                continue
+            manifest = self.storage_handler.read_manifest(item)
+            if manifest.get('tables'):
+                return {part['table']: part for part in manifest['parts']}
+        return {}
+
+    @staticmethod
+    def _table_unchanged(previous, current):
+        """ A table is unchanged if its indicators are the same and known (the update time is unknown for
+        some engines, ex : InnoDB after a restart)
+
+        Without checksum, the update time must also be before the time the previous indicators were
+        read : the update time has a one second granularity and the number of rows is an estimate, a
+        write in the second of the previous read would not change them.
+        """
+        if any(previous.get(key) != current.get(key) for key in ('update_time', 'rows', 'checksum')):
+            return False
+        if current.get('checksum') is not None:
+            return True
+        return (current.get('update_time') is not None and previous.get('read_at') is not None and
+                current['update_time'] < previous['read_at'])
+
+    def _dump(self, tmp_dir, tmp_file, dest_file=None, cli_conf=None):
         """ Execute the dump/backup task in the temporary file
 
         .. note:: the dump task must return a single file
@@ -211,32 +931,389 @@ class DbDustBackupHandler(object):
         :param tmp_dir: temp dir absolute path
         :param tmp_file: temp file absolute path
         :type tmp_file: str
+        :param dest_file: writable file object receiving the dump instead of the temporary file
+        :param cli_conf: settings of the dump command used instead of the ones of the dump config
+        :type cli_conf: dict
         """
-        dump_cli = self.dump_conf.cli_func(self.dump_conf.bin_path, self.dump_conf.zip_path, tmp_dir, tmp_file,
-                                           **self.dump_conf.cli_conf)
-        dump_cmd = ' '.join(dump_cli)
-        self.logger.debug('command : {}'.format(dump_cmd))
+        if self.dump_conf.native_dumper is not None:
+            self._dump_native(tmp_file, dest_file, cli_conf)
+            return
+
+        pipeline = self._build_pipeline(tmp_file, dest_file)
+        dump_path = pipeline.prepare() if pipeline is not None else tmp_file
+
+        try:
+            dump_cli = self.dump_conf.cli_func(self.dump_conf.bin_path, self.dump_conf.zip_path, tmp_dir, dump_path,
+                                               **(cli_conf if cli_conf is not None else self.dump_conf.cli_conf))
+            dump_cmd = ' '.join(dump_cli)
+            self.logger.debug('command : {}'.format(dump_cmd))
+
+            prefix = dbdust.throttle.priority_prefix(self.dump_conf.ionice_class, self.dump_conf.ionice_level)
+            preexec_fn = dbdust.throttle.priority_preexec_fn(self.dump_conf.nice, self.dump_conf.cgroup)
+
+            start_date = datetime.datetime.utcnow()
+            if prefix:
+                process = subprocess.Popen(prefix + ['/bin/sh', '-c', dump_cmd], stdin=sys.stdin, stdout=sys.stdout,
+                                           preexec_fn=preexec_fn)
+            else:
+                process = subprocess.Popen(dump_cmd, stdin=sys.stdin, stdout=sys.stdout, shell=True,
+                                           preexec_fn=preexec_fn)
+        except BaseException:
+            # the dump command is not started, the pipe is never consumed
+            if pipeline is not None:
+                pipeline.cleanup()
+            raise
+        returncode = pipeline.run(process) if pipeline is not None else process.wait()
+        if returncode != 0:
+            raise Exception('dump command exited with error code {}'.format(returncode))
+        end_date = datetime.datetime.utcnow()
+        self.logger.info('dump command executed successfully')
+        self._report_dump(tmp_file, dest_file, pipeline, start_date, end_date)
+
+    def _dump_native(self, tmp_file, dest_file=None, cli_conf=None):
+        """ Execute the dump in process with the native dumper of the dump config
+
+        :param tmp_file: temp file absolute path
+        :type tmp_file: str
+        :param dest_file: writable file object receiving the dump instead of the temporary file
+        :param cli_conf: settings of the dumper used instead of the ones of the dump config
+        :type cli_conf: dict
+        """
+        dumper = self.dump_conf.native_dumper(**(cli_conf if cli_conf is not None else self.dump_conf.cli_conf))
+        pipeline = self._build_pipeline(tmp_file, dest_file, force=True)
 
         start_date = datetime.datetime.utcnow()
-        dump_result = subprocess.run(dump_cmd, stdin=sys.stdin, stdout=sys.stdout, shell=True)
-        if dump_result.returncode != 0:
-            raise Exception('dump command exited with error code {}'.format(dump_result.returncode))
+        pipeline.consume(dumper.chunks())
         end_date = datetime.datetime.utcnow()
+        self.logger.info('native dump executed successfully')
+        self._report_dump(tmp_file, dest_file, pipeline, start_date, end_date)
 
-        self.logger.info('dump command executed successfully')
-        self.logger.debug('dump file size is {} bytes'.format(os.path.getsize(tmp_file)))
+    def _report_dump(self, tmp_file, dest_file, pipeline, start_date, end_date):
+        """ Add the size and the duration of the dump to the run report """
+        dump_size = os.path.getsize(tmp_file) if dest_file is None else pipeline.bytes_written
+        self.logger.debug('dump file size is {} bytes'.format(dump_size))
         self.logger.debug('dump executed in {} seconds'.format((end_date - start_date).total_seconds()))
+        self.report.update({'dump_size': dump_size, 'dump_duration': (end_date - start_date).total_seconds()})
+        if pipeline is not None:
+            self.report.update(pipeline.report())
+
+    def _report_page_cache(self, tmp_file, cached_before):
+        """ Add the page cache use of the dump to the run report
+
+        :param tmp_file: temp file absolute path
+        :type tmp_file: str
+        :param cached_before: size of the page cache of the host before the dump
+        :type cached_before: int
+        """
+        page_cache = {'io_mode': self.dump_conf.io_conf.mode, 'cached_before': cached_before,
+                      'cached_after': dbdust.cacheio.cached_bytes()}
+        residency = dbdust.cacheio.residency(tmp_file)
+        if residency is not None:
+            page_cache['dump_resident_pages'], page_cache['dump_pages'] = residency
+        self.logger.info('page cache : {} of {} pages of the dump cached, host cache from {} to {} bytes'.format(
+            page_cache.get('dump_resident_pages'), page_cache.get('dump_pages'), cached_before,
+            page_cache['cached_after']))
+        self.report['page_cache'] = page_cache
+
+    def _preallocation_size(self, tmp_file):
+        """ Expected size of a dump file, known for the whole backup only (not for its parts)
+
+        :param tmp_file: temp file absolute path
+        :type tmp_file: str
+        :rtype: int
+        """
+        if os.path.basename(tmp_file) != self.file_name:
+            return None
+        if 'estimated_size' in self.report:
+            return self.report['estimated_size']
+        if self.catalog is not None:
+            estimate = self.catalog.estimate(self.job)
+            return estimate['size'] if estimate is not None else None
+        return None
+
+    def _open_dump_file(self, tmp_file):
+        """ Open a dump file in the I/O mode of the dump config
+
+        :param tmp_file: temp file absolute path
+        :type tmp_file: str
+        :return: a writable file object
+        """
+        io_conf = self.dump_conf.io_conf
+        return dbdust.cacheio.open_writer(tmp_file, io_conf.mode, io_conf.sync_size,
+                                          self._preallocation_size(tmp_file))
+
+    def _build_pipeline(self, tmp_file, dest_file=None, force=False):
+        """ Build the in process pipeline if a setting needs dbdust to read the dump command output
+
+        :param tmp_file: temp file absolute path
+        :type tmp_file: str
+        :param dest_file: writable file object receiving the dump instead of the temporary file
+        :param force: build the pipeline even if no setting needs it
+        :type force: bool
+        :return: the pipeline or None if the dump command can write directly to the temp file
+        :rtype: dbdust.pipeline.DumpPipeline
+        """
+        stages = []
+        if self.dump_conf.codec is not None:
+            stages.append(dbdust.pipeline.CompressStage(self.dump_conf.codec, self.dump_conf.compression_level,
+                                                        self.dump_conf.compression_min_level,
+                                                        self.dump_conf.compression_max_level))
+        if self.dump_conf.encryption_key is not None:
+            stages.append(dbdust.crypto.EncryptStage(self.dump_conf.encryption_key,
+                                                     self.dump_conf.encryption_segment_size))
+        if self.dump_conf.checksum:
+            stages.append(dbdust.pipeline.ChecksumStage())
+        if dest_file is None and self.dump_conf.io_conf.mode != 'buffered':
+            # the dump command would write through the page cache
+            dest_file = self._open_dump_file(tmp_file)
+        if not stages and not self.dump_conf.read_rate and dest_file is None and not force:
+            return None
+        bucket = dbdust.throttle.get_shared_bucket('dump', self.dump_conf.read_rate)
+        chunk_size = self.dump_conf.chunk_size or dbdust.pipeline.DEFAULT_CHUNK_SIZE
+        buffers = None
+        if self.dump_conf.buffer_pool_size:
+            buffers = max(1, self.dump_conf.buffer_pool_size // chunk_size)
+        return dbdust.pipeline.DumpPipeline(tmp_file, bucket=bucket, chunk_size=chunk_size, stages=stages,
+                                            dest_file=dest_file,
+                                            pool=dbdust.pipeline.get_shared_pool(chunk_size, buffers))
 
-    def _save(self, tmp_file):
+    def _save(self, tmp_file, journal=None):
         """ Execute the storage task (store and rotate)
 
         :param tmp_file: temp file absolute path
         :type tmp_file: str
+        :param journal: journal persisting the progress of the storage task
+        :type journal: dbdust.journal.UploadJournal
         """
-        self.storage_handler.save(tmp_file)
+        start_date = datetime.datetime.utcnow()
+        if journal is None:
+            self.storage_handler.save(tmp_file)
+        elif not journal.state.get('stored'):
+            self.storage_handler.save(tmp_file, journal)
+            journal.update(stored=True)
+        self.report['upload_duration'] = (datetime.datetime.utcnow() - start_date).total_seconds()
         self.logger.info('file {} saved to storage successfully'.format(self.file_name))
-        self.storage_handler.rotate()
-        self.logger.info('rotation done successfully')
+        self._rotate()
+
+
+def execute(conf, command='backup', workers=None, input_path=None, output_path=None):
+    """ Run a dbdust command with a config
+
+    :param conf: config references for current dbdust process
+    :type conf: dbdust.admin.DbDustConfig
+    :param command: backup, resume, verify, decrypt or unpack
+    :type command: str
+    :param workers: max number of backups verified (or segments decrypted) at the same time
+    :type workers: int
+    :param input_path: encrypted file to decrypt, pack to extract
+    :type input_path: str
+    :param output_path: path of the decrypted file, directory of the extracted dumps
+    :type output_path: str
+    :raise Exception: if the command fails
+    :return: the exit code
+    :rtype: int
+    """
+    dump_type = conf.get('general', 'database')
+    if dump_type not in dbdust.dumper.dumper_config:
+        raise Exception('{} database not supported'.format(dump_type))
+
+    storage_type = conf.get('general', 'storage')
+    if storage_type not in dbdust.storage.StorageFactory.storage_list:
+        raise Exception('{} storage not supported'.format(storage_type))
+
+    storage_conf = get_storage_config(storage_type, conf)
+    tmp_dir = conf.get('general', 'tmp_dir', fallback=tempfile.gettempdir())
+    keep_failed_dump = conf.getboolean('general', 'keep_failed_dump', fallback=False)
+    catalog = get_catalog(conf)
+    preflight_conf = get_preflight_config(conf)
+    job = conf.get('general', 'job', fallback=None)
+
+    if command == 'decrypt':
+        if input_path is None or output_path is None:
+            raise Exception('decrypt needs an --input and an --output file')
+        dbdust.crypto.decrypt_file(input_path, output_path, get_decryption_keys(conf), workers)
+    elif command == 'unpack':
+        if input_path is None or output_path is None:
+            raise Exception('unpack needs an --input pack and an --output directory')
+        if os.path.exists(input_path):
+            paths = dbdust.pack.extract(input_path, output_path)
+        else:
+            paths = unpack_stored(create_storage_handler(storage_conf), input_path, output_path)
+        logger.info('{} dumps extracted to {}'.format(len(paths), output_path))
+    elif command == 'verify':
+        verifier = dbdust.verify.Verifier(logger, create_storage_handler(storage_conf),
+                                          dbdust.dumper.dumper_config[dump_type].get('dump_format'),
+                                          catalog, job or storage_conf.file_prefix, workers,
+                                          get_decryption_keys(conf))
+        if not all(result['ok'] for result in verifier.run()):
+            return 1
+    elif command == 'resume':
+        dump_conf = get_dump_config(dump_type, conf)
+        for journal in dbdust.journal.UploadJournal.list(tmp_dir):
+            backup_handler = DbDustBackupHandler(logger, dump_conf, storage_conf, keep_failed_dump, catalog,
+                                                 preflight_conf, job)
+            backup_handler.resume(journal)
+        for checkpoint in dbdust.journal.SegmentJournal.list(tmp_dir):
+            backup_handler = DbDustBackupHandler(logger, dump_conf, storage_conf, keep_failed_dump, catalog,
+                                                 preflight_conf, job)
+            backup_handler.resume_segments(tmp_dir, checkpoint)
+    elif dbdust.dumper.dumper_config[dump_type].get('continuous') is not None:
+        streamer_class = dbdust.continuous.STREAMERS[dbdust.dumper.dumper_config[dump_type]['continuous']]
+        streamer = streamer_class(logger, get_dump_config(dump_type, conf), create_storage_handler(storage_conf),
+                                  tmp_dir, conf.get('general', 'segment_duration', fallback=None),
+                                  conf.get('general', 'full_backup_prefix', fallback=None), job)
+        streamer.run()
+    else:
+        dump_conf = get_dump_config(dump_type, conf)
+        backup_handler = DbDustBackupHandler(logger, dump_conf, storage_conf, keep_failed_dump, catalog,
+                                             preflight_conf, job)
+        backup_handler.process(tmp_dir)
+    return 0
+
+
+def unpack_stored(storage_handler, file_name, output_dir):
+    """ Extract the members of a stored pack, each member is read by range
+
+    :param storage_handler: the storage handler of the job
+    :type storage_handler: dbdust.storage.StorageHandler
+    :param file_name: name of the stored pack
+    :type file_name: str
+    :param output_dir: the directory the members are written to
+    :type output_dir: str
+    :return: the paths of the extracted members
+    :rtype: str[]
+    """
+    items = [item for item in storage_handler._get_sorted_backup_files_list() if item['file_name'] == file_name]
+    if not items:
+        raise Exception('{} not found in the storage'.format(file_name))
+    paths = []
+    for member in storage_handler.read_pack_index(items[0]):
+        path = os.path.join(output_dir, os.path.basename(member['name']))
+        with open(path, 'wb') as member_file:
+            member_file.write(storage_handler.read_member(items[0], member['name']))
+        paths.append(path)
+    return paths
+
+
+def get_catalog(conf):
+    """ Get the catalog of a config (`general/catalog`, default to `dbdust-catalog.jsonl` in the tmp dir)
+
+    :param conf: config references for current dbdust process
+    :type conf: dbdust.admin.DbDustConfig
+    :rtype: dbdust.catalog.Catalog
+    """
+    tmp_dir = conf.get('general', 'tmp_dir', fallback=tempfile.gettempdir())
+    return dbdust.catalog.Catalog(conf.get('general', 'catalog',
+                                           fallback=os.path.join(tmp_dir, 'dbdust-catalog.jsonl')))
+
+
+def run_queued_job(config_path):
+    """ Run the backup of a job taken from the work queue
+
+    :param config_path: the config file of the job
+    :type config_path: str
+    :raise Exception: if the backup fails
+    """
+    conf = DbDustConfig(config_path)
+    dump_type = conf.get('general', 'database')
+    if dbdust.dumper.dumper_config.get(dump_type, {}).get('continuous') is not None:
+        raise Exception('{} is a continuous source and can not be queued'.format(dump_type))
+    execute(conf)
+
+
+def estimate_queued_job(config_path):
+    """ Expected dump size and duration of a job taken from the work queue, from its catalog
+
+    :param config_path: the config file of the job
+    :type config_path: str
+    :return: dict with `size` (bytes), `duration` (seconds) and the database `host` (None when unknown)
+    :rtype: dict
+    """
+    conf = DbDustConfig(config_path)
+    job = conf.get('general', 'job', fallback=None) or conf.get('general', 'file_prefix', fallback='backup-')
+    catalog = get_catalog(conf)
+    estimate = catalog.estimate(job)
+    dump_type = conf.get('general', 'database', fallback=None)
+    host = None
+    if dump_type is not None and conf.has_section(dump_type):
+        host = conf.get(dump_type, 'host', fallback=None) or conf.get(dump_type, 'uri', fallback=None)
+    return {'size': estimate['size'] if estimate is not None else None,
+            'duration': catalog.expected_duration(job), 'host': host}
+
+
+def run_worker(conf, queue_path, slots=None):
+    """ Run the jobs of a shared work queue until it is empty
+
+    :param conf: config references for current dbdust process
+    :type conf: dbdust.admin.DbDustConfig
+    :param queue_path: the queue directory (default to `general/queue`)
+    :type queue_path: str
+    :param slots: number of jobs run at the same time by this worker
+    :type slots: int
+    :return: the exit code
+    :rtype: int
+    """
+    queue_path = queue_path or conf.get('general', 'queue', fallback=None)
+    if queue_path is None:
+        raise Exception('worker needs a --queue directory')
+    queue = dbdust.workqueue.WorkQueue(queue_path, conf.get('general', 'lease_duration', fallback=None))
+    host_limit = conf.get('general', 'max_jobs_per_host', fallback=None)
+    window = conf.get('general', 'backup_window', fallback=None)
+    worker = dbdust.workqueue.Worker(logger, queue, run_queued_job, estimate_queued_job, slots,
+                                     host_limit=int(host_limit) if host_limit is not None else None,
+                                     window=float(window) if window is not None else None)
+    failed = worker.run()
+    if failed:
+        logger.error('queue : {} failed'.format(', '.join(failed)))
+        return 1
+    return 0
+
+
+def rotate_jobs(configs):
+    """ Rotate the backups of several jobs, a storage location shared by several jobs is listed once
+
+    :param configs: config references of the jobs
+    :type configs: dbdust.admin.DbDustConfig[]
+    :return: the number of files deleted
+    :rtype: int
+    """
+    locations = collections.OrderedDict()
+    for conf in configs:
+        storage_type = conf.get('general', 'storage')
+        if storage_type not in dbdust.storage.StorageFactory.storage_list:
+            raise Exception('{} storage not supported'.format(storage_type))
+        storage_conf = get_storage_config(storage_type, conf)
+        location = (storage_type, tuple(sorted(storage_conf.impl_conf.items())))
+        locations.setdefault(location, []).append(storage_conf)
+    deleted = 0
+    for storage_confs in locations.values():
+        storage_handler = create_storage_handler(storage_confs[0])
+        handlers = [storage_handler] + [
+            dbdust.storage.StorageHandler(storage_handler.storage_impl, storage_conf.file_prefix,
+                                          storage_conf.date_format, **storage_conf.retain_conf)
+            for storage_conf in storage_confs[1:]]
+        deleted += dbdust.rotation.RotationCoordinator(logger, handlers).run()
+    return deleted
+
+
+def run_rotation(conf, queue_path=None):
+    """ Rotate the backups of the job, or of all the jobs of a work queue
+
+    :param conf: config references for current dbdust process
+    :type conf: dbdust.admin.DbDustConfig
+    :param queue_path: the queue directory (default to `general/queue`), its waiting and finished jobs are rotated
+    :type queue_path: str
+    :return: the exit code
+    :rtype: int
+    """
+    queue_path = queue_path or conf.get('general', 'queue', fallback=None)
+    configs = [conf]
+    if queue_path is not None:
+        configs = [DbDustConfig(config_path)
+                   for config_path in dbdust.workqueue.WorkQueue(queue_path).configs().values()]
+    deleted = rotate_jobs(configs)
+    logger.info('rotation : {} files deleted for {} jobs'.format(deleted, len(configs)))
+    return 0
 
 
 def run(*args, **kwargs):
@@ -258,21 +1335,12 @@ def run(*args, **kwargs):
     logger.info('start')
 
     try:
-
-        dump_type = conf.get('general', 'database')
-        if dump_type not in dbdust.dumper.dumper_config:
-            raise Exception('{} database not supported'.format(dump_type))
-
-        storage_type = conf.get('general', 'storage')
-        if storage_type not in dbdust.storage.StorageFactory.storage_list:
-            raise Exception('{} storage not supported'.format(storage_type))
-
-        dump_conf = get_dump_config(dump_type, conf)
-        storage_conf = get_storage_config(storage_type, conf)
-        tmp_dir = conf.get('general', 'tmp_dir', fallback=tempfile.gettempdir())
-
-        backup_handler = DbDustBackupHandler(logger, dump_conf, storage_conf)
-        backup_handler.process(tmp_dir)
+        if args.command == 'worker':
+            exit_code = run_worker(conf, args.queue, args.workers)
+        elif args.command == 'rotate':
+            exit_code = run_rotation(conf, args.queue)
+        else:
+            exit_code = execute(conf, args.command, args.workers, args.input, args.output)
 
     except configparser.Error as e:
         logger.error("configuration error : {}".format(str(e)))
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" File I/O keeping the backups out of the page cache of the database host
+
+Writing a large dump through the page cache evicts the hot pages of the database. In
+the `nocache` mode, the ranges written are flushed with `sync_file_range` and dropped
+with `posix_fadvise(DONTNEED)` every `sync_size` bytes, the ranges read are dropped the
+same way. The `direct` mode writes with `O_DIRECT` from an aligned buffer so the dump
+does not go through the page cache at all.
+
+The page cache calls are Linux ones, elsewhere the files are written as usual.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import io
+import mmap
+import os
+
+#: I/O modes (`buffered` is the usual page cache behaviour)
+IO_MODES = ('buffered', 'nocache', 'direct')
+
+#: default number of bytes written (or read) between two flushes of the page cache
+DEFAULT_SYNC_SIZE = 8 * 1024 * 1024
+
+#: alignment of the offsets, sizes and buffers of the `O_DIRECT` writes
+ALIGNMENT = 4096
+
+#: size of the mappings used to measure the page cache residency of a file
+RESIDENCY_WINDOW = 1024 * 1024 * 1024
+
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:  # pragma: no cover - no C library available
+    _libc = None
+
+
+def _libc_function(name, argtypes):
+    """ Get a function of the C library, None if the platform does not have it """
+    function = getattr(_libc, name, None) if _libc is not None else None
+    if function is not None:
+        function.argtypes = argtypes
+        function.restype = ctypes.c_int
+    return function
+
+
+_sync_file_range = _libc_function('sync_file_range', [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint])
+_fallocate = _libc_function('fallocate64', [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64])
+_mincore = _libc_function('mincore', [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)])
+
+
+def _check(result):
+    if result != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def sync_range(fd, offset, size):
+    """ Write the dirty pages of a range of a file and wait for the end of the writes
+
+    `fdatasync` is used where `sync_file_range` is not available.
+
+    :param fd: file descriptor
+    :type fd: int
+    :param offset: start of the range
+    :type offset: int
+    :param size: size of the range
+    :type size: int
+    """
+    if _sync_file_range is None:
+        os.fdatasync(fd)
+        return
+    _check(_sync_file_range(fd, offset, size, SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE |
+                            SYNC_FILE_RANGE_WAIT_AFTER))
+
+
+def drop_cache(fd, offset=0, size=0):
+    """ Drop the clean pages of a range of a file from the page cache (all the file if size is 0)
+
+    :param fd: file descriptor
+    :type fd: int
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, size, os.POSIX_FADV_DONTNEED)
+
+
+def preallocate(fd, size):
+    """ Allocate the blocks of a file, so it is written in as few extents as possible
+
+    Unlike `posix_fallocate`, nothing is written when the filesystem does not support it.
+
+    :param fd: file descriptor
+    :type fd: int
+    :param size: expected size of the file, the file size is set to it
+    :type size: int
+    :return: False if the filesystem (or the platform) does not support it or has not enough space
+    :rtype: bool
+    """
+    if _fallocate is None or size <= 0:
+        return False
+    try:
+        _check(_fallocate(fd, 0, 0, size))
+    except OSError:
+        return False
+    return True
+
+
+class NoCacheWriter(io.FileIO):
+    """ File written without keeping its pages in the page cache
+
+    :param path: path of the file
+    :type path: str
+    :param mode: `wb` or `ab`
+    :type mode: str
+    :param direct: write with `O_DIRECT` (`wb` mode only, ignored if the filesystem does not support it)
+    :type direct: bool
+    :param sync_size: number of bytes written between two flushes of the page cache
+    :type sync_size: int
+    :param preallocate_size: expected size of the file, its blocks are allocated when the file is opened
+        (`wb` mode only) and the file is truncated to the size written when closed
+    :type preallocate_size: int
+    """
+
+    def __init__(self, path, mode='wb', direct=False, sync_size=DEFAULT_SYNC_SIZE, preallocate_size=None):
+        self.direct = direct and mode == 'wb' and hasattr(os, 'O_DIRECT')
+        self.sync_size = max(sync_size or DEFAULT_SYNC_SIZE, ALIGNMENT)
+        self.staging = None
+        super(NoCacheWriter, self).__init__(path, mode, opener=self._open)
+        self.synced = self.position = self.tell()
+        self.preallocated = False
+        if preallocate_size and mode == 'wb':
+            self.preallocated = preallocate(self.fileno(), preallocate_size)
+        if self.direct:
+            # anonymous mappings are page aligned, as needed by O_DIRECT
+            self.staging = mmap.mmap(-1, self.sync_size - self.sync_size % ALIGNMENT)
+            self.staged = 0
+
+    def _open(self, path, flags):
+        if self.direct:
+            try:
+                return os.open(path, flags | os.O_DIRECT, 0o666)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                self.direct = False
+        return os.open(path, flags, 0o666)
+
+    def write(self, data):
+        with memoryview(data) as view, view.cast('B') as view:
+            size = len(view)
+            if self.direct:
+                self._stage(view)
+            else:
+                self._write_all(view)
+        return size
+
+    def _stage(self, view):
+        """ Copy the data in the aligned buffer, written once full """
+        with memoryview(self.staging) as staging:
+            while len(view):
+                count = min(len(view), len(staging) - self.staged)
+                staging[self.staged:self.staged + count] = view[:count]
+                self.staged += count
+                view = view[count:]
+                if self.staged == len(staging):
+                    self._write_all(staging)
+                    self.staged = 0
+
+    def _write_all(self, view):
+        while len(view):
+            count = super(NoCacheWriter, self).write(view)
+            view = view[count:]
+            self.position += count
+        if self.position - self.synced >= self.sync_size:
+            self._sync()
+
+    def truncate(self, size=None):
+        size = super(NoCacheWriter, self).truncate(size)
+        # the next writes of the `ab` mode go to the new end of the file
+        self.synced = self.position = self.seek(0, os.SEEK_END)
+        return size
+
+    def _sync(self):
+        """ Flush the range written since the last flush and drop it from the page cache """
+        if self.position > self.synced:
+            sync_range(self.fileno(), self.synced, self.position - self.synced)
+            drop_cache(self.fileno(), self.synced, self.position - self.synced)
+            self.synced = self.position
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.staging is not None and self.staged:
+                with memoryview(self.staging) as staging:
+                    aligned = self.staged - self.staged % ALIGNMENT
+                    self._write_all(staging[:aligned])
+                    # the tail is not a multiple of the alignment
+                    fcntl.fcntl(self.fileno(), fcntl.F_SETFL, fcntl.fcntl(self.fileno(), fcntl.F_GETFL) & ~os.O_DIRECT)
+                    self._write_all(staging[aligned:self.staged])
+                self.staged = 0
+            self._sync()
+            if self.preallocated:
+                os.ftruncate(self.fileno(), self.position)
+        finally:
+            if self.staging is not None:
+                self.staging.close()
+            super(NoCacheWriter, self).close()
+
+
+class NoCacheReader(io.FileIO):
+    """ File read without keeping its pages in the page cache
+
+    :param path: path of the file
+    :type path: str
+    :param sync_size: number of bytes read between two drops of the page cache
+    :type sync_size: int
+    """
+
+    def __init__(self, path, sync_size=DEFAULT_SYNC_SIZE):
+        super(NoCacheReader, self).__init__(path, 'rb')
+        self.sync_size = sync_size or DEFAULT_SYNC_SIZE
+        self.dropped = self.read_end = 0
+
+    def read(self, size=-1):
+        start = self.tell()
+        data = super(NoCacheReader, self).read(size)
+        self._account(start, len(data) if data else 0)
+        return data
+
+    def readinto(self, buffer):
+        start = self.tell()
+        count = super(NoCacheReader, self).readinto(buffer)
+        self._account(start, count or 0)
+        return count
+
+    def _account(self, start, count):
+        """ Record a range read, the pending range is dropped when the reads are not contiguous """
+        if start != self.read_end:
+            self._drop()
+            self.dropped = start
+        self.read_end = start + count
+        if self.read_end - self.dropped >= self.sync_size:
+            self._drop()
+
+    def _drop(self):
+        if self.read_end > self.dropped:
+            drop_cache(self.fileno(), self.dropped, self.read_end - self.dropped)
+        self.dropped = self.read_end
+
+    def close(self):
+        if not self.closed:
+            self._drop()
+        super(NoCacheReader, self).close()
+
+
+def open_writer(path, io_mode='buffered', sync_size=None, preallocate_size=None, mode='wb'):
+    """ Open a file for writing in an I/O mode
+
+    :param path: path of the file
+    :type path: str
+    :param io_mode: one of :data:`IO_MODES`
+    :type io_mode: str
+    :param sync_size: number of bytes written between two flushes of the page cache
+    :type sync_size: int
+    :param preallocate_size: expected size of the file
+    :type preallocate_size: int
+    :param mode: `wb` or `ab`
+    :type mode: str
+    :return: a writable file object
+    """
+    if io_mode in (None, 'buffered'):
+        return open(path, mode)
+    return NoCacheWriter(path, mode, direct=io_mode == 'direct', sync_size=sync_size,
+                         preallocate_size=preallocate_size)
+
+
+def open_reader(path, io_mode='buffered', sync_size=None):
+    """ Open a file for reading in an I/O mode (`direct` reads as `nocache`)
+
+    :param path: path of the file
+    :type path: str
+    :param io_mode: one of :data:`IO_MODES`
+    :type io_mode: str
+    :param sync_size: number of bytes read between two drops of the page cache
+    :type sync_size: int
+    :return: a readable file object
+    """
+    if io_mode in (None, 'buffered'):
+        return open(path, 'rb')
+    return NoCacheReader(path, sync_size=sync_size)
+
+
+def residency(path):
+    """ Measure the pages of a file in the page cache with `mincore`
+
+    :param path: path of the file
+    :type path: str
+    :return: the number of pages of the file in the page cache and the number of pages of the file,
+        None if the platform can not measure it
+    :rtype: tuple
+    """
+    if _mincore is None:
+        return None
+    resident = pages = 0
+    with open(path, 'rb') as fileobj:
+        size = os.fstat(fileobj.fileno()).st_size
+        for offset in range(0, size, RESIDENCY_WINDOW):
+            length = min(RESIDENCY_WINDOW, size - offset)
+            window_pages = (length + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vector = (ctypes.c_ubyte * window_pages)()
+            # a private mapping is writable, as needed to get its address, and is never written
+            with mmap.mmap(fileobj.fileno(), length, offset=offset, access=mmap.ACCESS_COPY) as mapping:
+                anchor = ctypes.c_char.from_buffer(mapping)
+                try:
+                    _check(_mincore(ctypes.addressof(anchor), length, vector))
+                finally:
+                    del anchor
+            # only the lowest bit of each page is defined
+            resident += window_pages - bytes(page & 1 for page in vector).count(0)
+            pages += window_pages
+    return resident, pages
+
+
+def cached_bytes():
+    """ Size of the page cache of the host (`Cached` of `/proc/meminfo`)
+
+    :return: the size in bytes or None if not available
+    :rtype: int
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('Cached:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
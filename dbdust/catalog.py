@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" History of the backups done by dbdust used to estimate the next ones """
+
+import datetime
+import json
+import os
+
+
+class Catalog(object):
+    """ Catalog of the run reports, stored as one json document per line
+
+    Each line is appended with a single write so several dbdust processes can share
+    the same catalog file.
+
+    :param path: path of the catalog file
+    :type path: str
+    """
+
+    #: number of previous runs used to estimate the next one
+    ESTIMATE_SAMPLES = 5
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, report):
+        """ Append a run report to the catalog
+
+        :param report: the run report (must have a `job` key)
+        :type report: dict
+        """
+        entry = dict(report)
+        entry.setdefault('date', datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'))
+        line = '{}\n'.format(json.dumps(entry, sort_keys=True)).encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def history(self, job):
+        """ Get the reports of a job, oldest first
+
+        :param job: job name
+        :type job: str
+        :rtype: dict[]
+        """
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path) as catalog_file:
+            for line in catalog_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('job') == job:
+                    entries.append(entry)
+        return entries
+
+    def estimate(self, job):
+        """ Estimate size and duration of the next run of a job from its last runs
+
+        The size is the max of the last sizes (to be safe when the database grows),
+        the duration the mean of the last durations.
+
+        :param job: job name
+        :type job: str
+        :return: dict with `size` (bytes) and `duration` (seconds) keys or None without history
+        :rtype: dict
+        """
+        entries = [e for e in self.history(job) if e.get('dump_size') is not None][-self.ESTIMATE_SAMPLES:]
+        if not entries:
+            return None
+        durations = [e['dump_duration'] for e in entries if e.get('dump_duration') is not None]
+        return {'size': max(e['dump_size'] for e in entries),
+                'duration': sum(durations) / len(durations) if durations else None}
+
+    def expected_duration(self, job):
+        """ Expected duration of the next run of a job (dump and upload) from its last runs
+
+        :param job: job name
+        :type job: str
+        :return: the mean duration in seconds of the last runs or None without history
+        :rtype: float
+        """
+        durations = []
+        for entry in self.history(job):
+            if entry.get('job_duration') is not None:
+                durations.append(entry['job_duration'])
+            elif entry.get('dump_duration') is not None:
+                durations.append(entry['dump_duration'] + (entry.get('upload_duration') or 0))
+        durations = durations[-self.ESTIMATE_SAMPLES:]
+        return sum(durations) / len(durations) if durations else None
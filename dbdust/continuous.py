@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Long running sources shipping the changes of a database in time bounded segments """
+
+import datetime
+import gzip
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import bson
+    import pymongo
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+    from bson.timestamp import Timestamp
+except ImportError:  # pragma: no cover - optional dependency
+    pymongo = None
+
+import dbdust.dumper
+from dbdust.storage import StorageHandler
+
+#: size of the reads from the spooled files
+READ_SIZE = 8 * 1024 * 1024
+
+
+class ContinuousStreamer(object):
+    """ Base class of the long running sources
+
+    The source runs until SIGTERM or SIGINT. Every `segment_duration` seconds the new data is
+    compressed into a segment stored with the job file prefix and the date of the segment, then
+    the segments not needed anymore to replay the changes on top of the oldest full backup
+    are removed.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param dump_conf: a named tuple of all settings for the source
+    :type dump_conf: collections.namedtuple
+    :param storage_handler: the storage handler of the job
+    :type storage_handler: dbdust.storage.StorageHandler
+    :param tmp_dir: directory of the state file and the local spool
+    :type tmp_dir: str
+    :param segment_duration: max number of seconds of changes in a segment
+    :type segment_duration: int
+    :param full_backup_prefix: file prefix of the full backups in the same storage (no rotation if None)
+    :type full_backup_prefix: str
+    :param job: name of the job
+    :type job: str
+    """
+
+    #: seconds between two checks of the source process
+    POLL_INTERVAL = 1
+    #: seconds to wait before restarting a source process which exited
+    RESTART_DELAY = 10
+    #: default max number of seconds of changes in a segment
+    DEFAULT_SEGMENT_DURATION = 300
+
+    def __init__(self, logger, dump_conf, storage_handler, tmp_dir, segment_duration=None, full_backup_prefix=None,
+                 job=None):
+        self.logger = logger
+        self.dump_conf = dump_conf
+        self.storage_handler = storage_handler
+        self.segment_duration = int(segment_duration or self.DEFAULT_SEGMENT_DURATION)
+        self.full_backup_prefix = full_backup_prefix
+        self.job = job or storage_handler.file_prefix
+        self.spool_dir = os.path.join(tmp_dir, 'dbdust-{}-{}'.format(dump_conf.type, self.job))
+        self.state_path = '{}.state'.format(self.spool_dir)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.state = self._load_state()
+        self.process = None
+        self.started = False
+        self.stopping = threading.Event()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as state_file:
+            return json.load(state_file)
+
+    def _save_state(self):
+        """ Persist the position of the last stored segment (written to a temporary file then renamed) """
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.state, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def stop(self, *args):
+        """ Ask the streamer to store the last segment and exit """
+        self.stopping.set()
+
+    def run(self):
+        """ Run the source until stopped """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        segment_start = time.monotonic()
+        failed = True
+        try:
+            while not self.stopping.is_set():
+                if not self.source_alive():
+                    self._restart()
+                self.stopping.wait(self.POLL_INTERVAL)
+                if time.monotonic() - segment_start >= self.segment_duration:
+                    self.ship()
+                    self.rotate()
+                    segment_start = time.monotonic()
+            failed = False
+        finally:
+            self.stop_source()
+            # after an error, the data received is left to the next run : shipping it again could hide the error
+            if not failed:
+                self.ship()
+
+    def _restart(self):
+        """ Start the source, waiting `RESTART_DELAY` seconds if it stopped """
+        if self.started:
+            self.logger.error('{} stopped ({}), restarted in {} seconds'.format(
+                self.dump_conf.type, self.source_exit_reason(), self.RESTART_DELAY))
+            if self.stopping.wait(self.RESTART_DELAY):
+                return
+            # the data received before the exit is stored before the source starts again
+            self.ship()
+        self.start_source()
+        self.started = True
+
+    def start_source(self):
+        """ Start the process reading the changes of the database (default to the command of :meth:`build_cli`) """
+        cmd = self.build_cli()
+        self.logger.debug('command : {}'.format(' '.join(cmd)))
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=sys.stdout, cwd=self.spool_dir)
+
+    def source_alive(self):
+        """ Whether the source is running
+
+        :rtype: bool
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def source_exit_reason(self):
+        """ Description of the reason the source stopped, for the logs
+
+        :rtype: str
+        """
+        return 'exit code {}'.format(self.process.returncode)
+
+    def stop_source(self):
+        """ Stop the source """
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def build_cli(self):
+        """ Build the command of the source process
+
+        :rtype: list
+        """
+        raise NotImplementedError()
+
+    def ship(self):
+        """ Store the data received since the last segment """
+        raise NotImplementedError()
+
+    def store_segment(self, chunks, name):
+        """ Compress chunks of data into a segment and store it
+
+        :param chunks: iterable of bytes
+        :param name: segment name, appended to the file prefix and the date
+        :type name: str
+        :return: the stored segment size
+        :rtype: int
+        """
+        file_name = '{}{}.{}.{}'.format(self.storage_handler.file_prefix,
+                                        datetime.datetime.utcnow().strftime(self.storage_handler.date_format),
+                                        name, self.dump_conf.file_ext)
+        segment_path = os.path.join(self.spool_dir, file_name)
+        try:
+            with open(segment_path, 'wb') as segment_file:
+                for chunk in chunks:
+                    # each chunk is an independent gzip member, the segment is readable by gunzip
+                    segment_file.write(gzip.compress(chunk))
+            size = os.path.getsize(segment_path)
+            self.storage_handler.save(segment_path)
+        finally:
+            if os.path.exists(segment_path):
+                os.remove(segment_path)
+        self.logger.info('segment {} stored ({} bytes)'.format(file_name, size))
+        return size
+
+    def segment_group(self, name):
+        """ Key of the segments only replayable together (default to the segment itself)
+
+        :param name: segment name, without the file prefix, the date and the extension
+        :type name: str
+        :rtype: str
+        """
+        return name
+
+    def _segment_name(self, file_name):
+        name = file_name[len(self.storage_handler.file_prefix):].split('.', 1)[1]
+        return name[:-len(self.dump_conf.file_ext) - 1]
+
+    def rotate(self):
+        """ Remove the segments older than the oldest full backup
+
+        The last segment started before the oldest full backup is kept as it may contain
+        changes done after the full backup started. The segments of a group (see
+        :meth:`segment_group`) are only removed if none of them is kept.
+        """
+        if self.full_backup_prefix is None:
+            return
+        full_handler = StorageHandler(self.storage_handler.storage_impl, self.full_backup_prefix,
+                                      self.storage_handler.date_format, 0, 0, 0, 0)
+        full_backups = full_handler._get_sorted_backup_files_list()
+        if not full_backups:
+            return
+        oldest_full_date = full_backups[-1]['date']
+        segments = self.storage_handler._get_sorted_backup_files_list()
+        # the segments are sorted newest first, the expired ones are at the end
+        expired = [item for item in segments if item['date'] < oldest_full_date][1:]
+        kept_groups = set(self.segment_group(self._segment_name(item['file_name']))
+                          for item in segments[:len(segments) - len(expired)])
+        to_delete = []
+        for item in expired:
+            if self.segment_group(self._segment_name(item['file_name'])) not in kept_groups:
+                to_delete.extend(item.get('ids', [item['id']]))
+        self.storage_handler.delete(to_delete)
+
+
+class BinlogStreamer(ContinuousStreamer):
+    """ Stream the binary logs of a mysql server with `mysqlbinlog --raw --stop-never`
+
+    mysqlbinlog writes the binary log files in a local spool directory. Each segment holds
+    the bytes appended to a binary log file since the previous segment, its name has the
+    binary log file name and the offset of the first byte (concatenating the segments of a
+    binary log file in offset order and decompressing them gives the binary log file). A
+    spooled file is removed once it is stored and the server moved to the next one.
+    """
+
+    def build_cli(self):
+        binlog_file = self.state.get('binlog_file') or self.dump_conf.cli_conf.get('start_file')
+        if binlog_file is None:
+            binlog_file = dbdust.dumper.dumper_config[self.dump_conf.type]['current_position'](
+                **self.dump_conf.cli_conf)
+        if 'binlog_file' not in self.state:
+            self.state = {'binlog_file': binlog_file, 'offset': 0}
+            self._save_state()
+        cli_conf = dict(self.dump_conf.cli_conf, start_file=binlog_file)
+        return self.dump_conf.cli_func(self.dump_conf.bin_path, self.dump_conf.zip_path, self.spool_dir, None,
+                                       **cli_conf)
+
+    def segment_group(self, name):
+        # the segments of a binary log file are only replayable together (the first one has the format
+        # description event)
+        return name.rsplit('.', 1)[0]
+
+    def _spooled_files(self):
+        """ Binary log files in the spool, oldest first (the server numbers them in sequence) """
+        return sorted(name for name in os.listdir(self.spool_dir)
+                      if not name.startswith(self.storage_handler.file_prefix))
+
+    def ship(self):
+        if 'binlog_file' not in self.state:
+            return
+        files = self._spooled_files()
+        for name in files:
+            path = os.path.join(self.spool_dir, name)
+            if name < self.state['binlog_file']:
+                os.remove(path)
+                continue
+            if name != self.state['binlog_file']:
+                # the previous file was completely stored
+                self.state = {'binlog_file': name, 'offset': 0}
+                self._save_state()
+            size = os.path.getsize(path)
+            offset = self.state['offset']
+            if size > offset:
+                self.store_segment(read_range(path, offset, size), '{}.{:012d}'.format(name, offset))
+                self.state['offset'] = size
+                self._save_state()
+            if name != files[-1]:
+                os.remove(path)
+
+
+class OplogStreamer(ContinuousStreamer):
+    """ Tail the oplog of a mongo replica set member with a tailable cursor
+
+    A thread appends the raw bson oplog entries to a spool file. Each segment holds the entries
+    received since the previous segment, in the `oplog.bson` format of `mongodump --oplog` (a
+    decompressed segment can be replayed with `mongorestore --oplogReplay`). Its name has the
+    timestamp of its first entry. The timestamp of the last stored entry is saved so a
+    restarted dbdust tails the oplog from this entry (entries received but not stored are
+    read again from the server).
+    """
+
+    #: max time in milliseconds the server waits for new entries before returning an empty batch
+    MAX_AWAIT_TIME_MS = 1000
+
+    def __init__(self, *args, **kwargs):
+        super(OplogStreamer, self).__init__(*args, **kwargs)
+        if pymongo is None:
+            raise dbdust.dumper.DbDustDumpException('mongo oplog : pymongo package is needed')
+        self.lock = threading.Lock()
+        self.thread = None
+        self.error = None
+        self.spool_path = os.path.join(self.spool_dir, 'oplog.bson')
+        self.spool = None
+        self.first_ts = None
+        self.last_ts = None
+        # entries in the spool are read again from the server
+        for name in os.listdir(self.spool_dir):
+            os.remove(os.path.join(self.spool_dir, name))
+
+    def connect(self):
+        """ Connect to the mongo server with the source settings
+
+        :rtype: pymongo.MongoClient
+        """
+        return dbdust.dumper.mongo_client(**self.dump_conf.cli_conf)
+
+    def start_source(self):
+        self.error = None
+        self.thread = threading.Thread(target=self._tail, daemon=True)
+        self.thread.start()
+
+    def source_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def source_exit_reason(self):
+        return '{}: {}'.format(type(self.error).__name__, str(self.error))
+
+    def stop_source(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _tail(self):
+        """ Append the oplog entries after the saved timestamp to the spool until stopped """
+        try:
+            oplog = self.connect().local.get_collection(
+                'oplog.rs', codec_options=CodecOptions(document_class=RawBSONDocument))
+            if 'ts' in self.state:
+                last_ts = Timestamp(*self.state['ts'])
+            else:
+                # first run : only the entries written from now on
+                last_entry = next(iter(oplog.find().sort('$natural', -1).limit(1)), None)
+                last_ts = last_entry['ts'] if last_entry is not None else Timestamp(0, 0)
+                # a restart before the first segment continues from this entry
+                self.state = {'ts': [last_ts.time, last_ts.inc]}
+                self._save_state()
+            query = {'ts': {'$gt': last_ts}}
+            if self.dump_conf.cli_conf.get('database'):
+                # the writes of a transaction are in the `applyOps` of a single `admin.$cmd` entry
+                query['$or'] = [
+                    {'ns': {'$regex': '^{}\\.'.format(re.escape(self.dump_conf.cli_conf['database']))}},
+                    {'ns': 'admin.$cmd', 'o.applyOps': {'$exists': True}}]
+            cursor = oplog.find(query, cursor_type=pymongo.CursorType.TAILABLE_AWAIT).max_await_time_ms(
+                self.MAX_AWAIT_TIME_MS)
+            while not self.stopping.is_set():
+                if not cursor.alive:
+                    # the source is restarted from the last stored entry
+                    raise dbdust.dumper.DbDustDumpException('mongo oplog : the tailable cursor was closed')
+                for entry in cursor:
+                    entry = self._filter_transaction(entry)
+                    if entry is not None:
+                        self._append(entry)
+                    if self.stopping.is_set():
+                        break
+        except Exception as e:
+            self.error = e
+
+    def _filter_transaction(self, entry):
+        """ Keep the operations on the database of a transaction entry (`applyOps` command)
+
+        :param entry: an oplog entry
+        :type entry: bson.raw_bson.RawBSONDocument
+        :return: the entry, None if the transaction has no operation on the database
+        :rtype: bson.raw_bson.RawBSONDocument
+        """
+        database = self.dump_conf.cli_conf.get('database')
+        if not database or entry['ns'] != 'admin.$cmd':
+            return entry
+        document = bson.decode(entry.raw)
+        operations = document['o'].get('applyOps', [])
+        kept = [operation for operation in operations if operation.get('ns', '').startswith(database + '.')]
+        if not kept:
+            return None
+        if len(kept) == len(operations):
+            return entry
+        document['o']['applyOps'] = kept
+        return RawBSONDocument(bson.encode(document))
+
+    def _append(self, entry):
+        with self.lock:
+            if self.spool is None:
+                self.spool = open(self.spool_path, 'wb')
+                self.first_ts = entry['ts']
+            self.spool.write(entry.raw)
+            self.last_ts = entry['ts']
+
+    def ship(self):
+        with self.lock:
+            if self.spool is None:
+                return
+            self.spool.close()
+            self.spool = None
+            ship_path = '{}.ship'.format(self.spool_path)
+            os.replace(self.spool_path, ship_path)
+            first_ts, last_ts = self.first_ts, self.last_ts
+        self.store_segment(read_range(ship_path, 0, os.path.getsize(ship_path)),
+                           'oplog.{:010d}-{:06d}'.format(first_ts.time, first_ts.inc))
+        os.remove(ship_path)
+        self.state = {'ts': [last_ts.time, last_ts.inc]}
+        self._save_state()
+
+
+def read_range(path, offset, end):
+    """ Read a file from `offset` to `end` by chunks
+
+    :rtype: generator
+    """
+    with open(path, 'rb') as src:
+        src.seek(offset)
+        while offset < end:
+            chunk = src.read(min(READ_SIZE, end - offset))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+
+#: streamer class per `continuous` value in :data:`dbdust.dumper.dumper_config`
+STREAMERS = {
+    'binlog': BinlogStreamer,
+    'oplog': OplogStreamer,
+}
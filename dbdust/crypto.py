@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Segmented authenticated encryption of the dumps
+
+An encrypted dump is a header followed by fixed size segments, each one encrypted
+independently with AES-GCM so segments are encrypted and decrypted in parallel :
+
+* header : magic, key id, segment size and a random nonce prefix
+* segment : ciphertext of `segment_size` bytes of the dump (less for the last one) followed by the 16 bytes tag
+
+The nonce of a segment is the nonce prefix, the segment index and a flag set on the last
+segment, the header is authenticated with each segment : segments can not be reordered,
+removed or truncated without the decryption failing.
+"""
+
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import os
+import struct
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # pragma: no cover - optional dependency
+    AESGCM = None
+
+from dbdust.pipeline import Stage
+
+#: file extension appended to the encrypted dumps
+FILE_EXT = 'enc'
+
+#: default size of the plaintext segments
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+
+MAGIC = b'DBDUSTE1'
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+
+
+class DbDustCryptoException(Exception):
+    """ Base exception for all crypto exception """
+    pass
+
+
+def _check_cryptography():
+    if AESGCM is None:
+        raise DbDustCryptoException('cryptography package is needed for encryption')
+
+
+def load_key(path):
+    """ Read an AES key file (16, 24 or 32 raw bytes or their base64 encoding)
+
+    :param path: path of the key file
+    :type path: str
+    :rtype: bytes
+    """
+    with open(path, 'rb') as key_file:
+        key = key_file.read()
+    if len(key) not in (16, 24, 32):
+        try:
+            key = base64.b64decode(key.strip(), validate=True)
+        except ValueError:
+            pass
+    if len(key) not in (16, 24, 32):
+        raise DbDustCryptoException('{} is not a valid AES key file'.format(path))
+    return key
+
+
+def load_keys(paths):
+    """ Read several key files
+
+    :param paths: paths of the key files
+    :type paths: str[]
+    :return: the keys indexed by their key id
+    :rtype: dict
+    """
+    keys = {}
+    for path in paths:
+        key = load_key(path)
+        keys[key_id(key)] = key
+    return keys
+
+
+def key_id(key):
+    """ Identifier of a key written in the header of the encrypted dumps (not secret)
+
+    :param key: the key
+    :type key: bytes
+    :rtype: str
+    """
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+def _nonce(prefix, index, last):
+    return prefix + struct.pack('>I?', index, last)
+
+
+def _build_header(kid, segment_size, nonce_prefix):
+    kid = kid.encode()
+    return MAGIC + struct.pack('>B', len(kid)) + kid + struct.pack('>I', segment_size) + nonce_prefix
+
+
+class EncryptStage(Stage):
+    """ Encrypt the dump segment by segment on a pool of threads
+
+    At most twice `workers` segments are in progress, the results are written in order.
+
+    :param key: the AES key
+    :type key: bytes
+    :param segment_size: size of the plaintext segments
+    :type segment_size: int
+    :param workers: number of threads encrypting segments (default to the number of cpu)
+    :type workers: int
+    """
+
+    def __init__(self, key, segment_size=None, workers=None):
+        _check_cryptography()
+        self.aead = AESGCM(key)
+        self.key_id = key_id(key)
+        self.segment_size = segment_size or DEFAULT_SEGMENT_SIZE
+        self.workers = workers or os.cpu_count() or 1
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.header = _build_header(self.key_id, self.segment_size, self.nonce_prefix)
+        self.buffer = bytearray()
+        self.index = 0
+        self.pending = collections.deque()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.header_written = False
+
+    def _encrypt(self, index, data, last):
+        return self.aead.encrypt(_nonce(self.nonce_prefix, index, last), data, self.header)
+
+    def _submit(self, data, last):
+        self.pending.append(self.executor.submit(self._encrypt, self.index, data, last))
+        self.index += 1
+
+    def _collect(self, keep):
+        """ Get the encrypted segments in order, waiting until at most `keep` are in progress """
+        output = []
+        if not self.header_written:
+            output.append(self.header)
+            self.header_written = True
+        while len(self.pending) > keep or (self.pending and self.pending[0].done()):
+            output.append(self.pending.popleft().result())
+        return b''.join(output)
+
+    def process(self, chunk):
+        self.buffer += chunk
+        # the last segment is only known at the end of the dump, a full segment is kept in the buffer
+        segment_count = (len(self.buffer) - 1) // self.segment_size
+        if segment_count > 0:
+            # the segments are encrypted from views of the buffer : a new buffer gets the data left
+            end = segment_count * self.segment_size
+            view = memoryview(self.buffer)
+            self.buffer = bytearray(view[end:])
+            for i in range(segment_count):
+                self._submit(view[i * self.segment_size:(i + 1) * self.segment_size], False)
+        return self._collect(2 * self.workers)
+
+    def flush(self):
+        self._submit(self.buffer, True)
+        self.buffer = bytearray()
+        try:
+            return self._collect(0)
+        finally:
+            self.executor.shutdown()
+
+    def close(self):
+        # a failed dump is not flushed : the segments not started are dropped, the threads end
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.buffer = bytearray()
+        self.executor.shutdown(wait=False)
+
+    def report(self):
+        return {'encryption': 'aes-gcm', 'encryption_key_id': self.key_id}
+
+
+class DecryptingReader(object):
+    """ File like object decrypting an encrypted dump, segments are decrypted in parallel
+
+    :param fileobj: the encrypted file object to read from
+    :param keys: the keys indexed by key id (see :func:`load_keys`)
+    :type keys: dict
+    :param workers: number of threads decrypting segments (default to the number of cpu)
+    :type workers: int
+    """
+
+    def __init__(self, fileobj, keys, workers=None):
+        _check_cryptography()
+        self.fileobj = fileobj
+        self.workers = workers or os.cpu_count() or 1
+        self.header = self._read_header(keys)
+        self.index = 0
+        self.lookahead = None
+        self.data = b''
+        self.eof = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            part = self.fileobj.read(size - len(data))
+            if not part:
+                break
+            data += part
+        return data
+
+    def _read_header(self, keys):
+        magic = self._read_exactly(len(MAGIC) + 1)
+        if len(magic) != len(MAGIC) + 1 or magic[:len(MAGIC)] != MAGIC:
+            raise DbDustCryptoException('not a dbdust encrypted file')
+        kid = self._read_exactly(magic[-1]).decode()
+        segment_size, = struct.unpack('>I', self._read_exactly(4))
+        self.nonce_prefix = self._read_exactly(NONCE_PREFIX_SIZE)
+        if kid not in keys:
+            raise DbDustCryptoException('key {} needed to decrypt the file'.format(kid))
+        self.aead = AESGCM(keys[kid])
+        self.segment_size = segment_size
+        return _build_header(kid, segment_size, self.nonce_prefix)
+
+    def _decrypt(self, index, data, last):
+        try:
+            return self.aead.decrypt(_nonce(self.nonce_prefix, index, last), data, self.header)
+        except InvalidTag:
+            raise DbDustCryptoException('segment {} is corrupted or the file is truncated'.format(index))
+
+    def _next_batch(self):
+        """ Read and decrypt the next segments, one per worker """
+        full_size = self.segment_size + TAG_SIZE
+        segments = []
+        if self.lookahead is None:
+            self.lookahead = self._read_exactly(full_size)
+        while len(segments) < self.workers and self.lookahead is not None:
+            data = self.lookahead
+            self.lookahead = self._read_exactly(full_size) if len(data) == full_size else b''
+            last = not self.lookahead
+            segments.append((self.index, data, last))
+            self.index += 1
+            if last:
+                self.lookahead = None
+                self.eof = True
+        return b''.join(self.executor.map(lambda s: self._decrypt(*s), segments))
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.data) < size):
+            self.data += self._next_batch()
+        if size is None or size < 0:
+            size = len(self.data)
+        result, self.data = self.data[:size], self.data[size:]
+        return result
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.executor.shutdown()
+        self.fileobj.close()
+
+
+def decrypt_file(src_path, dest_path, keys, workers=None):
+    """ Decrypt an encrypted dump to a file
+
+    :param src_path: the encrypted dump
+    :type src_path: str
+    :param dest_path: the decrypted dump
+    :type dest_path: str
+    :param keys: the keys indexed by key id (see :func:`load_keys`)
+    :type keys: dict
+    :param workers: number of threads decrypting segments
+    :type workers: int
+    """
+    with open(dest_path, 'wb') as dst:
+        reader = DecryptingReader(open(src_path, 'rb'), keys, workers)
+        try:
+            while True:
+                data = reader.read(reader.segment_size * reader.workers)
+                if not data:
+                    break
+                dst.write(data)
+        finally:
+            reader.close()
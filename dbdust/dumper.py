@@ -9,7 +9,29 @@
 
 """ Cli and config for all supported source systems """
 
+import collections
 import functools
+import json
+import os
+import shlex
+import shutil
+import subprocess
+
+try:
+    import bson.json_util
+    import pymongo
+    import pymongo.errors
+except ImportError:  # pragma: no cover - optional dependency
+    pymongo = None
+
+import dbdust.native
+import dbdust.utils
+
+#: number of sampled documents per range when the `_id` split points are sampled
+MONGO_SAMPLES_PER_RANGE = 100
+
+#: seconds to wait for the connection to a candidate replica
+REPLICA_CONNECT_TIMEOUT = 10
 
 
 class DbDustDumpException(Exception):
@@ -19,7 +41,7 @@ class DbDustDumpException(Exception):
 
 def mongo_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, uri=None, host=None, port=None,
                       database=None, username=None, password=None, authentication_database=None,
-                      authentication_mechanism=None, collection=None):
+                      authentication_mechanism=None, collection=None, query=None):
     """ dbust cli for mongodump """
     if uri and any([host, port, database, username, password, authentication_database, authentication_mechanism]):
         raise DbDustDumpException('mongo dump : when specifying uri, don\'t set other connection settings')
@@ -42,15 +64,21 @@ def mongo_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, uri=Non
         cmd.extend(['--db', database])
     if collection:
         cmd.extend(['--collection', collection])
+    if query:
+        if not collection:
+            raise DbDustDumpException('mongo dump : a query needs a collection')
+        cmd.extend(['--query', shlex.quote(query)])
     cmd.extend(['--gzip', '--archive={}'.format(dump_file_path)])
     return cmd
 
 
 def mysql_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, host=None, port=None, username=None,
-                      password=None, database=None, all_databases=None, zipped=None):
-    """ dbust cli for mysqldump """
+                      password=None, database=None, all_databases=None, zipped=None, table=None):
+    """ dbust cli for mysqldump (of a single `table` of the database if set) """
     if all([database, all_databases]):
         raise DbDustDumpException('mysql dump : you must not set both database and all_databases')
+    if table is not None and database is None:
+        raise DbDustDumpException('mysql dump : a database is needed to dump a table')
     cmd = [bin_path]
     if host is not None:
         cmd.extend(['-h', host])
@@ -62,6 +90,8 @@ def mysql_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, host=No
         cmd.append('-p{}'.format(password))
     if database is not None:
         cmd.append(database)
+    if table is not None:
+        cmd.append(table)
     if all_databases is not None:
         cmd.append('--all-databases')
     if zipped:
@@ -77,12 +107,351 @@ def zipped_mysql_cli_builder():
     return wrapper
 
 
+def _mysql_client_cmd(host=None, port=None, username=None, password=None, column_names=False):
+    """ Build the command of the mysql client in batch mode (without column names by default)
+
+    :return: the command or None if the mysql client is not available
+    :rtype: list
+    """
+    bin_path = shutil.which('mysql')
+    if bin_path is None:
+        return None
+    cmd = [bin_path, '-B'] if column_names else [bin_path, '-N', '-B']
+    if host is not None:
+        cmd.extend(['-h', host])
+    if port is not None:
+        cmd.extend(['-P', port])
+    if username is not None:
+        cmd.extend(['-u', username])
+    if password is not None:
+        cmd.append('-p{}'.format(password))
+    return cmd
+
+
+def _mysql_string(value):
+    return "'{}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+
+
+def _mysql_identifier(value):
+    return '`{}`'.format(value.replace('`', '``'))
+
+
+def mysql_size_estimator(host=None, port=None, username=None, password=None, database=None,
+                         all_databases=None, **kwargs):
+    """ Estimate the size of a mysql dump from the size of the data in information_schema
+
+    :return: the estimated size in bytes or None if the mysql client is not available
+    :rtype: int
+    """
+    cmd = _mysql_client_cmd(host, port, username, password)
+    if cmd is None:
+        return None
+    query = 'SELECT COALESCE(SUM(data_length), 0) FROM information_schema.tables WHERE '
+    if database is not None:
+        query += 'table_schema = {}'.format(_mysql_string(database))
+    else:
+        query += "table_schema NOT IN ('information_schema', 'performance_schema', 'sys')"
+    cmd.extend(['-e', query])
+    output = subprocess.check_output(cmd)
+    return int(output.decode().strip().split('.')[0] or 0)
+
+
+def mongo_size_estimator(uri=None, host=None, port=None, database=None, username=None, password=None,
+                         authentication_database=None, authentication_mechanism=None, collection=None, **kwargs):
+    """ Estimate the size of a mongo dump from the data size in `dbStats` (or `collStats`)
+
+    :return: the estimated size in bytes or None if no mongo shell is available
+    :rtype: int
+    """
+    bin_path = shutil.which('mongosh') or shutil.which('mongo')
+    if bin_path is None:
+        return None
+    cmd = [bin_path, '--quiet']
+    if uri:
+        cmd.append(uri)
+    if host:
+        cmd.extend(['--host', host])
+    if port:
+        cmd.extend(['--port', port])
+    if username:
+        cmd.extend(['--username', username])
+    if password:
+        cmd.extend(['--password', password])
+    if authentication_database:
+        cmd.extend(['--authenticationDatabase', authentication_database])
+    if authentication_mechanism:
+        cmd.extend(['--authenticationMechanism', authentication_mechanism])
+    if database:
+        cmd.append(database)
+    if collection:
+        stats = 'db.getCollection({}).stats().size'.format(json.dumps(collection))
+    elif database:
+        stats = 'db.stats().dataSize'
+    else:
+        stats = ('db.adminCommand({listDatabases: 1}).databases'
+                 '.reduce(function (total, d) { return total + d.sizeOnDisk; }, 0)')
+    cmd.extend(['--eval', 'print({})'.format(stats)])
+    output = subprocess.check_output(cmd)
+    return int(float(output.decode().strip().splitlines()[-1]))
+
+
+def mongo_client(uri=None, host=None, port=None, username=None, password=None, authentication_database=None,
+                 authentication_mechanism=None, direct_connection=False, **kwargs):
+    """ Connect to a mongo server with the settings of a mongo source
+
+    :param direct_connection: connect to the server only, not to its replica set
+    :type direct_connection: bool
+    :rtype: pymongo.MongoClient
+    """
+    if pymongo is None:
+        raise DbDustDumpException('mongo : pymongo package is needed')
+    client_kwargs = {'directConnection': True} if direct_connection else {}
+    if uri:
+        return pymongo.MongoClient(uri, **client_kwargs)
+    if username:
+        client_kwargs.update(username=username, password=password)
+    if authentication_database:
+        client_kwargs['authSource'] = authentication_database
+    if authentication_mechanism:
+        client_kwargs['authMechanism'] = authentication_mechanism
+    return pymongo.MongoClient(host, int(port) if port else None, **client_kwargs)
+
+
+def mongo_replica_status(**kwargs):
+    """ Get the replication lag and the load of a mongo server (see :mod:`dbdust.replicas`)
+
+    The lag is the difference between the last operation applied by the primary and by the
+    server in `replSetGetStatus`, the load is the number of active clients of `serverStatus`.
+
+    :return: dict with `replica`, `lag` and `load` keys
+    :rtype: dict
+    """
+    client = mongo_client(direct_connection=True, **kwargs)
+    try:
+        server_status = client.admin.command('serverStatus')
+        load = server_status.get('globalLock', {}).get('activeClients', {}).get('total')
+        try:
+            members = client.admin.command('replSetGetStatus')['members']
+        except pymongo.errors.OperationFailure:
+            # not a member of a replica set
+            return {'replica': False, 'lag': None, 'load': load}
+    finally:
+        client.close()
+    self_member = next(member for member in members if member.get('self'))
+    primary = next((member for member in members if member['stateStr'] == 'PRIMARY'), None)
+    replica = self_member['stateStr'] == 'SECONDARY'
+    lag = None
+    if replica and primary is not None:
+        lag = max(0, (primary['optimeDate'] - self_member['optimeDate']).total_seconds())
+    return {'replica': replica, 'lag': lag, 'load': load}
+
+
+def _mongo_split_points(db, collection, count):
+    """ Get at most `count - 1` `_id` values splitting a collection in ranges of about the same size
+
+    The split points of `splitVector` are used, if the command is not allowed (needs the
+    `splitVector` privilege, not available through mongos) the points are sampled.
+
+    :rtype: list
+    """
+    try:
+        size = db.command('collStats', collection).get('size', 0)
+        result = db.command('splitVector', '{}.{}'.format(db.name, collection), keyPattern={'_id': 1},
+                            maxChunkSizeBytes=max(1, size // count))
+        points = [key['_id'] for key in result.get('splitKeys', [])]
+    except pymongo.errors.OperationFailure:
+        sample = db[collection].aggregate([{'$sample': {'size': count * MONGO_SAMPLES_PER_RANGE}},
+                                           {'$project': {'_id': 1}}])
+        points = [document['_id'] for document in sample]
+    if not points:
+        return []
+
+    # range filters only match the `_id` of the type of their bounds, keep the most common type
+    types = collections.Counter(type(point) for point in points)
+    main_type = types.most_common(1)[0][0]
+    points = sorted(set(point for point in points if type(point) is main_type))
+    return [points[len(points) * index // count] for index in range(1, count) if len(points) * index // count]
+
+
+def mongo_range_queries(points):
+    """ Build the `--query` filters of the `_id` ranges between split points
+
+    The first range also gets the documents with an `_id` of another type than the split points.
+
+    :param points: the sorted split points
+    :type points: list
+    :return: the filters in extended JSON
+    :rtype: str[]
+    """
+    if not points:
+        return ['{}']
+    filters = [{'_id': {'$not': {'$gte': points[0]}}}]
+    filters.extend({'_id': {'$gte': first, '$lt': last}} for first, last in zip(points, points[1:]))
+    filters.append({'_id': {'$gte': points[-1]}})
+    return [bson.json_util.dumps(f, json_options=bson.json_util.CANONICAL_JSON_OPTIONS) for f in filters]
+
+
+def mongo_key_ranges(count, database=None, collection=None, **kwargs):
+    """ Split a mongo collection in `_id` ranges
+
+    :param count: number of ranges
+    :type count: int
+    :return: the settings of the dump of each range
+    :rtype: dict[]
+    """
+    if not database or not collection:
+        raise DbDustDumpException('mongo key ranges : a database and a collection are needed')
+    client = mongo_client(**kwargs)
+    try:
+        points = _mongo_split_points(client[database], collection, count)
+    finally:
+        client.close()
+    return [{'query': query} for query in mongo_range_queries(sorted(set(points)))]
+
+
+def mysql_binlog_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, host=None, port=None,
+                             username=None, password=None, server_id=None, start_file=None):
+    """ dbust cli for mysqlbinlog : copy the binary logs from `start_file` to `dump_dir_path` and wait for new events
+
+    The binary log files are written as is (`--raw`) in `dump_dir_path` with their name on the server.
+    """
+    if start_file is None:
+        raise DbDustDumpException('mysql binlog : the first binary log file is unknown')
+    cmd = [bin_path, '--read-from-remote-server', '--raw', '--stop-never',
+           '--result-file={}'.format(os.path.join(dump_dir_path, ''))]
+    if host is not None:
+        cmd.extend(['-h', host])
+    if port is not None:
+        cmd.extend(['-P', port])
+    if username is not None:
+        cmd.extend(['-u', username])
+    if password is not None:
+        cmd.append('-p{}'.format(password))
+    if server_id is not None:
+        cmd.append('--connection-server-id={}'.format(server_id))
+    cmd.append(start_file)
+    return cmd
+
+
+def mysql_binlog_current_file(host=None, port=None, username=None, password=None, **kwargs):
+    """ Get the name of the binary log file currently written by the mysql server
+
+    :return: the binary log file name
+    :rtype: str
+    """
+    cmd = _mysql_client_cmd(host, port, username, password)
+    if cmd is None:
+        raise DbDustDumpException('mysql binlog : mysql client needed to find the current binary log file')
+    # SHOW MASTER STATUS was renamed in mysql 8.4
+    for query in ('SHOW BINARY LOG STATUS', 'SHOW MASTER STATUS'):
+        try:
+            output = subprocess.check_output(cmd + ['-e', query], stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            continue
+        if output.strip():
+            return output.decode().split()[0]
+    raise DbDustDumpException('mysql binlog : binary logging is not enabled on the server')
+
+
+def mysql_table_indicators(host=None, port=None, username=None, password=None, database=None, checksum=False,
+                           **kwargs):
+    """ Get the change indicators of each table of the database
+
+    The indicators are the `UPDATE_TIME` and the `TABLE_ROWS` from information_schema, the time of
+    the server when they are read and, with `checksum`, the result of `CHECKSUM TABLE` (which reads
+    the whole table).
+
+    :return: dict of indicators (`update_time`, `rows`, `read_at`, `checksum`) per table name
+    :rtype: dict
+    """
+    if database is None:
+        raise DbDustDumpException('mysql tables : a database is needed to dump its tables separately')
+    cmd = _mysql_client_cmd(host, port, username, password)
+    if cmd is None:
+        raise DbDustDumpException('mysql tables : mysql client needed to get the table change indicators')
+    query = ("SELECT table_name, COALESCE(update_time, 'NULL'), COALESCE(table_rows, 'NULL'), NOW() "
+             "FROM information_schema.tables WHERE table_schema = {} AND table_type = 'BASE TABLE'".format(
+                 _mysql_string(database)))
+    tables = {}
+    for line in subprocess.check_output(cmd + ['-e', query]).decode().splitlines():
+        name, update_time, rows, read_at = line.split('\t')
+        tables[name] = {'update_time': update_time if update_time != 'NULL' else None,
+                        'rows': int(rows) if rows != 'NULL' else None, 'read_at': read_at, 'checksum': None}
+    if checksum and tables:
+        names = ['{}.{}'.format(_mysql_identifier(database), _mysql_identifier(name)) for name in tables]
+        query = 'CHECKSUM TABLE {}'.format(', '.join(names))
+        for line in subprocess.check_output(cmd + ['-e', query]).decode().splitlines():
+            name, value = line.rsplit('\t', 1)
+            name = name.split('.', 1)[1]
+            if name in tables and value != 'NULL':
+                tables[name]['checksum'] = value
+    return tables
+
+
+def mysql_replica_status(host=None, port=None, username=None, password=None, **kwargs):
+    """ Get the replication lag and the load of a mysql server (see :mod:`dbdust.replicas`)
+
+    The lag is `Seconds_Behind_Source` of `SHOW REPLICA STATUS` (`SHOW SLAVE STATUS` before mysql 8.0.22),
+    the load is the number of threads running.
+
+    :return: dict with `replica`, `lag` and `load` keys
+    :rtype: dict
+    """
+    cmd = _mysql_client_cmd(host, port, username, password, column_names=True)
+    if cmd is None:
+        raise DbDustDumpException('mysql replicas : mysql client needed to get the replication status')
+    cmd.append('--connect-timeout={}'.format(REPLICA_CONNECT_TIMEOUT))
+    status = None
+    for query, lag_column in (('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+                              ('SHOW SLAVE STATUS', 'Seconds_Behind_Master')):
+        try:
+            output = subprocess.check_output(cmd + ['-e', query], stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            continue
+        lines = output.decode().splitlines()
+        status = dict(zip(lines[0].split('\t'), lines[1].split('\t'))) if len(lines) > 1 else {}
+        break
+    if status is None:
+        raise DbDustDumpException('mysql replicas : replication status of {} unavailable'.format(host))
+    lag = status.get(lag_column)
+    output = subprocess.check_output(cmd + ['-N', '-e', "SHOW GLOBAL STATUS LIKE 'Threads_running'"])
+    return {'replica': bool(status), 'lag': int(lag) if lag not in (None, '', 'NULL') else None,
+            'load': int(output.decode().split()[1])}
+
+
+def mysql_native_dumper(host=None, port=None, username=None, password=None, database=None, workers=None,
+                        batch_rows=None, statement_size=None, split_rows=None, table=None, **kwargs):
+    """ dbdust native mysql dumper (see :class:`dbdust.native.MySQLNativeDumper`)
+
+    :rtype: dbdust.native.MySQLNativeDumper
+    """
+    if dbdust.native.pymysql is None:
+        raise DbDustDumpException('mysql native : pymysql package is needed')
+    if database is None:
+        raise DbDustDumpException('mysql native : a database is needed')
+    connect = functools.partial(dbdust.native.pymysql.connect, host=host or 'localhost', port=int(port or 3306),
+                                user=username, password=password or '', charset='utf8mb4')
+    return dbdust.native.MySQLNativeDumper(connect, database, workers=workers, batch_rows=batch_rows,
+                                           statement_size=dbdust.utils.parse_size(statement_size),
+                                           split_rows=split_rows, tables=[table] if table is not None else None)
+
+
 def dbdust_tester_cli_builder(bin_path, zip_path, dump_dir_path, dump_file_path, loop='default', sleep=0, exit_code=0):
     """ dbust cli tester script included in this package """
     return [bin_path, dump_file_path, loop, sleep, exit_code]
 
 
-#: dict off all items mandatory for dbdust main process
+#: dict off all items mandatory for dbdust main process (`bin_name` is None if no executable is needed)
+#: (optional `codec` and `stream_cli_builder` items let dbdust compress the dump itself,
+#: optional `size_estimator` estimates the dump size from the source metadata,
+#: optional `dump_format` selects the content checks of `dbdust verify`,
+#: optional `key_ranges` splits the source in the key ranges dumped concurrently (settings of each range dump),
+#: optional `replica_status` gets the replication lag and the load of a server (see :mod:`dbdust.replicas`),
+#: optional `native_dumper` builds a dumper running inside dbdust (see :mod:`dbdust.native`) used instead of
+#: `cli_builder`, its output is always compressed with `codec`,
+#: optional `table_indicators` gets the change indicators of each table to dump the changed tables only,
+#: optional `continuous` marks a long running source handled by a streamer of :data:`dbdust.continuous.STREAMERS`
+#: and `current_position` gets its current position on the server)
 dumper_config = {
     "dbdust_tester.sh": {
         "bin_name": "dbdust_tester.sh",
@@ -94,24 +463,106 @@ dumper_config = {
         "bin_name": "mysqldump",
         "zip_name": None,
         "file_ext": "sql",
-        "cli_builder": mysql_cli_builder
+        "cli_builder": mysql_cli_builder,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
     },
     "mysql_gz": {
         "bin_name": "mysqldump",
         "zip_name": "gzip",
         "file_ext": "sql.gz",
-        "cli_builder": zipped_mysql_cli_builder()
+        "cli_builder": zipped_mysql_cli_builder(),
+        "codec": "gzip",
+        "stream_cli_builder": mysql_cli_builder,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
     },
     "mysql_bz2": {
         "bin_name": "mysqldump",
         "zip_name": "bzip2",
         "file_ext": "sql.bz2",
-        "cli_builder": zipped_mysql_cli_builder()
+        "cli_builder": zipped_mysql_cli_builder(),
+        "codec": "bzip2",
+        "stream_cli_builder": mysql_cli_builder,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
+    },
+    "mysql_zst": {
+        "bin_name": "mysqldump",
+        "zip_name": "zstd",
+        "file_ext": "sql.zst",
+        "cli_builder": zipped_mysql_cli_builder(),
+        "codec": "zstd",
+        "stream_cli_builder": mysql_cli_builder,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
+    },
+    "mysql_native": {
+        "bin_name": None,
+        "zip_name": None,
+        "file_ext": "sql",
+        "cli_builder": None,
+        "native_dumper": mysql_native_dumper,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
+    },
+    "mysql_native_gz": {
+        "bin_name": None,
+        "zip_name": None,
+        "file_ext": "sql.gz",
+        "cli_builder": None,
+        "codec": "gzip",
+        "native_dumper": mysql_native_dumper,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
+    },
+    "mysql_native_zst": {
+        "bin_name": None,
+        "zip_name": None,
+        "file_ext": "sql.zst",
+        "cli_builder": None,
+        "codec": "zstd",
+        "native_dumper": mysql_native_dumper,
+        "size_estimator": mysql_size_estimator,
+        "dump_format": "mysql",
+        "table_indicators": mysql_table_indicators,
+        "replica_status": mysql_replica_status
+    },
+    "mysql_binlog": {
+        "bin_name": "mysqlbinlog",
+        "zip_name": None,
+        "file_ext": "gz",
+        "cli_builder": mysql_binlog_cli_builder,
+        "continuous": "binlog",
+        "current_position": mysql_binlog_current_file
+    },
+    "mongo_oplog": {
+        "bin_name": None,
+        "zip_name": None,
+        "file_ext": "bson.gz",
+        "cli_builder": None,
+        "continuous": "oplog"
     },
     "mongo": {
         "bin_name": "mongodump",
         "zip_name": None,
         "file_ext": "gz",
-        "cli_builder": mongo_cli_builder
+        "cli_builder": mongo_cli_builder,
+        "size_estimator": mongo_size_estimator,
+        "dump_format": "mongo_archive",
+        "key_ranges": mongo_key_ranges,
+        "replica_status": mongo_replica_status
     }
 }
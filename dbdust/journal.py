@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Journal persisting the state of a backup so a failed run can be resumed """
+
+import glob
+import json
+import os
+
+
+class UploadJournal(object):
+    """ Json file in the tmp dir describing a dump kept after a failed run and its upload progress
+
+    The state is saved on disk after each update (written to a temporary file then renamed so
+    a crash never leaves a truncated journal).
+
+    :param path: path of the journal file
+    :type path: str
+    :param state: initial state
+    :type state: dict
+    """
+    #: journal files are stored as `<tmp_dir>/<PREFIX><dump file name><SUFFIX>`
+    PREFIX = 'dbdust-'
+    SUFFIX = '.journal'
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.state = state or {}
+
+    @classmethod
+    def create(cls, tmp_dir, file_name, **state):
+        """ Create and save the journal of a dump
+
+        :param tmp_dir: the dbdust tmp dir
+        :type tmp_dir: str
+        :param file_name: the name of the dump file
+        :type file_name: str
+        :return: the saved journal
+        :rtype: dbdust.journal.UploadJournal
+        """
+        state['file_name'] = file_name
+        journal = cls(os.path.join(tmp_dir, '{}{}{}'.format(cls.PREFIX, file_name, cls.SUFFIX)), state)
+        journal.save()
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        """ Read a journal from disk
+
+        :param path: path of the journal file
+        :type path: str
+        :rtype: dbdust.journal.UploadJournal
+        """
+        with open(path) as journal_file:
+            return cls(path, json.load(journal_file))
+
+    @classmethod
+    def list(cls, tmp_dir):
+        """ Find all journals in the tmp dir
+
+        :param tmp_dir: the dbdust tmp dir
+        :type tmp_dir: str
+        :return: journals sorted by path
+        :rtype: dbdust.journal.UploadJournal[]
+        """
+        pattern = os.path.join(glob.escape(tmp_dir), '{}*{}'.format(cls.PREFIX, cls.SUFFIX))
+        return [cls.load(path) for path in sorted(glob.glob(pattern))]
+
+    def update(self, **kwargs):
+        """ Update the state and save it """
+        self.state.update(kwargs)
+        self.save()
+
+    def save(self):
+        """ Write the state on disk """
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as journal_file:
+            json.dump(self.state, journal_file)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+        """ Remove the journal from disk """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SegmentJournal(UploadJournal):
+    """ Checkpoint of a backup dumped in segments (tables or key ranges) kept in the tmp dir
+
+    The state lists the segments of the backup and the manifest part of each one already
+    stored : a failed run is resumed by dumping the other segments only.
+    """
+    SUFFIX = '.checkpoint'
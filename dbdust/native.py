@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Dumpers running inside dbdust instead of an external dump command
+
+A native dumper produces the dump as a stream of chunks consumed by the dump pipeline
+(see :meth:`dbdust.pipeline.DumpPipeline.consume`) : no named pipe and no dump command.
+"""
+
+import math
+import queue
+import threading
+
+try:
+    import pymysql
+    import pymysql.cursors
+except ImportError:  # pragma: no cover - optional dependency
+    pymysql = None
+
+#: default number of rows fetched from the server per round trip
+DEFAULT_BATCH_ROWS = 10000
+
+#: default max size of an INSERT statement (below the `max_allowed_packet` default of the servers)
+DEFAULT_STATEMENT_SIZE = 1024 * 1024
+
+#: default number of rows of the primary key ranges a big table is split in
+DEFAULT_SPLIT_ROWS = 1000000
+
+#: integer column types a table can be split on
+SPLIT_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+
+#: session timeout (seconds) for the server writing rows to a slow consumer
+NET_WRITE_TIMEOUT = 3600
+
+DUMP_HEADER = ('-- dbdust native dump of {}\n'
+               'SET NAMES utf8mb4;\n'
+               'SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0;\n'
+               'SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0;\n'
+               "SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n"
+               # the TIMESTAMP values are read in UTC (as `mysqldump --tz-utc`)
+               '/*!40103 SET @OLD_TIME_ZONE=@@TIME_ZONE */;\n'
+               "/*!40103 SET TIME_ZONE='+00:00' */;\n")
+
+# same trailer as mysqldump, checked by `dbdust verify`
+DUMP_TRAILER = ('/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;\n'
+                'SET SQL_MODE=@OLD_SQL_MODE;\n'
+                'SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;\n'
+                'SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;\n'
+                '-- Dump completed\n')
+
+
+class DbDustNativeException(Exception):
+    """ Base exception for all native dumper exception """
+    pass
+
+
+def quote_identifier(name):
+    """ Quote a table or column name for a statement
+
+    :param name: the identifier
+    :type name: str
+    :rtype: str
+    """
+    return '`{}`'.format(name.replace('`', '``'))
+
+
+def split_ranges(low, high, count):
+    """ Split the integer interval [low, high] in at most `count` consecutive ranges
+
+    :param low: lowest value
+    :type low: int
+    :param high: highest value
+    :type high: int
+    :param count: number of ranges
+    :type count: int
+    :return: list of (first, last) tuples, both included
+    :rtype: list
+    """
+    count = max(1, min(count, high - low + 1))
+    step = (high - low + 1) // count
+    ranges = []
+    first = low
+    for index in range(count):
+        last = high if index == count - 1 else first + step - 1
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def encode_inserts(table, columns, rows, literal, max_size=DEFAULT_STATEMENT_SIZE):
+    """ Encode rows as multi rows INSERT statements
+
+    A statement holds as many rows as fit in `max_size` (at least one row). The rows are
+    encoded as text and joined once per statement, the statement is encoded once.
+
+    :param table: the table name
+    :type table: str
+    :param columns: the column names
+    :type columns: str[]
+    :param rows: iterable of rows (tuples of values in the column order)
+    :param literal: function returning the SQL literal of a value
+    :type literal: callable
+    :param max_size: max size of a statement
+    :type max_size: int
+    :return: generator of statements
+    :rtype: bytes
+    """
+    prefix = 'INSERT INTO {} ({}) VALUES '.format(quote_identifier(table), ','.join(map(quote_identifier, columns)))
+    values = []
+    size = len(prefix)
+    for row in rows:
+        value = '({})'.format(','.join(map(literal, row)))
+        if values and size + len(value) + 2 > max_size:
+            yield _statement(prefix, values)
+            values = []
+            size = len(prefix)
+        values.append(value)
+        size += len(value) + 1
+    if values:
+        yield _statement(prefix, values)
+
+
+def _statement(prefix, values):
+    # binary values are escaped as surrogates (see pymysql.converters.escape_bytes), they get their bytes back
+    return '{}{};\n'.format(prefix, ','.join(values)).encode('utf8', 'surrogateescape')
+
+
+def fetch_rows(cursor, batch_rows):
+    """ Iterate on the rows of a query, fetched in batches of `batch_rows` rows
+
+    :param cursor: cursor of the executed query
+    :param batch_rows: number of rows per fetch
+    :type batch_rows: int
+    """
+    while True:
+        batch = cursor.fetchmany(batch_rows)
+        if not batch:
+            return
+        yield from batch
+
+
+def _text(value):
+    # some servers return the metadata columns as binary strings
+    if isinstance(value, bytes):
+        return value.decode('utf8')
+    return value or ''
+
+
+class TableUnit(object):
+    """ Part of a table dumped by a worker : the whole table or a range of its primary key
+
+    :param database: the database name
+    :type database: str
+    :param table: the table name
+    :type table: str
+    :param columns: the column names (generated columns excluded)
+    :type columns: str[]
+    :param key: the primary key column the range applies to
+    :type key: str
+    :param first: lowest primary key of the range (included)
+    :type first: int
+    :param last: highest primary key of the range (included)
+    :type last: int
+    """
+
+    def __init__(self, database, table, columns, key=None, first=None, last=None):
+        self.database = database
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.first = first
+        self.last = last
+
+    def query(self):
+        """ The SELECT statement of the unit
+
+        :rtype: str
+        """
+        query = 'SELECT {} FROM {}.{}'.format(','.join(map(quote_identifier, self.columns)),
+                                              quote_identifier(self.database), quote_identifier(self.table))
+        if self.key is not None:
+            query += ' WHERE {0} >= {1} AND {0} <= {2}'.format(quote_identifier(self.key), int(self.first),
+                                                               int(self.last))
+        return query
+
+
+class MySQLNativeDumper(object):
+    """ Dump a mysql database with unbuffered server side cursors
+
+    The dump is a SQL script loadable by the `mysql` client : the structure of the tables
+    followed by multi rows INSERT statements. Only the base tables are dumped (no views,
+    routines, triggers nor events).
+
+    Each worker has its own connection, all of them read the same snapshot : with more than
+    one worker, the snapshot transactions are started while a global read lock is held
+    (`FLUSH TABLES WITH READ LOCK`, needs the `RELOAD` privilege). Tables with more than
+    `split_rows` rows and a single integer primary key are split in primary key ranges
+    dumped concurrently by the workers.
+
+    :param connect: function opening a new connection to the server
+    :type connect: callable
+    :param database: the database to dump
+    :type database: str
+    :param workers: number of connections reading the rows
+    :type workers: int
+    :param batch_rows: number of rows fetched per round trip
+    :type batch_rows: int
+    :param statement_size: max size of an INSERT statement
+    :type statement_size: int
+    :param split_rows: number of rows of the primary key ranges of the big tables
+    :type split_rows: int
+    :param tables: dump only these tables
+    :type tables: str[]
+    """
+
+    def __init__(self, connect, database, workers=1, batch_rows=None, statement_size=None, split_rows=None,
+                 tables=None):
+        self.connect = connect
+        self.database = database
+        self.workers = max(1, int(workers or 1))
+        self.batch_rows = int(batch_rows or DEFAULT_BATCH_ROWS)
+        self.statement_size = int(statement_size or DEFAULT_STATEMENT_SIZE)
+        self.split_rows = int(split_rows or DEFAULT_SPLIT_ROWS)
+        self.tables = tables
+        self.cursor_class = pymysql.cursors.SSCursor if pymysql is not None else None
+        self.stop = threading.Event()
+
+    def chunks(self):
+        """ Dump the database
+
+        :return: generator of the parts of the dump
+        :rtype: bytes
+        """
+        connections = []
+        threads = []
+        output = queue.Queue(maxsize=2 * self.workers)
+        try:
+            connections = self._open_snapshot()
+            yield DUMP_HEADER.format(quote_identifier(self.database)).encode('utf8')
+
+            cursor = connections[0].cursor()
+            units = queue.Queue()
+            for table in self._list_tables(cursor):
+                yield self._structure(cursor, table)
+                for unit in self._units(cursor, table):
+                    units.put(unit)
+            cursor.close()
+
+            for connection in connections:
+                thread = threading.Thread(target=self._work, args=(connection, units, output), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+            running = len(threads)
+            while running:
+                item = output.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+
+            yield DUMP_TRAILER.encode('utf8')
+        finally:
+            self.stop.set()
+            for thread in threads:
+                # unblock the workers waiting for room in the output queue
+                while thread.is_alive():
+                    try:
+                        output.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+            for connection in connections:
+                connection.close()
+
+    def _open_snapshot(self):
+        """ Open the connections of the workers, all in a transaction reading the same snapshot
+
+        :rtype: list
+        """
+        connections = []
+        lock = None
+        try:
+            if self.workers > 1:
+                lock = self.connect()
+                lock.cursor().execute('FLUSH TABLES WITH READ LOCK')
+            for _ in range(self.workers):
+                connection = self.connect()
+                connections.append(connection)
+                cursor = connection.cursor()
+                cursor.execute('SET SESSION net_write_timeout = {}'.format(NET_WRITE_TIMEOUT))
+                cursor.execute("SET SESSION time_zone = '+00:00'")
+                cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+                cursor.close()
+        except BaseException:
+            for connection in connections:
+                connection.close()
+            raise
+        finally:
+            if lock is not None:
+                lock.cursor().execute('UNLOCK TABLES')
+                lock.close()
+        return connections
+
+    def _list_tables(self, cursor):
+        cursor.execute('SHOW FULL TABLES FROM {}'.format(quote_identifier(self.database)))
+        tables = [row[0] for row in cursor.fetchall() if row[1] == 'BASE TABLE']
+        if self.tables is not None:
+            missing = set(self.tables) - set(tables)
+            if missing:
+                raise DbDustNativeException('mysql native : tables {} not found in {}'.format(
+                    ', '.join(sorted(missing)), self.database))
+            tables = [table for table in tables if table in self.tables]
+        return tables
+
+    def _structure(self, cursor, table):
+        """ DROP and CREATE statements of a table
+
+        :rtype: bytes
+        """
+        name = '{}.{}'.format(quote_identifier(self.database), quote_identifier(table))
+        cursor.execute('SHOW CREATE TABLE {}'.format(name))
+        create = cursor.fetchone()[1]
+        return '\n--\n-- Table {}\n--\n\nDROP TABLE IF EXISTS {};\n{};\n\n'.format(
+            quote_identifier(table), quote_identifier(table), create).encode('utf8')
+
+    def _units(self, cursor, table):
+        """ Split a table in the units dumped by the workers
+
+        :rtype: TableUnit[]
+        """
+        name = '{}.{}'.format(quote_identifier(self.database), quote_identifier(table))
+        cursor.execute('SHOW COLUMNS FROM {}'.format(name))
+        columns = []
+        keys = []
+        for field, column_type, _, key, _, extra in cursor.fetchall():
+            # generated columns can not be inserted
+            if 'GENERATED' in _text(extra).upper():
+                continue
+            columns.append(field)
+            if key == 'PRI':
+                # `int(11) unsigned` or `bigint unsigned`
+                keys.append((field, _text(column_type).split('(')[0].split(' ')[0].lower()))
+
+        whole = [TableUnit(self.database, table, columns)]
+        if self.workers == 1 or len(keys) != 1 or keys[0][1] not in SPLIT_TYPES:
+            return whole
+
+        cursor.execute('SELECT TABLE_ROWS FROM information_schema.tables WHERE TABLE_SCHEMA = %s '
+                       'AND TABLE_NAME = %s', (self.database, table))
+        rows = (cursor.fetchone() or (0,))[0] or 0
+        if rows <= self.split_rows:
+            return whole
+        key = keys[0][0]
+        cursor.execute('SELECT MIN({0}), MAX({0}) FROM {1}'.format(quote_identifier(key), name))
+        low, high = cursor.fetchone()
+        if low is None:
+            return whole
+        return [TableUnit(self.database, table, columns, key, first, last)
+                for first, last in split_ranges(low, high, math.ceil(rows / self.split_rows))]
+
+    def _work(self, connection, units, output):
+        """ Dump units until none is left, the statements are put in the output queue """
+        try:
+            while not self.stop.is_set():
+                try:
+                    unit = units.get_nowait()
+                except queue.Empty:
+                    break
+                cursor = connection.cursor(self.cursor_class)
+                try:
+                    cursor.execute(unit.query())
+                    rows = fetch_rows(cursor, self.batch_rows)
+                    for statement in encode_inserts(unit.table, unit.columns, rows, connection.literal,
+                                                    self.statement_size):
+                        if not self._put(output, statement):
+                            return
+                finally:
+                    cursor.close()
+        except Exception as e:
+            self._put(output, e)
+            return
+        self._put(output, None)
+
+    def _put(self, output, item):
+        """ Put an item in the output queue unless the dump is stopped
+
+        :return: False if the dump is stopped
+        :rtype: bool
+        """
+        while not self.stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
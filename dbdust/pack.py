@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Pack of many small dumps stored as a single file
+
+A pack is its members written one after the other, followed by an index and a footer :
+
+* index : json listing the `name`, `offset`, `size` and `sha256` of each member
+* footer : magic, offset and size of the index (fixed size, at the very end of the file)
+
+A member is read without reading the whole pack : the footer, then the index, then the
+range of the member.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+
+#: file extension appended to the packs
+FILE_EXT = 'pack'
+
+MAGIC = b'DBDUSTP1'
+FOOTER = struct.Struct('>8sQQ')
+
+#: size of the copies into the pack
+COPY_SIZE = 1024 * 1024
+
+
+class DbDustPackException(Exception):
+    """ Base exception for all pack exception """
+    pass
+
+
+class PackWriter(object):
+    """ Write the members of a pack one by one
+
+    :param path: path of the pack file
+    :type path: str
+    :param fileobj: writable file object of the pack (default to the file at `path`)
+    """
+
+    def __init__(self, path, fileobj=None):
+        self.path = path
+        self.file = fileobj if fileobj is not None else open(path, 'wb')
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        self.members = []
+
+    def _write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.offset += len(data)
+
+    def add(self, name, file_path, **info):
+        """ Append a file to the pack
+
+        :param name: name of the member
+        :type name: str
+        :param file_path: the file to append
+        :type file_path: str
+        :param info: information about the member kept in the index
+        :return: the index entry of the member
+        :rtype: dict
+        """
+        member_hash = hashlib.sha256()
+        offset = self.offset
+        with open(file_path, 'rb') as member_file:
+            for data in iter(lambda: member_file.read(COPY_SIZE), b''):
+                member_hash.update(data)
+                self._write(data)
+        member = dict(info, name=name, offset=offset, size=self.offset - offset, sha256=member_hash.hexdigest())
+        self.members.append(member)
+        return member
+
+    def close(self):
+        """ Write the index and the footer """
+        index = json.dumps({'members': self.members}).encode()
+        index_offset = self.offset
+        self._write(index)
+        self._write(FOOTER.pack(MAGIC, index_offset, len(index)))
+        self.file.close()
+
+    def abort(self):
+        """ Close and remove the incomplete pack """
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def sha256(self):
+        """ Checksum of the whole pack
+
+        :rtype: str
+        """
+        return self.hash.hexdigest()
+
+
+def read_index(read_range):
+    """ Read the index of a pack
+
+    :param read_range: function reading `size` bytes at `offset` of the pack (negative offset from the end)
+    :type read_range: callable
+    :raise dbdust.pack.DbDustPackException: if the file is not a pack
+    :return: the index entry of each member, in the pack order
+    :rtype: dict[]
+    """
+    footer = read_range(-FOOTER.size, FOOTER.size)
+    if len(footer) != FOOTER.size:
+        raise DbDustPackException('not a dbdust pack')
+    magic, index_offset, index_size = FOOTER.unpack(footer)
+    if magic != MAGIC:
+        raise DbDustPackException('not a dbdust pack')
+    return json.loads(read_range(index_offset, index_size).decode())['members']
+
+
+def file_range_reader(fileobj):
+    """ Build the `read_range` function of :func:`read_index` for a seekable file object
+
+    :rtype: callable
+    """
+    def read_range(offset, size):
+        fileobj.seek(offset, os.SEEK_END if offset < 0 else os.SEEK_SET)
+        return fileobj.read(size)
+    return read_range
+
+
+def find_member(members, name):
+    """ Get the index entry of a member by its name
+
+    :raise dbdust.pack.DbDustPackException: if the pack has no such member
+    :rtype: dict
+    """
+    for member in members:
+        if member['name'] == name:
+            return member
+    raise DbDustPackException('{} not found in the pack'.format(name))
+
+
+class MemberReader(io.RawIOBase):
+    """ Read a member from a stream of the whole pack positioned at the start of the member
+
+    The sha256 of the data read is computed, :meth:`drain` reads the rest of the member.
+
+    :param fileobj: the pack stream
+    :param size: size of the member
+    :type size: int
+    """
+
+    def __init__(self, fileobj, size):
+        super(MemberReader, self).__init__()
+        self.fileobj = fileobj
+        self.remaining = size
+        self.hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0 or not len(buffer):
+            return 0
+        with memoryview(buffer) as view:
+            count = self.fileobj.readinto(view[:min(len(view), self.remaining)])
+            if not count:
+                raise DbDustPackException('pack truncated, {} bytes of the member missing'.format(self.remaining))
+            self.hash.update(view[:count])
+        self.remaining -= count
+        return count
+
+    def drain(self):
+        """ Read the rest of the member """
+        buffer = bytearray(COPY_SIZE)
+        while self.readinto(buffer):
+            pass
+
+
+def extract(path, output_dir, names=None):
+    """ Extract the members of a pack file
+
+    :param path: the pack file
+    :type path: str
+    :param output_dir: the directory the members are written to
+    :type output_dir: str
+    :param names: extract these members only
+    :type names: str[]
+    :raise dbdust.pack.DbDustPackException: if a member is corrupted
+    :return: the paths of the extracted members
+    :rtype: str[]
+    """
+    paths = []
+    with open(path, 'rb') as pack_file:
+        members = read_index(file_range_reader(pack_file))
+        if names is not None:
+            members = [find_member(members, name) for name in names]
+        for member in members:
+            pack_file.seek(member['offset'])
+            reader = MemberReader(pack_file, member['size'])
+            member_path = os.path.join(output_dir, os.path.basename(member['name']))
+            with open(member_path, 'wb') as member_file:
+                shutil.copyfileobj(reader, member_file, COPY_SIZE)
+            if reader.hash.hexdigest() != member['sha256']:
+                raise DbDustPackException('{} is corrupted'.format(member['name']))
+            paths.append(member_path)
+    return paths
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" In process data path between the dump command and the dump file """
+
+import bz2
+import collections
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+#: default size of each read from the dump command output
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+#: default number of buffers of a shared pool
+DEFAULT_POOL_BUFFERS = 4
+
+
+class DbDustPipelineException(Exception):
+    """ Base exception for all pipeline exception """
+    pass
+
+
+def _zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+#: codecs usable in the pipeline. Each chunk is compressed as an independent
+#: gzip member / bzip2 stream / zstd frame, the concatenation is readable by the standard tools
+CODECS = {
+    'gzip': {'compress': lambda data, level: gzip.compress(data, compresslevel=level),
+             'min_level': 1, 'max_level': 9, 'default_level': 6},
+    'bzip2': {'compress': lambda data, level: bz2.compress(data, compresslevel=level),
+              'min_level': 1, 'max_level': 9, 'default_level': 9},
+    'zstd': {'compress': _zstd_compress,
+             'min_level': 1, 'max_level': 19, 'default_level': 3},
+}
+
+
+class BufferPool(object):
+    """ Fixed set of preallocated buffers reused for each chunk of the data path
+
+    The memory used by the data path is bounded by the pool : a consumer waits for a
+    buffer to be released when all of them are in use.
+
+    :param buffer_size: size of each buffer
+    :type buffer_size: int
+    :param count: number of buffers
+    :type count: int
+    """
+
+    def __init__(self, buffer_size, count=DEFAULT_POOL_BUFFERS):
+        if count < 1:
+            raise ValueError('buffer pool needs at least one buffer')
+        self.buffer_size = buffer_size
+        self.count = count
+        self.buffers = collections.deque(bytearray(buffer_size) for _ in range(count))
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """ Take a buffer from the pool, waiting for one to be released if needed
+
+        :rtype: bytearray
+        """
+        with self.condition:
+            while not self.buffers:
+                self.condition.wait()
+            return self.buffers.pop()
+
+    def release(self, buffer):
+        """ Give a buffer back to the pool, it must not be used by the caller anymore
+
+        :param buffer: a buffer taken with :meth:`acquire`
+        :type buffer: bytearray
+        """
+        with self.condition:
+            self.buffers.append(buffer)
+            self.condition.notify()
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(buffer_size, count=None):
+    """ Get the process wide pool of buffers of `buffer_size` bytes
+
+    Concurrent jobs using the same buffer size share the same buffers. The count of the
+    first caller is used.
+
+    :param buffer_size: size of each buffer
+    :type buffer_size: int
+    :param count: number of buffers (default to :data:`DEFAULT_POOL_BUFFERS`)
+    :type count: int
+    :rtype: dbdust.pipeline.BufferPool
+    """
+    with _shared_pools_lock:
+        if buffer_size not in _shared_pools:
+            _shared_pools[buffer_size] = BufferPool(buffer_size, count or DEFAULT_POOL_BUFFERS)
+        return _shared_pools[buffer_size]
+
+
+def readinto_full(fileobj, view):
+    """ Fill a buffer from a file object, unlike `readinto` only a short read means end of file
+
+    :param fileobj: the file object to read from
+    :param view: the buffer to fill
+    :type view: memoryview
+    :return: the number of bytes read
+    :rtype: int
+    """
+    filled = 0
+    while filled < len(view):
+        count = fileobj.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+class Stage(object):
+    """ Base class of a transformation applied to each chunk of the dump """
+
+    def process(self, chunk):
+        """ Transform a chunk
+
+        The chunk is a view on a pooled buffer reused once the result is written : a stage
+        keeping data for later must copy it.
+
+        :param chunk: data read from the dump command
+        :type chunk: memoryview
+        :return: the transformed data
+        :rtype: bytes or memoryview
+        """
+        return chunk
+
+    def flush(self):
+        """ Called once the dump command output is exhausted
+
+        :return: remaining data to write
+        :rtype: bytes
+        """
+        return b''
+
+    def feedback(self, read_time, write_time):
+        """ Called after each chunk with the time spent waiting for the dumper and writing the result
+
+        :param read_time: seconds spent reading the chunk from the dump command
+        :type read_time: float
+        :param write_time: seconds spent writing the chunk to the destination
+        :type write_time: float
+        """
+        pass
+
+    def report(self):
+        """ Information added to the run report
+
+        :rtype: dict
+        """
+        return {}
+
+    def close(self):
+        """ Release the resources of the stage, called at the end of the dump even if it failed """
+        pass
+
+
+class AdaptiveLevel(object):
+    """ Choose a compression level per chunk from the measured pipeline throughput
+
+    The time spent compressing a chunk is compared to the time spent waiting for the
+    dumper and writing the result :
+
+    * the compressor is the bottleneck : less compression
+    * the dumper or the destination is the bottleneck : compression is free, more compression
+
+    :param level: initial level
+    :type level: int
+    :param min_level: lowest level allowed
+    :type min_level: int
+    :param max_level: highest level allowed
+    :type max_level: int
+    """
+
+    #: compression is considered the bottleneck above this ratio of the other stages time
+    SLOWER_RATIO = 1.0
+    #: compression is considered free below this ratio of the other stages time
+    FASTER_RATIO = 0.5
+
+    def __init__(self, level, min_level, max_level):
+        self.level = level
+        self.min_level = min_level
+        self.max_level = max_level
+
+    def update(self, compress_time, read_time, write_time):
+        """ Compute the level of the next chunk
+
+        :return: the new level
+        :rtype: int
+        """
+        other_time = max(read_time, write_time)
+        if compress_time > other_time * self.SLOWER_RATIO:
+            self.level = max(self.min_level, self.level - 1)
+        elif compress_time < other_time * self.FASTER_RATIO:
+            self.level = min(self.max_level, self.level + 1)
+        return self.level
+
+
+class CompressStage(Stage):
+    """ Compress each chunk with a fixed or adaptive level
+
+    :param codec: one of :data:`CODECS` keys
+    :type codec: str
+    :param level: compression level, `adaptive` or None for the codec default
+    :type level: str
+    :param min_level: lowest level in adaptive mode (default to the codec min)
+    :type min_level: int
+    :param max_level: highest level in adaptive mode (default to the codec max)
+    :type max_level: int
+    """
+
+    def __init__(self, codec, level=None, min_level=None, max_level=None):
+        if codec not in CODECS:
+            raise DbDustPipelineException('pipeline : {} compression not supported'.format(codec))
+        if codec == 'zstd' and zstandard is None:
+            raise DbDustPipelineException('pipeline : zstandard package is needed for zstd compression')
+        codec_conf = CODECS[codec]
+        self.codec = codec
+        self.compress = codec_conf['compress']
+        min_level = int(min_level) if min_level is not None else codec_conf['min_level']
+        max_level = int(max_level) if max_level is not None else codec_conf['max_level']
+
+        self.adaptive = None
+        if level == 'adaptive':
+            self.level = codec_conf['default_level']
+            self.adaptive = AdaptiveLevel(min(max(self.level, min_level), max_level), min_level, max_level)
+            self.level = self.adaptive.level
+        elif level is not None:
+            self.level = int(level)
+        else:
+            self.level = codec_conf['default_level']
+
+        self.levels = collections.Counter()
+        self.last_compress_time = 0
+
+    def process(self, chunk):
+        start = time.monotonic()
+        result = self.compress(chunk, self.level)
+        self.last_compress_time = time.monotonic() - start
+        self.levels[self.level] += 1
+        return result
+
+    def feedback(self, read_time, write_time):
+        if self.adaptive is not None:
+            self.level = self.adaptive.update(self.last_compress_time, read_time, write_time)
+
+    def report(self):
+        return {'codec': self.codec, 'compression_levels': dict(self.levels)}
+
+
+class ChecksumStage(Stage):
+    """ Compute the sha256 of the data written to the dump file (must be the last stage) """
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def process(self, chunk):
+        self.hash.update(chunk)
+        return chunk
+
+    def report(self):
+        return {'sha256': self.hash.hexdigest()}
+
+
+class DumpPipeline(object):
+    """ Route the output of the dump command through dbdust before it reaches the dump file
+
+    The dump command writes into a named pipe instead of the dump file. dbdust reads the
+    pipe chunk by chunk, applies the stages and writes the result to the dump file. As the
+    pipe has a limited size, a slow reader slows down the dump command.
+
+    :param dest_path: path of the final dump file
+    :type dest_path: str
+    :param bucket: token bucket limiting the read throughput from the pipe
+    :type bucket: dbdust.throttle.TokenBucket
+    :param chunk_size: size of each read from the pipe
+    :type chunk_size: int
+    :param stages: transformations applied in order to each chunk
+    :type stages: dbdust.pipeline.Stage[]
+    :param dest_file: writable file object used instead of the dump file (closed at the end of the dump)
+    :param pool: pool of buffers the pipe is read into (default to a pool of one buffer of `chunk_size`)
+    :type pool: dbdust.pipeline.BufferPool
+    """
+
+    def __init__(self, dest_path, bucket=None, chunk_size=DEFAULT_CHUNK_SIZE, stages=None, dest_file=None,
+                 pool=None):
+        self.dest_path = dest_path
+        self.dest_file = dest_file
+        self.fifo_path = '{}.fifo'.format(dest_path)
+        self.bucket = bucket
+        self.pool = pool or BufferPool(chunk_size or DEFAULT_CHUNK_SIZE, 1)
+        self.chunk_size = min(chunk_size or DEFAULT_CHUNK_SIZE, self.pool.buffer_size)
+        self.stages = stages or []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._read_fd = None
+        self._keepalive_fd = None
+
+    def prepare(self):
+        """ Create and open the named pipe. Must be called before the dump command starts.
+
+        dbdust keeps a write end open itself so reading never blocks on open and never
+        reaches end of file before the dump command exits (even if it never opens the pipe).
+
+        :return: the path the dump command must write to
+        :rtype: str
+        """
+        os.mkfifo(self.fifo_path)
+        self._read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        self._keepalive_fd = os.open(self.fifo_path, os.O_WRONLY)
+        os.set_blocking(self._read_fd, True)
+        return self.fifo_path
+
+    def cleanup(self):
+        """ Close and remove the named pipe prepared for a dump command which could not be started
+
+        Once :meth:`run` is called, it closes and removes the pipe itself.
+        """
+        for fd in (self._read_fd, self._keepalive_fd):
+            if fd is not None:
+                os.close(fd)
+        self._read_fd = self._keepalive_fd = None
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
+        if self.dest_file is not None:
+            self.dest_file.close()
+        self._close_stages()
+
+    def run(self, process):
+        """ Consume the pipe until the dump command exits
+
+        :param process: the running dump command
+        :type process: subprocess.Popen
+        :return: the exit code of the dump command
+        :rtype: int
+        """
+        watcher = threading.Thread(target=self._release_on_exit, args=(process,), daemon=True)
+        watcher.start()
+        try:
+            self._copy()
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            watcher.join()
+            os.remove(self.fifo_path)
+            if self.dest_file is not None:
+                self.dest_file.close()
+            self._close_stages()
+        return process.returncode
+
+    def report(self):
+        """ Information about the pipeline added to the run report
+
+        :rtype: dict
+        """
+        report = {'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+        for stage in self.stages:
+            report.update(stage.report())
+        return report
+
+    def _release_on_exit(self, process):
+        """ Close the dbdust write end once the dump command is done so the reader gets end of file """
+        process.wait()
+        os.close(self._keepalive_fd)
+
+    def consume(self, chunks):
+        """ Run the stages on a dump produced in process instead of the output of a dump command
+
+        The chunks are gathered in a pooled buffer so the stages get chunks of `chunk_size`
+        bytes whatever the size of the produced ones.
+
+        :param chunks: iterable of the parts of the dump (see :mod:`dbdust.native`)
+        """
+        try:
+            self._consume(chunks)
+        finally:
+            self._close_stages()
+
+    def _consume(self, chunks):
+        dst = self.dest_file if self.dest_file is not None else open(self.dest_path, 'wb')
+        with dst:
+            buffer = None
+            try:
+                size = 0
+                start = time.monotonic()
+                for data in chunks:
+                    offset = 0
+                    while offset < len(data):
+                        if buffer is None:
+                            # a buffer is only held while a chunk is gathered, the other jobs get it in between
+                            buffer = self.pool.acquire()
+                        count = min(len(data) - offset, self.chunk_size - size)
+                        with memoryview(buffer) as view:
+                            view[size:size + count] = data[offset:offset + count]
+                        size += count
+                        offset += count
+                        if size == self.chunk_size:
+                            self._write_buffer(dst, buffer, size, time.monotonic() - start)
+                            self.pool.release(buffer)
+                            buffer = None
+                            size = 0
+                            start = time.monotonic()
+                if size:
+                    self._write_buffer(dst, buffer, size, time.monotonic() - start)
+            finally:
+                if buffer is not None:
+                    self.pool.release(buffer)
+            self._flush(dst)
+
+    def _write_buffer(self, dst, buffer, size, read_time):
+        with memoryview(buffer) as view:
+            self._write(dst, view[:size], read_time)
+
+    def _copy(self):
+        """ Copy the content of the pipe to the dump file through the stages
+
+        The pipe is read into a pooled buffer, the stages get a view on it so the data
+        is not copied when a stage does not transform it.
+        """
+        dst = self.dest_file if self.dest_file is not None else open(self.dest_path, 'wb')
+        with open(self._read_fd, 'rb', buffering=0) as src, dst:
+            while True:
+                buffer = self.pool.acquire()
+                try:
+                    with memoryview(buffer) as view:
+                        start = time.monotonic()
+                        size = readinto_full(src, view[:self.chunk_size])
+                        if not size:
+                            break
+                        self._write(dst, view[:size], time.monotonic() - start)
+                finally:
+                    self.pool.release(buffer)
+            self._flush(dst)
+
+    def _close_stages(self):
+        for stage in self.stages:
+            stage.close()
+
+    def _write(self, dst, chunk, read_time):
+        """ Apply the stages to a chunk and write the result
+
+        :param dst: the dump file
+        :param chunk: view on the data read
+        :type chunk: memoryview
+        :param read_time: seconds spent getting the chunk
+        :type read_time: float
+        """
+        if self.bucket is not None:
+            start = time.monotonic()
+            self.bucket.consume(len(chunk))
+            read_time += time.monotonic() - start
+        self.bytes_read += len(chunk)
+        for stage in self.stages:
+            chunk = stage.process(chunk)
+
+        start = time.monotonic()
+        dst.write(chunk)
+        write_time = time.monotonic() - start
+        self.bytes_written += len(chunk)
+        del chunk
+        for stage in self.stages:
+            stage.feedback(read_time, write_time)
+
+    def _flush(self, dst):
+        """ Write the data kept by the stages at the end of the dump """
+        for index, stage in enumerate(self.stages):
+            chunk = stage.flush()
+            for next_stage in self.stages[index + 1:]:
+                chunk = next_stage.process(chunk) if chunk else chunk
+            if chunk:
+                dst.write(chunk)
+                self.bytes_written += len(chunk)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Choice of the replicas a dump is read from, to offload the primary
+
+Each candidate host is probed with the `replica_status` function of the source (see
+:data:`dbdust.dumper.dumper_config`), which returns :
+
+* `replica` : the server replicates from a primary
+* `lag` : replication lag in seconds, None if unknown (replication stopped)
+* `load` : current load of the server (running threads, active clients)
+
+The replicas within the lag threshold are used, the least loaded first. When none is,
+the dump is read from the configured host (the primary).
+"""
+
+import concurrent.futures
+
+#: default max replication lag in seconds of a replica used for a dump
+DEFAULT_MAX_LAG = 60
+
+
+def parse_hosts(value):
+    """ Parse a comma separated list of `host[:port]`
+
+    :param value: the list (ex : `db2:3307, db3`)
+    :type value: str
+    :return: the connection settings (`host` and, if set, `port`) of each host
+    :rtype: dict[]
+    """
+    hosts = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(':') if ':' in item else (item, None, None)
+        hosts.append({'host': host, 'port': port} if port else {'host': host})
+    return hosts
+
+
+def probe(logger, candidates, replica_status, settings):
+    """ Get the replication status of each candidate, concurrently
+
+    :param logger: main program logger
+    :param candidates: connection settings of each candidate (see :func:`parse_hosts`)
+    :type candidates: dict[]
+    :param replica_status: the `replica_status` function of the source
+    :type replica_status: callable
+    :param settings: the source settings, the candidate settings replace its `host` and `port`
+    :type settings: dict
+    :return: the status of each candidate (with its settings and an `error`, None if the probe succeeded)
+    :rtype: dict[]
+    """
+    def probe_candidate(candidate):
+        status = {'replica': False, 'lag': None, 'load': None, 'error': None}
+        try:
+            status.update(replica_status(**dict(settings, **candidate)))
+        except Exception as e:
+            status['error'] = str(e)
+            logger.warning('replicas : {} unavailable : {}'.format(candidate['host'], str(e)))
+        status.update(candidate)
+        logger.debug('replicas : {}'.format(status))
+        return status
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(candidates))) as executor:
+        return list(executor.map(probe_candidate, candidates))
+
+
+def eligible(statuses, max_lag=DEFAULT_MAX_LAG):
+    """ Keep the replicas within the lag threshold, the least loaded first
+
+    :param statuses: result of :func:`probe`
+    :type statuses: dict[]
+    :param max_lag: max replication lag in seconds
+    :type max_lag: float
+    :rtype: dict[]
+    """
+    replicas = [status for status in statuses
+                if status['error'] is None and status['replica'] and status['lag'] is not None and
+                status['lag'] <= max_lag]
+    return sorted(replicas, key=lambda status: (status['load'] if status['load'] is not None else float('inf'),
+                                                status['lag']))
+
+
+def select(logger, candidates, replica_status, settings, max_lag=DEFAULT_MAX_LAG):
+    """ Choose the replicas the dump is read from
+
+    :param logger: main program logger
+    :param candidates: connection settings of each candidate (see :func:`parse_hosts`)
+    :type candidates: dict[]
+    :param replica_status: the `replica_status` function of the source
+    :type replica_status: callable
+    :param settings: the source settings
+    :type settings: dict
+    :param max_lag: max replication lag in seconds
+    :type max_lag: float
+    :return: the connection settings of the replicas to use, the least loaded first (empty if none can be used)
+    :rtype: dict[]
+    """
+    replicas = eligible(probe(logger, candidates, replica_status, settings), max_lag)
+    for replica in replicas:
+        logger.info('replicas : {} eligible, lag {} seconds, load {}'.format(
+            replica['host'], replica['lag'], replica['load']))
+    return [{key: replica[key] for key in ('host', 'port') if key in replica} for replica in replicas]
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Rotation of the jobs sharing a storage location with a single listing
+
+Jobs storing to the same local folder, container or bucket prefix with different
+`file_prefix` each list the whole location to rotate their backups. The coordinator lists
+it once, gives each job the files of its prefix, applies the retention of each job to its
+files and deletes the files of all the jobs in one pass (batched if the storage supports it).
+
+A file belongs to the job with the longest prefix it starts with : the files of the job
+`backup-db2-` start with the prefix of the job `backup-` but are not given to it.
+"""
+
+import bisect
+import os
+
+
+class PrefixIndex(object):
+    """ Sorted index of the file prefixes of the jobs, finding the longest prefix of a name
+
+    :param prefixes: the file prefixes
+    :type prefixes: str[]
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = sorted(set(prefixes))
+
+    def match(self, name):
+        """ Get the longest prefix a name starts with
+
+        :param name: the name (ex : a file name)
+        :type name: str
+        :return: the prefix, None if the name starts with none of them
+        :rtype: str
+        """
+        key = name
+        end = len(self.prefixes)
+        while end:
+            index = bisect.bisect_right(self.prefixes, key, 0, end)
+            if index == 0:
+                return None
+            prefix = self.prefixes[index - 1]
+            if name.startswith(prefix):
+                return prefix
+            # the other prefixes of the name are prefixes of the part it has in common with this one
+            key = os.path.commonprefix([prefix, name])
+            end = index - 1
+        return None
+
+    def split(self, items, key='file_name'):
+        """ Group items by the longest prefix of one of their values
+
+        :param items: the items (ex : the files listed by a storage)
+        :type items: dict[]
+        :param key: the key of the value matched
+        :type key: str
+        :return: prefix -> items starting with it, the items matching no prefix are left out
+        :rtype: dict
+        """
+        groups = {prefix: [] for prefix in self.prefixes}
+        for item in items:
+            prefix = self.match(item[key])
+            if prefix is not None:
+                groups[prefix].append(item)
+        return groups
+
+
+class RotationCoordinator(object):
+    """ Rotate the backups of several jobs sharing a storage location
+
+    :param logger: main program logger
+    :type logger: logging.Logger
+    :param handlers: the storage handlers of the jobs, using the same storage location
+    :type handlers: dbdust.storage.StorageHandler[]
+    """
+
+    def __init__(self, logger, handlers):
+        self.logger = logger
+        self.handlers = []
+        prefixes = set()
+        for handler in handlers:
+            if handler.file_prefix in prefixes:
+                logger.warning('rotation : {} is rotated once'.format(handler.file_prefix))
+                continue
+            prefixes.add(handler.file_prefix)
+            self.handlers.append(handler)
+
+    def run(self):
+        """ Rotate the backups of all the jobs
+
+        The jobs of a storage supporting partitions are rotated one by one, each one only lists
+        its own partitions.
+
+        :return: the number of files deleted in the shared pass (the partitions deleted whole are not counted)
+        :rtype: int
+        """
+        shared = [handler for handler in self.handlers if not handler.partitioned]
+        for handler in self.handlers:
+            if handler.partitioned:
+                handler.rotate()
+        if not shared:
+            return 0
+        listed = shared[0].storage_impl.list()
+        self.logger.info('rotation : {} files listed for {} jobs'.format(len(listed), len(shared)))
+        groups = PrefixIndex(handler.file_prefix for handler in shared).split(listed)
+        to_delete = []
+        to_demote = []
+        for handler in shared:
+            job_delete, job_demote, _ = handler.retention(handler.backups_of(groups[handler.file_prefix]))
+            self.logger.info('rotation : {} files to delete, {} files to demote for {}'.format(
+                len(job_delete), len(job_demote), handler.file_prefix))
+            to_delete.extend(job_delete)
+            to_demote.append((handler, job_demote))
+        shared[0].delete(to_delete)
+        for handler, item_ids in to_demote:
+            handler.demote(item_ids)
+        return len(to_delete)
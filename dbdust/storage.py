@@ -9,12 +9,38 @@
 
 """ Storage handler and implementation to send backup to supported destination and rotate old backup """
 
+import base64
+import collections
+import concurrent.futures
 import datetime
+import hashlib
+import io
+import json
 import os
+import re
+import shutil
+import threading
 
-from azure.storage.blob import BlockBlobService
+from azure.storage.blob import BlobBlock, BlockBlobService
 from dateutil.relativedelta import relativedelta
 
+try:
+    import boto3
+    import botocore.exceptions
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = None
+
+from dbdust import cacheio
+from dbdust import pack
+from dbdust.throttle import ThrottledReader
+from dbdust.utils import parse_size
+
+
+#: parts of a split backup are stored as `<backup file name>.partNNNN`
+PART_PATTERN = re.compile(r'^(?P<file_name>.+)\.part(?P<index>\d{4,})$')
+#: the manifest of a split backup is stored as `<backup file name>.manifest`, after all its parts
+MANIFEST_SUFFIX = '.manifest'
+
 
 class StorageHandler(object):
     """ Implements the logic of storage rotation
@@ -42,6 +68,10 @@ class StorageHandler(object):
         self.date_format = date_format
         self.max_per_day = max_per_day
         self.days_to_keep = self._build_day_to_keep(daily_retain, weekly_retain, monthly_retain)
+        self.hot_days = self._build_day_to_keep(daily_retain, 0, 0)
+        self.partitioned = getattr(storage_impl, 'supports_partitions', False) is True
+        if self.partitioned:
+            storage_impl.set_partitioner(file_prefix, self.file_day)
 
     @staticmethod
     def _build_day_to_keep(daily, weekly, monthly):
@@ -68,32 +98,324 @@ class StorageHandler(object):
             days_to_keep[first_day_month - relativedelta(months=i)] = 0
         return days_to_keep
 
-    def _get_sorted_backup_files_list(self):
+    def _get_sorted_backup_files_list(self, days=None):
         """ Get a list of all files available in the storage and store it per date
 
+        Files without the file prefix belong to other jobs and are ignored.
+
+        :param days: list the partitions of these days only (storage supporting partitions only)
+        :type days: datetime.date[]
         :return: sorted (datetime in file name desc) list of items of dict type.
             Each item is a file in the storage
         :rtype: list
         """
-        backup_list = self.storage_impl.list()
-        for item in backup_list:
-            item.update({'date': self.extract_date_from_file_name(item['file_name'])})
+        if self.partitioned:
+            listed = self.storage_impl.list(days=days, file_prefix=self.file_prefix)
+        else:
+            listed = self.storage_impl.list()
+        return self.backups_of(listed)
+
+    def backups_of(self, items):
+        """ Get the backups of this job among the files listed by the storage
+
+        Files without the file prefix, or without a date after it, belong to other jobs and are
+        ignored (the files of the job `backup-db2-` start with the prefix of the job `backup-`).
+
+        :param items: the files listed by the storage
+        :type items: dict[]
+        :return: sorted (datetime in file name desc) list of items of dict type
+        :rtype: list
+        """
+        backup_list = []
+        for item in self._group_split_backups([item for item in items
+                                               if item['file_name'].startswith(self.file_prefix)]):
+            try:
+                item.update({'date': self.extract_date_from_file_name(item['file_name'])})
+            except ValueError:
+                continue
+            backup_list.append(item)
         backup_list.sort(key=lambda r: r['date'], reverse=True)
         return backup_list
 
-    def save(self, file_path):
-        """ Wrapper around the store implementation for the storage """
-        return self.storage_impl.store(file_path)
+    @staticmethod
+    def _group_split_backups(items):
+        """ Merge the parts and the manifest of each split backup into a single item
+
+        The item of a split backup has the name of the backup as file_name, the id of its
+        manifest (or of its first part if the manifest is missing), the ids of its parts in
+        order in `parts` and the ids of all its files in `ids`.
+
+        :param items: the files listed by the storage
+        :type items: dict[]
+        :rtype: dict[]
+        """
+        result = []
+        groups = collections.OrderedDict()
+        for item in items:
+            match = PART_PATTERN.match(item['file_name'])
+            if match is not None:
+                group = groups.setdefault(match.group('file_name'), {'parts': [], 'manifest': None})
+                group['parts'].append((int(match.group('index')), item))
+            elif item['file_name'].endswith(MANIFEST_SUFFIX):
+                group = groups.setdefault(item['file_name'][:-len(MANIFEST_SUFFIX)], {'parts': [], 'manifest': None})
+                group['manifest'] = item
+            else:
+                result.append(item)
+        for file_name, group in groups.items():
+            parts = [item for _, item in sorted(group['parts'], key=lambda p: p[0])]
+            files = parts + ([group['manifest']] if group['manifest'] is not None else [])
+            result.append({'id': files[-1]['id'] if group['manifest'] is not None else files[0]['id'],
+                           'file_name': file_name,
+                           'manifest': group['manifest']['id'] if group['manifest'] is not None else None,
+                           'parts': [item['id'] for item in parts],
+                           'ids': [item['id'] for item in files],
+                           'cold': all(item.get('cold') for item in files)})
+        return result
+
+    def open_stream(self, item):
+        """ Open a stored backup for reading, the parts of a split backup are read in sequence
+
+        :param item: an item of :meth:`_get_sorted_backup_files_list`
+        :type item: dict
+        :raise dbdust.storage.DbDustStorageException: if a split backup has no manifest
+        :return: a readable file object
+        """
+        if 'parts' not in item:
+            return self.storage_impl.open_stream(item['id'])
+        if item['manifest'] is None:
+            raise DbDustStorageException('{} has no manifest, the upload is incomplete'.format(item['file_name']))
+        part_names = [part['file_name'] for part in self.read_manifest(item)['parts']]
+        own_prefix = '{}.part'.format(item['file_name'])
+        if all(name.startswith(own_prefix) for name in part_names):
+            return PartsReader(self.storage_impl, item['parts'])
+        # parts shared with previous backups
+        ids = {stored['file_name']: stored['id'] for stored in self.storage_impl.list()}
+        for name in part_names:
+            if name not in ids:
+                raise DbDustStorageException('{} needs {} which is not in the storage'.format(item['file_name'], name))
+        return PartsReader(self.storage_impl, [ids[name] for name in part_names])
+
+    def read_range(self, item, offset, size):
+        """ Read a range of a stored backup (the whole backup is read if the storage can not read a range)
+
+        :param item: an item of :meth:`_get_sorted_backup_files_list` (not a split backup)
+        :type item: dict
+        :param offset: position of the range, from the end of the backup if negative
+        :type offset: int
+        :param size: size of the range
+        :type size: int
+        :rtype: bytes
+        """
+        if size <= 0:
+            return b''
+        if getattr(self.storage_impl, 'supports_range', False) is True:
+            return self.storage_impl.read_range(item['id'], offset, size)
+        with self.storage_impl.open_stream(item['id']) as stream:
+            data = stream.read()
+        if offset < 0:
+            offset = max(0, len(data) + offset)
+        return data[offset:offset + size]
+
+    def read_pack_index(self, item):
+        """ Read the index of a stored pack
+
+        :param item: an item of :meth:`_get_sorted_backup_files_list` of a pack
+        :type item: dict
+        :return: the index entry of each member (see :func:`pack.read_index`)
+        :rtype: dict[]
+        """
+        return pack.read_index(lambda offset, size: self.read_range(item, offset, size))
+
+    def read_member(self, item, name):
+        """ Read a member of a stored pack, only the index and the member are read
+
+        :param item: an item of :meth:`_get_sorted_backup_files_list` of a pack
+        :type item: dict
+        :param name: name of the member
+        :type name: str
+        :raise pack.DbDustPackException: if the member is corrupted
+        :rtype: bytes
+        """
+        member = pack.find_member(self.read_pack_index(item), name)
+        data = self.read_range(item, member['offset'], member['size'])
+        if hashlib.sha256(data).hexdigest() != member['sha256']:
+            raise pack.DbDustPackException('{} is corrupted'.format(name))
+        return data
+
+    def read_manifest(self, item):
+        """ Read the manifest of a split backup
+
+        :param item: an item of :meth:`_get_sorted_backup_files_list` with a manifest
+        :type item: dict
+        :rtype: dict
+        """
+        with self.storage_impl.open_stream(item['manifest']) as stream:
+            return json.loads(stream.read().decode())
+
+    def _referenced_backups(self, items, backup_list=None):
+        """ Get the backups whose parts are shared by the given backups
+
+        A backup sharing parts of an older one needs it : the needs of the needed backups are
+        followed too.
+
+        :param items: items of :meth:`_get_sorted_backup_files_list`
+        :type items: dict[]
+        :param backup_list: all the backups of the job (default to a listing of the storage)
+        :type backup_list: dict[]
+        :return: the file names of the needed backups
+        :rtype: set
+        """
+        referenced = set()
+        to_read = [item for item in items if item.get('manifest') is not None]
+        if not to_read:
+            return referenced
+        if backup_list is None:
+            backup_list = self._get_sorted_backup_files_list()
+        by_name = {item['file_name']: item for item in backup_list}
+        while to_read:
+            item = to_read.pop()
+            for part in self.read_manifest(item)['parts']:
+                match = PART_PATTERN.match(part['file_name'])
+                owner = match.group('file_name') if match is not None else item['file_name']
+                if owner == item['file_name'] or owner in referenced:
+                    continue
+                referenced.add(owner)
+                needed = by_name.get(owner)
+                if needed is not None and needed.get('manifest') is not None:
+                    to_read.append(needed)
+        return referenced
+
+    def split_writer(self, file_path, part_size, workers=None):
+        """ Create a writer storing the data written to it as a split backup
+
+        :param file_path: path of the backup in the tmp dir (parts are written next to it)
+        :type file_path: str
+        :param part_size: size of each part
+        :type part_size: int
+        :param workers: number of parts uploaded at the same time
+        :type workers: int
+        :rtype: dbdust.storage.SplitWriter
+        """
+        return SplitWriter(self, file_path, part_size, workers)
+
+    def save(self, file_path, journal=None):
+        """ Wrapper around the store implementation for the storage
+
+        :param file_path: file to store
+        :type file_path: str
+        :param journal: journal used by the storage to persist (and resume) the upload progress
+        :type journal: dbdust.journal.UploadJournal
+        """
+        if journal is None:
+            return self.storage_impl.store(file_path)
+        return self.storage_impl.store(file_path, journal=journal)
+
+    def save_stream(self, stream, file_name):
+        """ Wrapper around the stream store implementation for the storage
+
+        :param stream: readable file object, read until end of file
+        :param file_name: name of the stored file
+        :type file_name: str
+        """
+        return self.storage_impl.store_stream(stream, file_name)
 
     def rotate(self):
-        """ Rotate the file kept in storage (remove old files) """
-        backup_list = self._get_sorted_backup_files_list()
+        """ Rotate the file kept in storage (remove old files)
+
+        If the storage has a cold tier, the files only kept for the weekly and monthly
+        retention are demoted to it.
+
+        If the storage supports partitions, only the partitions of the days kept are listed,
+        the partitions of the other days are deleted whole.
+        """
+        expired_days = []
+        if self.partitioned:
+            days = self.storage_impl.list_days(self.file_prefix)
+            expired_days = [day for day in days if day not in self.days_to_keep]
+            backup_list = self._get_sorted_backup_files_list([day for day in days if day in self.days_to_keep])
+        else:
+            backup_list = self._get_sorted_backup_files_list()
+        to_delete, to_demote, referenced = self.retention(backup_list, expired_days)
+        self.delete(to_delete)
+        self.demote(to_demote)
+        if expired_days:
+            self._delete_days(expired_days, referenced)
+
+    def retention(self, backup_list, expired_days=None):
+        """ Apply the retention to the backups of this job, nothing is deleted
+
+        :param backup_list: the backups of the job (see :meth:`backups_of`), of the days kept only
+            if the storage supports partitions
+        :type backup_list: dict[]
+        :param expired_days: days of the partitions out of the retention, not listed
+        :type expired_days: datetime.date[]
+        :return: the ids of the files to delete, the ids of the files to demote to the cold tier and the
+            file names of the backups whose parts are shared by the kept backups
+        :rtype: tuple
+        """
+        days_to_keep = dict(self.days_to_keep)
+        to_keep = []
+        to_delete = []
+        to_demote = []
         for item in backup_list:
             item_date = item['date'].date()
-            if item_date in self.days_to_keep:
-                self.days_to_keep[item_date] += 1
-            if item_date not in self.days_to_keep or self.days_to_keep[item_date] > self.max_per_day:
-                self.storage_impl.delete(item['id'])
+            if item_date in days_to_keep:
+                days_to_keep[item_date] += 1
+            if item_date not in days_to_keep or days_to_keep[item_date] > self.max_per_day:
+                to_delete.append(item)
+            else:
+                to_keep.append(item)
+                if item_date not in self.hot_days and not item.get('cold'):
+                    to_demote.append(item)
+        referenced = set()
+        if expired_days or any('parts' in item for item in to_delete + to_demote):
+            # backups whose parts are shared by the kept backups are kept hot
+            referenced = self._referenced_backups(to_keep, None if self.partitioned else backup_list)
+            to_delete = [item for item in to_delete if item['file_name'] not in referenced]
+            to_demote = [item for item in to_demote if item['file_name'] not in referenced]
+        return ([item_id for item in to_delete for item_id in item.get('ids', [item['id']])],
+                [item_id for item in to_demote for item_id in item.get('ids', [item['id']])], referenced)
+
+    def _delete_days(self, days, referenced):
+        """ Delete the partitions of days out of the retention
+
+        The days of the backups whose parts are shared by the kept backups are listed and only
+        their other files are deleted.
+
+        :param days: the days to delete
+        :type days: datetime.date[]
+        :param referenced: file names of the backups whose parts are shared by the kept backups
+        :type referenced: set
+        """
+        referenced_days = {self.file_day(file_name) for file_name in referenced}
+        for day in days:
+            if day not in referenced_days:
+                self.storage_impl.delete_day(self.file_prefix, day)
+                continue
+            self.delete([item_id for item in self._get_sorted_backup_files_list([day])
+                         if item['file_name'] not in referenced for item_id in item.get('ids', [item['id']])])
+
+    def delete(self, item_ids):
+        """ Delete files from the storage, in a few requests if the storage supports it
+
+        :param item_ids: ids of the files to delete
+        :type item_ids: list
+        """
+        if getattr(self.storage_impl, 'supports_bulk_delete', False) is True:
+            self.storage_impl.delete_many(item_ids)
+        else:
+            for item_id in item_ids:
+                self.storage_impl.delete(item_id)
+
+    def demote(self, item_ids):
+        """ Move files to the cold tier of the storage, if it has one
+
+        :param item_ids: ids of the files to demote
+        :type item_ids: list
+        """
+        if getattr(self.storage_impl, 'supports_demote', False) is True:
+            for item_id in item_ids:
+                self.storage_impl.demote(item_id)
 
     def extract_date_from_file_name(self, file_name):
         """ Extract a python datetime based on the value in the name of a stored file
@@ -104,6 +426,188 @@ class StorageHandler(object):
         file_name = file_name[len(self.file_prefix):].split('.', 1)[0]
         return datetime.datetime.strptime(file_name, self.date_format)
 
+    def file_day(self, file_name):
+        """ Day of a stored file of this job
+
+        :return: the day in the file name, None if the file belongs to another job
+        :rtype: datetime.date
+        """
+        if not file_name.startswith(self.file_prefix):
+            return None
+        try:
+            return self.extract_date_from_file_name(file_name).date()
+        except ValueError:
+            return None
+
+
+def part_path(file_path, index):
+    """ Path of a part of a split backup
+
+    :param file_path: path (or name) of the backup
+    :type file_path: str
+    :param index: index of the part
+    :type index: int
+    :rtype: str
+    """
+    return '{}.part{:04d}'.format(file_path, index)
+
+
+class PartsReader(io.RawIOBase):
+    """ Raw readable file object reading several stored files one after the other
+
+    :param storage_impl: the storage implementation
+    :type storage_impl: dbdust.storage.BaseStorage
+    :param item_ids: ids of the files in order
+    :type item_ids: str[]
+    """
+
+    def __init__(self, storage_impl, item_ids):
+        super(PartsReader, self).__init__()
+        self.storage_impl = storage_impl
+        self.item_ids = list(item_ids)
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.current is None:
+                if not self.item_ids:
+                    return 0
+                self.current = self.storage_impl.open_stream(self.item_ids.pop(0))
+            data = self.current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        super(PartsReader, self).close()
+
+
+class SplitWriter(object):
+    """ File like object cutting the data written to it in parts uploaded while the next parts are written
+
+    Each full part is handed to a pool of upload threads. At most `workers` + 1 parts are on
+    the local disk at the same time : writing waits for an upload to finish when the storage is
+    slower than the dump. The backup is complete once :meth:`commit` stored the manifest.
+
+    :param storage_handler: the storage handler used to store the parts
+    :type storage_handler: dbdust.storage.StorageHandler
+    :param file_path: path of the backup in the tmp dir (parts are written next to it)
+    :type file_path: str
+    :param part_size: size of each part
+    :type part_size: int
+    :param workers: number of parts uploaded at the same time
+    :type workers: int
+    """
+
+    #: default number of parts uploaded at the same time
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, storage_handler, file_path, part_size, workers=None):
+        self.storage_handler = storage_handler
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.part_size = part_size
+        self.workers = workers or self.DEFAULT_WORKERS
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers + 1)
+        self.futures = []
+        self.parts = []
+        self.part_file = None
+        self.part_hash = None
+        self.part_written = 0
+
+    def _part_path(self, index):
+        return part_path(self.file_path, index)
+
+    def _open_part(self):
+        self.slots.acquire()
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                self.slots.release()
+                raise future.exception()
+        self.part_file = open(self._part_path(len(self.parts)), 'wb')
+        self.part_hash = hashlib.sha256()
+        self.part_written = 0
+
+    def _close_part(self):
+        self.part_file.close()
+        self.part_file = None
+        part_path = self._part_path(len(self.parts))
+        self.parts.append({'file_name': os.path.basename(part_path), 'size': self.part_written,
+                           'sha256': self.part_hash.hexdigest()})
+        self.futures.append(self.executor.submit(self._upload, part_path))
+
+    def _upload(self, part_path):
+        try:
+            self.storage_handler.save(part_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            self.slots.release()
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            if self.part_file is None:
+                self._open_part()
+            size = min(len(view), self.part_size - self.part_written)
+            self.part_file.write(view[:size])
+            self.part_hash.update(view[:size])
+            self.part_written += size
+            view = view[size:]
+            if self.part_written == self.part_size:
+                self._close_part()
+        return len(data)
+
+    def close(self):
+        """ Close the part being written, it is uploaded by :meth:`commit` """
+        if self.part_file is not None:
+            self.part_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def commit(self):
+        """ Upload the last part, wait for all uploads then store the manifest
+
+        :return: the manifest
+        :rtype: dict
+        """
+        if self.part_file is not None:
+            self._close_part()
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        manifest = {'file_name': self.file_name, 'size': sum(part['size'] for part in self.parts),
+                    'parts': self.parts}
+        manifest_path = '{}{}'.format(self.file_path, MANIFEST_SUFFIX)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        self.storage_handler.save(manifest_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return manifest
+
+    def abort(self):
+        """ Stop the uploads and remove the parts already stored """
+        self.close()
+        self.executor.shutdown(wait=True)
+        prefix = '{}.part'.format(self.file_name)
+        for item in self.storage_handler.storage_impl.list():
+            if item['file_name'].startswith(prefix):
+                self.storage_handler.storage_impl.delete(item['id'])
+
 
 class StorageFactory(type):
     """ metaclass for all storage implementation used as a registry """
@@ -129,6 +633,48 @@ class BaseStorage(object):
     """ Base class that all storage implementation extends """
     storage_type = None
 
+    #: token bucket limiting the upload throughput (see :func:`dbdust.throttle.get_shared_bucket`)
+    bucket = None
+
+    #: page cache use of the local files read and written (see :mod:`dbdust.cacheio`)
+    io_mode = 'buffered'
+    io_sync_size = None
+
+    #: the storage implements `store_stream` and can receive a dump without a local temp file
+    supports_stream = False
+
+    #: the storage implements `delete_many` to remove several files in a few requests
+    supports_bulk_delete = False
+
+    #: the storage has a cold tier configured and implements `demote` to move a file to it
+    #: without downloading it (files in the cold tier are listed with a `cold` key set to True)
+    supports_demote = False
+
+    #: the storage implements `read_range` to read a part of a file without reading all of it
+    supports_range = False
+
+    #: the storage stores the files of each job in day partitions (see `set_partitioner`), lists the partitions
+    #: of a job for some days only (`list(days=..., file_prefix=...)`, `list_days`) and deletes a whole one
+    #: (`delete_day`)
+    supports_partitions = False
+
+    def _open_local(self, file_path):
+        """ Open a local file to store in the I/O mode of the storage
+
+        :param file_path: file to store
+        :type file_path: str
+        :return: a readable file object
+        """
+        return cacheio.open_reader(file_path, self.io_mode, self.io_sync_size)
+
+    def free_space(self):
+        """ Free space available in the storage
+
+        :return: number of bytes or None if unknown / unlimited
+        :rtype: int
+        """
+        return None
+
     def __getattr__(self, name):
         """ catch all getter magic method to raise an exception if method is not found
 
@@ -138,9 +684,36 @@ class BaseStorage(object):
 
 
 class AzureBlocStorage(BaseStorage, metaclass=StorageFactory):
+    """ Azure blob storage implementation
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param account_name: storage account name
+    :type account_name: str
+    :param container: container to store files
+    :type container: str
+    :param account_key: storage account key (exclusive with account_sas)
+    :type account_key: str
+    :param account_sas: shared access signature (exclusive with account_key)
+    :type account_sas: str
+    :param block_size: size of the blocks of a resumable upload
+    :type block_size: str
+    :param parallelism: number of blocks of a resumable upload sent at the same time
+    :type parallelism: str
+    :param cold_tier: access tier (`Cool` or `Archive`) of the backups only kept for the weekly / monthly retention
+    :type cold_tier: str
+    """
     storage_type = 'azure_blob'
+    supports_stream = True
+    supports_range = True
 
-    def __init__(self, logger, account_name, container, account_key=None, account_sas=None):
+    #: default size of the blocks of a resumable upload
+    DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+    #: access tiers allowed as cold tier
+    COLD_TIERS = ('Cool', 'Archive')
+
+    def __init__(self, logger, account_name, container, account_key=None, account_sas=None, block_size=None,
+                 parallelism=2, cold_tier=None):
         if account_key is not None:
             account_auth = {'account_key': account_key}
         elif account_sas is not None:
@@ -154,24 +727,140 @@ class AzureBlocStorage(BaseStorage, metaclass=StorageFactory):
 
         self.container = container
         self.logger = logger
+        self.block_size = parse_size(block_size) or self.DEFAULT_BLOCK_SIZE
+        self.parallelism = int(parallelism)
+        if cold_tier is not None and cold_tier.capitalize() not in self.COLD_TIERS:
+            raise DbDustStorageException('azure_blob storage : cold_tier must be one of {}'.format(
+                ', '.join(self.COLD_TIERS)))
+        self.cold_tier = cold_tier.capitalize() if cold_tier is not None else None
+        self.supports_demote = self.cold_tier is not None
 
-    def store(self, file_path):
+    def store(self, file_path, journal=None):
         """ Move local temp file to azure blob container
 
         :param file_path: file to move
         :type file_path: str
+        :param journal: if set, upload block by block and persist the uploaded blocks to resume later
+        :type journal: dbdust.journal.UploadJournal
         """
         file_name = os.path.basename(file_path)
-        self.service.create_blob_from_path(self.container, file_name, file_path)
+        if journal is not None:
+            self._store_blocks(file_path, file_name, journal)
+        elif self.bucket is None and self.io_mode == 'buffered':
+            self.service.create_blob_from_path(self.container, file_name, file_path)
+        else:
+            with self._open_local(file_path) as src:
+                stream = src if self.bucket is None else ThrottledReader(src, self.bucket)
+                self.service.create_blob_from_stream(self.container, file_name, stream,
+                                                     count=os.path.getsize(file_path))
         self.logger.debug('azure_blob storage : backup stored to {} - {}'.format(self.container, file_name))
 
+    def store_stream(self, stream, file_name):
+        """ Upload a stream to azure blob container until its end of file
+
+        :param stream: readable file object
+        :param file_name: blob name
+        :type file_name: str
+        """
+        if self.bucket is not None:
+            stream = ThrottledReader(stream, self.bucket)
+        self.service.create_blob_from_stream(self.container, file_name, stream, max_connections=1)
+        self.logger.debug('azure_blob storage : backup streamed to {} - {}'.format(self.container, file_name))
+
+    def _store_blocks(self, file_path, file_name, journal):
+        """ Upload the file blocks concurrently, skipping the blocks recorded in the journal
+
+        Uploaded but uncommitted blocks are kept by azure for 7 days.
+
+        :param file_path: file to upload
+        :type file_path: str
+        :param file_name: blob name
+        :type file_name: str
+        :param journal: journal persisting the uploaded block ids and the block size
+        :type journal: dbdust.journal.UploadJournal
+        """
+        upload = journal.state.get('upload')
+        # the blocks recorded with another size do not match the file offsets, they are sent again
+        if upload is None or upload.get('block_size') != self.block_size:
+            upload = {'block_size': self.block_size, 'blocks': {}}
+            journal.update(upload=upload)
+        else:
+            self.logger.info('azure_blob storage : resume upload of {} ({} blocks done)'.format(
+                file_name, len(upload['blocks'])))
+        lock = threading.Lock()
+
+        def upload_block(index):
+            with self._open_local(file_path) as src:
+                src.seek(index * self.block_size)
+                data = src.read(self.block_size)
+            if self.bucket is not None:
+                self.bucket.consume(len(data))
+            block_id = base64.b64encode('{:08d}'.format(index).encode()).decode()
+            self.service.put_block(self.container, file_name, data, block_id)
+            with lock:
+                upload['blocks'][str(index)] = block_id
+                journal.update(upload=upload)
+
+        block_count = (os.path.getsize(file_path) + self.block_size - 1) // self.block_size
+        todo = [index for index in range(block_count) if str(index) not in upload['blocks']]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            for future in [executor.submit(upload_block, index) for index in todo]:
+                future.result()
+        block_list = [BlobBlock(id=upload['blocks'][str(index)]) for index in range(block_count)]
+        self.service.put_block_list(self.container, file_name, block_list)
+
     def list(self):
         """ List all files available in azure blob container
 
         :return: list of dict. Each dict has an id (used to reference the file later), a file_name
+            and a cold key if the blob is in the cold tier
         :type: dict[]
         """
-        return [{'id': item.name, 'file_name': item.name} for item in self.service.list_blobs(self.container)]
+        items = []
+        for blob in self.service.list_blobs(self.container):
+            item = {'id': blob.name, 'file_name': blob.name}
+            if self.cold_tier is not None and blob.properties.blob_tier == self.cold_tier:
+                item['cold'] = True
+            items.append(item)
+        return items
+
+    def open_stream(self, item_id):
+        """ Open a stored file for reading, the blob is downloaded by ranges while it is read
+
+        :param item_id: the blob name
+        :type item_id: str
+        :return: a readable file object
+        """
+        return io.BufferedReader(AzureBlobReader(self.service, self.container, item_id),
+                                 buffer_size=self.block_size)
+
+    def read_range(self, item_id, offset, size):
+        """ Read a range of a stored file
+
+        :param item_id: the blob name
+        :type item_id: str
+        :param offset: position of the range, from the end of the file if negative
+        :type offset: int
+        :param size: size of the range
+        :type size: int
+        :rtype: bytes
+        """
+        if offset < 0:
+            length = self.service.get_blob_properties(self.container, item_id).properties.content_length
+            offset = max(0, length + offset)
+        return self.service.get_blob_to_bytes(self.container, item_id, start_range=offset,
+                                              end_range=offset + size - 1).content
+
+    def demote(self, item_id):
+        """ Change the access tier of a blob to the cold tier (done by azure, no data transfer)
+
+        .. note:: an archived blob must be rehydrated before it can be read
+
+        :param item_id: the blob name
+        :type item_id: str
+        """
+        self.service.set_standard_blob_tier(self.container, item_id, self.cold_tier)
+        self.logger.info('azure_blob storage : {} moved to {} tier'.format(item_id, self.cold_tier))
 
     def delete(self, item_id):
         """ Delete a file by its id in this storage
@@ -183,6 +872,39 @@ class AzureBlocStorage(BaseStorage, metaclass=StorageFactory):
         self.logger.debug('azure_blob storage : removed {} - {}'.format(self.container, item_id))
 
 
+class AzureBlobReader(io.RawIOBase):
+    """ Raw readable file object downloading a blob by ranges
+
+    :param service: the blob service
+    :type service: azure.storage.blob.BlockBlobService
+    :param container: the container name
+    :type container: str
+    :param blob_name: the blob name
+    :type blob_name: str
+    """
+
+    def __init__(self, service, container, blob_name):
+        super(AzureBlobReader, self).__init__()
+        self.service = service
+        self.container = container
+        self.blob_name = blob_name
+        self.size = service.get_blob_properties(container, blob_name).properties.content_length
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.offset >= self.size or not len(buffer):
+            return 0
+        end_range = min(self.offset + len(buffer), self.size) - 1
+        data = self.service.get_blob_to_bytes(self.container, self.blob_name, start_range=self.offset,
+                                              end_range=end_range).content
+        buffer[:len(data)] = data
+        self.offset += len(data)
+        return len(data)
+
+
 class LocalStorage(BaseStorage, metaclass=StorageFactory):
     """ Local filesystem storage implementation
 
@@ -190,43 +912,562 @@ class LocalStorage(BaseStorage, metaclass=StorageFactory):
     :type logger: logging.Logger
     :param path: local folder in filesystem to store files
     :type path: str
+    :param cold_path: local folder of the backups only kept for the weekly / monthly retention
+    :type cold_path: str
+    :param layout: `flat` (all files in the folder) or `date` (files of a job in `<file_prefix>/YYYY/MM/DD`)
+    :type layout: str
     """
     storage_type = 'local'
+    supports_stream = True
+    supports_range = True
+
+    #: layouts of the stored files
+    LAYOUTS = ('flat', 'date')
 
-    def __init__(self, logger, path, *args, **kwargs):
-        if not os.path.isdir(path):
-            raise DbDustStorageException('local storage : {} folder does not exist'.format(path))
-        if not os.access(path, os.W_OK | os.X_OK):
-            raise DbDustStorageException('local storage : {} folder is not writable'.format(path))
+    def __init__(self, logger, path, *args, cold_path=None, layout='flat', **kwargs):
+        if layout not in self.LAYOUTS:
+            raise DbDustStorageException('local storage : layout must be one of {}'.format(', '.join(self.LAYOUTS)))
+        for folder in filter(None, (path, cold_path)):
+            if not os.path.isdir(folder):
+                raise DbDustStorageException('local storage : {} folder does not exist'.format(folder))
+            if not os.access(folder, os.W_OK | os.X_OK):
+                raise DbDustStorageException('local storage : {} folder is not writable'.format(folder))
         self.local_path = os.path.abspath(path)
+        self.cold_path = os.path.abspath(cold_path) if cold_path is not None else None
+        self.supports_demote = self.cold_path is not None
+        self.supports_partitions = layout == 'date'
+        # file prefix of each job stored in the `date` layout -> function returning the day of a file
+        self.partitioners = {}
         logger.debug('local storage : backup will be stored at {}'.format(self.local_path))
         self.logger = logger
 
-    def store(self, file_path):
+    def set_partitioner(self, file_prefix, file_day):
+        """ Set how the files of a job are partitioned (`date` layout), several jobs may share the storage
+
+        :param file_prefix: prefix of the files of the job, folder of its partitions
+        :type file_prefix: str
+        :param file_day: function returning the day of a file of the job, None for the other files
+        :type file_day: callable
+        """
+        self.partitioners[file_prefix] = file_day
+
+    @staticmethod
+    def _partition(file_prefix, day):
+        """ Folder of the files of a job for a day, relative to the storage folder """
+        return os.path.join(file_prefix, '{:04d}'.format(day.year), '{:02d}'.format(day.month),
+                            '{:02d}'.format(day.day))
+
+    def _file_partition(self, file_name):
+        """ Partition of a file, None if the file does not belong to a job (or is partial)
+
+        The longest prefix wins : the files of the job `backup-db2-` start with the prefix of the job `backup-`.
+        """
+        if file_name.endswith('.partial'):
+            return None
+        for file_prefix in sorted(self.partitioners, key=len, reverse=True):
+            day = self.partitioners[file_prefix](file_name) if file_name.startswith(file_prefix) else None
+            if day is not None:
+                return self._partition(file_prefix, day)
+        return None
+
+    def _dest_path(self, file_name):
+        """ Path of a file to store, in its partition if the file belongs to a job """
+        partition = self._file_partition(file_name)
+        if partition is None:
+            return os.path.join(self.local_path, file_name)
+        folder = os.path.join(self.local_path, partition)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, file_name)
+
+    def store(self, file_path, journal=None):
         """ Move local temp file to local storage
 
         :param file_path: file to move
         :type file_path: str
+        :param journal: if set, a throttled copy resumes from the size already copied
+        :type journal: dbdust.journal.UploadJournal
         """
-        dest_path = os.path.join(self.local_path, os.path.basename(file_path))
-        os.replace(file_path, dest_path)
+        dest_path = self._dest_path(os.path.basename(file_path))
+        if self.bucket is None:
+            os.replace(file_path, dest_path)
+        else:
+            self._throttled_move(file_path, dest_path, journal)
         self.logger.debug('local storage : backup stored to {}'.format(dest_path))
 
-    def list(self):
+    def store_stream(self, stream, file_name):
+        """ Write a stream to local storage until its end of file
+
+        The stream is written to a temporary name first so a partial file is never listed.
+
+        :param stream: readable file object
+        :param file_name: name of the stored file
+        :type file_name: str
+        """
+        dest_path = self._dest_path(file_name)
+        partial_path = '{}.partial'.format(dest_path)
+        if self.bucket is not None:
+            stream = ThrottledReader(stream, self.bucket)
+        with cacheio.open_writer(partial_path, self.io_mode, self.io_sync_size) as dst:
+            shutil.copyfileobj(stream, dst)
+        os.replace(partial_path, dest_path)
+        self.logger.debug('local storage : backup streamed to {}'.format(dest_path))
+
+    def free_space(self):
+        """ Free space available on the filesystem of the local storage
+
+        :rtype: int
+        """
+        return shutil.disk_usage(self.local_path).free
+
+    def _throttled_move(self, file_path, dest_path, journal=None):
+        """ Copy the file at the throughput allowed by the bucket then remove the source
+
+        The copy is written to a temporary name first so a partial file is never listed.
+
+        :param file_path: file to move
+        :type file_path: str
+        :param dest_path: final path of the file in the storage
+        :type dest_path: str
+        :param journal: if set, the copy resumes at the end of an existing partial file
+        :type journal: dbdust.journal.UploadJournal
+        """
+        partial_path = '{}.partial'.format(dest_path)
+        offset = 0
+        if journal is not None and os.path.exists(partial_path):
+            offset = os.path.getsize(partial_path)
+            self.logger.info('local storage : resume copy of {} at offset {}'.format(file_path, offset))
+        with ThrottledReader(self._open_local(file_path), self.bucket) as src, \
+                cacheio.open_writer(partial_path, self.io_mode, self.io_sync_size, mode='ab') as dst:
+            dst.truncate(offset)
+            src.seek(offset)
+            shutil.copyfileobj(src, dst)
+        os.replace(partial_path, dest_path)
+        os.remove(file_path)
+
+    def list(self, days=None, file_prefix=None):
         """ List all files available in local storage
 
+        The files of the cold folder are listed with their full path as id and a cold key.
+
+        :param days: with the `date` layout, list the partitions of these days only (and the files
+            of the folder which are not of a job)
+        :type days: datetime.date[]
+        :param file_prefix: with the `date` layout, list the partitions of this job only
+        :type file_prefix: str
         :return: list of dict. Each dict has an id (used to reference the file later), a file_name, a file path
         :type: dict[]
         """
-        return [{'id': item, 'file_name': item,
-                 'path': os.path.join(self.local_path, item)} for item in os.listdir(self.local_path)]
+        items = self._list_folder(self.local_path, days, file_prefix)
+        if self.cold_path is not None:
+            items.extend(dict(item, id=item['path'], cold=True)
+                         for item in self._list_folder(self.cold_path, days, file_prefix))
+        return items
+
+    def _list_folder(self, root, days=None, file_prefix=None):
+        """ List the files of the storage or of the cold folder, ids relative to the folder """
+        if not self.partitioners:
+            return [{'id': item, 'file_name': item, 'path': os.path.join(root, item)} for item in os.listdir(root)]
+        items = [{'id': item, 'file_name': item, 'path': os.path.join(root, item)} for item in self._migrate(root)]
+        for prefix in ([file_prefix] if file_prefix is not None else self.partitioners):
+            for day in self._days(root, prefix):
+                if days is not None and day not in days:
+                    continue
+                partition = self._partition(prefix, day)
+                items.extend({'id': os.path.join(partition, item), 'file_name': item,
+                              'path': os.path.join(root, partition, item)}
+                             for item in os.listdir(os.path.join(root, partition)))
+        return items
+
+    def _migrate(self, root):
+        """ Move the files of the jobs stored at the root of a folder (flat layout) to their partition
+
+        :return: the names of the other files at the root of the folder
+        :rtype: str[]
+        """
+        others = []
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    continue
+                partition = self._file_partition(entry.name)
+                if partition is None:
+                    others.append(entry.name)
+                    continue
+                folder = os.path.join(root, partition)
+                os.makedirs(folder, exist_ok=True)
+                os.replace(entry.path, os.path.join(folder, entry.name))
+                self.logger.info('local storage : {} moved to {}'.format(entry.path, folder))
+        return others
+
+    def _days(self, root, file_prefix):
+        """ Days of the partitions of a job in a folder, from the folder names only """
+        days = []
+        base = os.path.join(root, file_prefix)
+        for year in self._subfolders(base, 4):
+            for month in self._subfolders(os.path.join(base, year), 2):
+                for day in self._subfolders(os.path.join(base, year, month), 2):
+                    try:
+                        days.append(datetime.date(int(year), int(month), int(day)))
+                    except ValueError:
+                        continue
+        return days
+
+    @staticmethod
+    def _subfolders(folder, width):
+        """ Names of the sub folders made of `width` digits """
+        if not os.path.isdir(folder):
+            return []
+        with os.scandir(folder) as entries:
+            return sorted(entry.name for entry in entries
+                          if len(entry.name) == width and entry.name.isdigit() and entry.is_dir())
+
+    def list_days(self, file_prefix):
+        """ List the days of the partitions of a job (`date` layout)
+
+        The files of the jobs still stored in the flat layout are moved to their partition first.
+
+        :param file_prefix: prefix of the files of the job
+        :type file_prefix: str
+        :rtype: datetime.date[]
+        """
+        days = set()
+        for root in filter(None, (self.local_path, self.cold_path)):
+            self._migrate(root)
+            days.update(self._days(root, file_prefix))
+        return sorted(days)
+
+    def delete_day(self, file_prefix, day):
+        """ Delete the partition of a job for a day, in the storage and the cold folders (`date` layout)
+
+        :param file_prefix: prefix of the files of the job
+        :type file_prefix: str
+        :param day: the day
+        :type day: datetime.date
+        """
+        for root in filter(None, (self.local_path, self.cold_path)):
+            folder = os.path.join(root, self._partition(file_prefix, day))
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+                self._prune(os.path.dirname(folder))
+                self.logger.debug('local storage : removed {}'.format(folder))
+
+    def _prune(self, folder):
+        """ Remove the empty partition folders from `folder` up to the storage (or cold) folder """
+        roots = [root for root in (self.local_path, self.cold_path)
+                 if root is not None and folder.startswith(root + os.sep)]
+        while roots and folder != roots[0]:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                # not empty (or a file is being stored in it)
+                return
+            folder = os.path.dirname(folder)
+
+    def open_stream(self, item_id):
+        """ Open a stored file for reading
+
+        :param item_id: in case of the local storage, it is the file path relative to the storage folder
+        :type item_id: str
+        :return: a readable file object
+        """
+        return cacheio.open_reader(os.path.join(self.local_path, item_id), self.io_mode, self.io_sync_size)
+
+    def read_range(self, item_id, offset, size):
+        """ Read a range of a stored file
+
+        :param item_id: in case of the local storage, it is the file path relative to the storage folder
+        :type item_id: str
+        :param offset: position of the range, from the end of the file if negative
+        :type offset: int
+        :param size: size of the range
+        :type size: int
+        :rtype: bytes
+        """
+        with self.open_stream(item_id) as stream:
+            stream.seek(offset, os.SEEK_END if offset < 0 else os.SEEK_SET)
+            return stream.read(size)
+
+    def demote(self, item_id):
+        """ Move a file to the cold folder
+
+        The file is renamed when both folders are on the same filesystem, copied otherwise.
+
+        :param item_id: in case of the local storage, it is the file path relative to the storage folder
+        :type item_id: str
+        """
+        dest_path = os.path.join(self.cold_path, item_id)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.move(os.path.join(self.local_path, item_id), dest_path)
+        self._prune(os.path.dirname(os.path.join(self.local_path, item_id)))
+        self.logger.info('local storage : {} moved to {}'.format(item_id, dest_path))
 
     def delete(self, item_id):
         """ Delete a file by its id in this storage
 
-        :param item_id: in case of the local storage, it is the file name
+        :param item_id: in case of the local storage, it is the file path relative to the storage folder
+            (or the full path in the cold folder)
         :type item_id: str
         """
         file_path = os.path.join(self.local_path, item_id)
         os.remove(file_path)
+        self._prune(os.path.dirname(file_path))
         self.logger.debug('local storage : removed {}'.format(file_path))
+
+
+class S3Storage(BaseStorage, metaclass=StorageFactory):
+    """ S3 compatible object storage implementation (aws, minio, ceph rgw ...)
+
+    Files bigger than a part are sent with a multipart upload, parts are uploaded concurrently.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param bucket: name of the s3 bucket
+    :type bucket: str
+    :param prefix: key prefix of the stored files (ex : `backups/`)
+    :type prefix: str
+    :param endpoint_url: url of the s3 compatible server (default to aws)
+    :type endpoint_url: str
+    :param region: region of the bucket
+    :type region: str
+    :param access_key: access key id (default to the boto3 credentials chain)
+    :type access_key: str
+    :param secret_key: secret access key
+    :type secret_key: str
+    :param part_size: size of the parts of a multipart upload (min 5M)
+    :type part_size: str
+    :param parallelism: number of parts uploaded at the same time
+    :type parallelism: str
+    :param cold_storage_class: storage class (ex : `STANDARD_IA`, `GLACIER`) of the backups only kept
+        for the weekly / monthly retention
+    :type cold_storage_class: str
+    """
+    storage_type = 's3'
+    supports_stream = True
+    supports_range = True
+    supports_bulk_delete = True
+
+    #: default size of the parts of a multipart upload
+    DEFAULT_PART_SIZE = 64 * 1024 * 1024
+    #: max number of keys in a delete objects request
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self, logger, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 part_size=None, parallelism=4, cold_storage_class=None):
+        if boto3 is None:
+            raise DbDustStorageException('s3 storage : boto3 package is needed')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        try:
+            self.client.head_bucket(Bucket=bucket)
+        except botocore.exceptions.ClientError:
+            raise DbDustStorageException('s3 storage : {} bucket does not exist'.format(bucket))
+
+        self.bucket_name = bucket
+        self.prefix = prefix
+        self.part_size = parse_size(part_size) or self.DEFAULT_PART_SIZE
+        self.parallelism = int(parallelism)
+        self.cold_storage_class = cold_storage_class
+        self.supports_demote = cold_storage_class is not None
+        self.logger = logger
+
+    def store(self, file_path, journal=None):
+        """ Upload local temp file to the bucket
+
+        :param file_path: file to upload
+        :type file_path: str
+        :param journal: if set, the multipart upload id and the uploaded parts are persisted to resume later
+        :type journal: dbdust.journal.UploadJournal
+        """
+        key = self.prefix + os.path.basename(file_path)
+        size = os.path.getsize(file_path)
+        if size <= self.part_size:
+            with self._open_local(file_path) as src:
+                stream = src if self.bucket is None else ThrottledReader(src, self.bucket)
+                self.client.put_object(Bucket=self.bucket_name, Key=key, Body=stream.read())
+        else:
+            self._store_multipart(file_path, key, size, journal)
+        self.logger.debug('s3 storage : backup stored to {} - {}'.format(self.bucket_name, key))
+
+    def _store_multipart(self, file_path, key, size, journal=None):
+        """ Upload the file parts concurrently, skipping the parts recorded in the journal
+
+        :param file_path: file to upload
+        :type file_path: str
+        :param key: object key
+        :type key: str
+        :param size: file size
+        :type size: int
+        :param journal: journal persisting the upload id and the uploaded parts
+        :type journal: dbdust.journal.UploadJournal
+        """
+        upload = journal.state.get('upload') if journal is not None else None
+        if upload is None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key)['UploadId']
+            upload = {'upload_id': upload_id, 'parts': {}}
+            if journal is not None:
+                journal.update(upload=upload)
+        else:
+            self.logger.info('s3 storage : resume upload of {} ({} parts done)'.format(key, len(upload['parts'])))
+        lock = threading.Lock()
+
+        def upload_part(part_number):
+            with self._open_local(file_path) as src:
+                src.seek((part_number - 1) * self.part_size)
+                data = src.read(self.part_size)
+            if self.bucket is not None:
+                self.bucket.consume(len(data))
+            etag = self.client.upload_part(Bucket=self.bucket_name, Key=key, UploadId=upload['upload_id'],
+                                           PartNumber=part_number, Body=data)['ETag']
+            with lock:
+                upload['parts'][str(part_number)] = etag
+                if journal is not None:
+                    journal.update(upload=upload)
+
+        part_count = (size + self.part_size - 1) // self.part_size
+        todo = [n for n in range(1, part_count + 1) if str(n) not in upload['parts']]
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+                for future in [executor.submit(upload_part, n) for n in todo]:
+                    future.result()
+        except Exception:
+            if journal is None:
+                self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload['upload_id'])
+            raise
+        self._complete_multipart(key, upload['upload_id'], upload['parts'])
+
+    def _complete_multipart(self, key, upload_id, parts):
+        """ Assemble the uploaded parts
+
+        :param parts: etag of the parts indexed by part number
+        :type parts: dict
+        """
+        part_list = [{'PartNumber': int(n), 'ETag': etag} for n, etag in sorted(parts.items(), key=lambda p: int(p[0]))]
+        self.client.complete_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+                                              MultipartUpload={'Parts': part_list})
+
+    def store_stream(self, stream, file_name):
+        """ Upload a stream to the bucket until its end of file
+
+        Parts are read sequentially and uploaded concurrently, at most `parallelism`
+        parts are held in memory.
+
+        :param stream: readable file object
+        :param file_name: name of the stored file
+        :type file_name: str
+        """
+        key = self.prefix + file_name
+        if self.bucket is not None:
+            stream = ThrottledReader(stream, self.bucket)
+        data = stream.read(self.part_size)
+        next_data = stream.read(self.part_size) if data else b''
+        if not next_data:
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key)['UploadId']
+        slots = threading.BoundedSemaphore(self.parallelism)
+        parts = {}
+
+        def upload_part(part_number, part_data):
+            parts[str(part_number)] = self.client.upload_part(Bucket=self.bucket_name, Key=key,
+                                                              UploadId=upload_id, PartNumber=part_number,
+                                                              Body=part_data)['ETag']
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+                futures = []
+                part_number = 1
+                while data:
+                    slots.acquire()
+                    # a failed part stops the upload before the rest of the stream is read
+                    for future in [future for future in futures if future.done()]:
+                        futures.remove(future)
+                        future.result()
+                    future = executor.submit(upload_part, part_number, data)
+                    # the slot is released once the future is done, its error is seen by the next part
+                    future.add_done_callback(lambda _: slots.release())
+                    futures.append(future)
+                    part_number += 1
+                    data, next_data = next_data, stream.read(self.part_size) if next_data else b''
+                for future in futures:
+                    future.result()
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            raise
+        self._complete_multipart(key, upload_id, parts)
+        self.logger.debug('s3 storage : backup streamed to {} - {}'.format(self.bucket_name, key))
+
+    def open_stream(self, item_id):
+        """ Open a stored file for reading
+
+        :param item_id: the object key
+        :type item_id: str
+        :return: a readable file object
+        """
+        return self.client.get_object(Bucket=self.bucket_name, Key=item_id)['Body']
+
+    def read_range(self, item_id, offset, size):
+        """ Read a range of a stored file
+
+        :param item_id: the object key
+        :type item_id: str
+        :param offset: position of the range, from the end of the file if negative
+        :type offset: int
+        :param size: size of the range
+        :type size: int
+        :rtype: bytes
+        """
+        if offset < 0:
+            byte_range = 'bytes={}'.format(offset)
+        else:
+            byte_range = 'bytes={}-{}'.format(offset, offset + size - 1)
+        return self.client.get_object(Bucket=self.bucket_name, Key=item_id, Range=byte_range)['Body'].read()[:size]
+
+    def list(self):
+        """ List all files available under the prefix, page by page
+
+        :return: list of dict. Each dict has an id (the object key), a file_name (the key without the prefix)
+        :type: dict[]
+        """
+        items = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                items.append({'id': item['Key'], 'file_name': item['Key'][len(self.prefix):]})
+                if self.cold_storage_class is not None and item.get('StorageClass') == self.cold_storage_class:
+                    items[-1]['cold'] = True
+        return items
+
+    def demote(self, item_id):
+        """ Change the storage class of an object with a server side copy onto itself
+
+        :param item_id: the object key
+        :type item_id: str
+        """
+        self.client.copy({'Bucket': self.bucket_name, 'Key': item_id}, self.bucket_name, item_id,
+                         ExtraArgs={'StorageClass': self.cold_storage_class, 'MetadataDirective': 'COPY'})
+        self.logger.info('s3 storage : {} moved to {} storage class'.format(item_id, self.cold_storage_class))
+
+    def delete(self, item_id):
+        """ Delete a file by its id in this storage
+
+        :param item_id: the object key
+        :type item_id: str
+        """
+        self.client.delete_object(Bucket=self.bucket_name, Key=item_id)
+        self.logger.debug('s3 storage : removed {} - {}'.format(self.bucket_name, item_id))
+
+    def delete_many(self, item_ids):
+        """ Delete several files with batched delete objects requests
+
+        :param item_ids: the object keys
+        :type item_ids: str[]
+        """
+        for start in range(0, len(item_ids), self.DELETE_BATCH_SIZE):
+            batch = item_ids[start:start + self.DELETE_BATCH_SIZE]
+            response = self.client.delete_objects(Bucket=self.bucket_name, Delete={
+                'Objects': [{'Key': item_id} for item_id in batch], 'Quiet': True})
+            if response.get('Errors'):
+                raise DbDustStorageException('s3 storage : failed to remove {}'.format(
+                    ', '.join(error['Key'] for error in response['Errors'])))
+            self.logger.debug('s3 storage : removed {} - {}'.format(self.bucket_name, ', '.join(batch)))
@@ -1,11 +1,17 @@
 import argparse
 import datetime
+import gzip
+import os
 
 import pytest
+from freezegun import freeze_time
 from unittest.mock import Mock
 
 import dbdust.admin as admin
+import dbdust.catalog as catalog
 import dbdust.dumper as dumper
+import dbdust.journal as journal
+import dbdust.workqueue
 
 
 def test_validate_config_file_unkonwn_file(tmpdir):
@@ -163,6 +169,22 @@ def test_get_dump_config(dbdust_config_tester):
     assert result.cli_func is dumper.dumper_config.get('dbdust_tester.sh').get('cli_builder')
     assert result.cli_conf == {'host': 'value1', 'port': 'value2'}
     assert result.zip_path is None
+    assert result.read_rate is None
+    assert result.nice is None
+    assert result.ionice_class is None
+    assert result.ionice_level is None
+    assert result.cgroup is None
+
+
+def test_get_dump_config_throttle(dbdust_config_tester):
+    dbdust_config_tester.read_dict({'general': {'dump_rate': '10M', 'nice': '10', 'ionice_class': '2',
+                                                'ionice_level': '7', 'cgroup': '/sys/fs/cgroup/dbdust'}})
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_tester)
+    assert result.read_rate == 10 * 1024 * 1024
+    assert result.nice == '10'
+    assert result.ionice_class == '2'
+    assert result.ionice_level == '7'
+    assert result.cgroup == '/sys/fs/cgroup/dbdust'
 
 
 def test_get_dump_config_unknown_dumper(monkeypatch, dbdust_config_tester):
@@ -185,6 +207,63 @@ def test_get_dump_config_unknown_zip(monkeypatch, dbdust_config_tester):
     assert 'unknown_zip not found on the system' == str(excinfo.value)
 
 
+def test_get_dump_config_compression(monkeypatch, dbdust_config_tester):
+    stream_cli_builder = Mock()
+    monkeypatch.setattr(dumper, 'dumper_config', {'dbdust_tester.sh': {'bin_name': 'dbdust_tester.sh',
+                                                                       'file_ext': 'txt.gz',
+                                                                       'zip_name': 'unknown_zip',
+                                                                       'cli_builder': lambda x: x,
+                                                                       'codec': 'gzip',
+                                                                       'stream_cli_builder': stream_cli_builder}})
+    dbdust_config_tester.read_dict({'general': {'compression_level': 'adaptive', 'compression_max_level': '7',
+                                                'chunk_size': '4M'}})
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_tester)
+    assert result.cli_func is stream_cli_builder
+    assert result.zip_path is None
+    assert result.codec == 'gzip'
+    assert result.compression_level == 'adaptive'
+    assert result.compression_min_level is None
+    assert result.compression_max_level == '7'
+    assert result.chunk_size == 4 * 1024 * 1024
+
+
+def test_get_dump_config_native(monkeypatch, dbdust_config_tester):
+    native_dumper = Mock()
+    monkeypatch.setattr(dumper, 'dumper_config', {'dbdust_tester.sh': {'bin_name': None,
+                                                                       'file_ext': 'sql.gz',
+                                                                       'zip_name': None,
+                                                                       'cli_builder': None,
+                                                                       'codec': 'gzip',
+                                                                       'native_dumper': native_dumper}})
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_tester)
+    assert result.native_dumper is native_dumper
+    assert result.bin_path is None
+    assert result.codec == 'gzip'
+    assert result.compression_level is None
+
+
+def test_get_dump_config_compression_not_supported(dbdust_config_tester):
+    dbdust_config_tester.read_dict({'general': {'compression_level': '3'}})
+    with pytest.raises(Exception) as excinfo:
+        admin.get_dump_config('dbdust_tester.sh', dbdust_config_tester)
+    assert 'compression_level not supported by dbdust_tester.sh database' == str(excinfo.value)
+
+
+def test_get_dump_config_encryption(dbdust_config_tester, tmpdir):
+    key_file = tmpdir.join('backup.key')
+    key_file.write_binary(bytes(range(32)))
+    old_key_file = tmpdir.join('old.key')
+    old_key_file.write_binary(bytes(range(16)))
+    dbdust_config_tester.read_dict({'general': {'encryption_key': str(key_file), 'encryption_segment_size': '4M',
+                                                'decryption_keys': ' {} '.format(old_key_file)}})
+
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_tester)
+    assert result.file_ext == 'txt.enc'
+    assert result.encryption_key == bytes(range(32))
+    assert result.encryption_segment_size == 4 * 1024 * 1024
+    assert sorted(admin.get_decryption_keys(dbdust_config_tester).values()) == [bytes(range(16)), bytes(range(32))]
+
+
 def test_get_storage_config_fallback(dbdust_config_tester):
     result = admin.get_storage_config('local', dbdust_config_tester)
     assert result.type == 'local'
@@ -192,6 +271,14 @@ def test_get_storage_config_fallback(dbdust_config_tester):
     assert result.date_format == '%Y%m%d%H%M%S'
     assert result.retain_conf == {'daily_retain': 7, 'weekly_retain': 4, 'monthly_retain': 2, 'max_per_day': 1}
     assert result.impl_conf == {'path': 'value3', 'remote': 'no'}
+    assert result.upload_rate is None
+
+
+def test_get_storage_config_upload_rate(dbdust_config_tester):
+    dbdust_config_tester.set('local', 'upload_rate', '512k')
+    result = admin.get_storage_config('local', dbdust_config_tester)
+    assert result.impl_conf == {'path': 'value3', 'remote': 'no'}
+    assert result.upload_rate == 512 * 1024
 
 
 def test_get_storage_config_custom(dbdust_config_full_tester):
@@ -222,6 +309,7 @@ def test_dbdusthandler_process(dbdust_config_full_tester, tmpdir, monkeypatch):
     assert handler._save.call_count == 1
     save_call_args = handler._save.call_args
     assert save_call_args[0][0].endswith('dump-{}.txt'.format(now.strftime('%Y%m')))
+    assert handler.report['job_duration'] >= 0
 
 
 def test_dbdusthandler_save(dbdust_config_full_tester):
@@ -234,3 +322,778 @@ def test_dbdusthandler_save(dbdust_config_full_tester):
 
     handler.storage_handler.save.assert_called_once_with('tmpfile')
     handler.storage_handler.rotate.assert_called_once_with()
+
+
+def test_dbdusthandler_dump_throttled(dbdust_config_full_tester, tmpdir, monkeypatch):
+    monkeypatch.setattr(admin.sys, 'stdin', None)
+    monkeypatch.setattr(admin.sys, 'stdout', None)
+    dbdust_config_full_tester.set('general', 'dump_rate', '1M')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        return ['printf', '012', '>', dump_file_path]
+    dump_conf = dump_conf._replace(cli_func=cli_func, cli_conf={})
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    tmp_file = tmpdir.join('dump.txt')
+
+    handler._dump(str(tmpdir), str(tmp_file))
+
+    assert tmp_file.read() == '012'
+    assert handler.report['dump_size'] == 3
+    assert handler.report['bytes_read'] == 3
+
+
+@pytest.mark.parametrize('failure', ['cli_func', 'popen'])
+def test_dbdusthandler_dump_not_started(dbdust_config_full_tester, tmpdir, monkeypatch, failure):
+    dbdust_config_full_tester.set('general', 'dump_rate', '1M')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        if failure == 'cli_func':
+            raise Exception('bad dump configuration')
+        return ['printf', '012', '>', dump_file_path]
+    dump_conf = dump_conf._replace(cli_func=cli_func, cli_conf={})
+    monkeypatch.setattr(admin.subprocess, 'Popen', Mock(side_effect=OSError('no shell')))
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    dump_dir = tmpdir.mkdir('dump')
+    fds = len(os.listdir('/proc/self/fd'))
+
+    with pytest.raises(Exception):
+        handler._dump(str(dump_dir), str(dump_dir.join('dump.txt')))
+
+    # the named pipe is closed and removed
+    assert dump_dir.listdir() == []
+    assert len(os.listdir('/proc/self/fd')) == fds
+
+
+def test_dbdusthandler_dump_native(dbdust_config_full_tester, tmpdir):
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    native_dumper = Mock()
+    native_dumper.return_value.chunks.return_value = iter([b'-- dump', b' completed'])
+    dump_conf = dump_conf._replace(native_dumper=native_dumper, codec='gzip', cli_conf={'database': 'db'})
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    tmp_file = tmpdir.join('dump.sql.gz')
+
+    handler._dump(str(tmpdir), str(tmp_file), cli_conf={'database': 'db', 'table': 't1'})
+
+    native_dumper.assert_called_once_with(database='db', table='t1')
+    assert gzip.decompress(tmp_file.read_binary()) == b'-- dump completed'
+    assert handler.report['bytes_read'] == 17
+    assert handler.report['codec'] == 'gzip'
+    assert handler.report['dump_size'] == len(tmp_file.read_binary())
+
+
+def test_create_cmd_line_parser_command():
+    parser = admin.create_cmd_line_parser()
+    assert parser.parse_args([]).command == 'backup'
+    assert parser.parse_args(['resume']).command == 'resume'
+    args = parser.parse_args(['worker', '-q', '/mnt/queue', '-w', '2'])
+    assert (args.command, args.queue, args.workers) == ('worker', '/mnt/queue', 2)
+    args = parser.parse_args(['decrypt', '-i', 'backup.sql.gz.enc', '-o', 'backup.sql.gz'])
+    assert (args.command, args.input, args.output) == ('decrypt', 'backup.sql.gz.enc', 'backup.sql.gz')
+    args = parser.parse_args(['rotate', '-q', '/mnt/queue'])
+    assert (args.command, args.queue) == ('rotate', '/mnt/queue')
+
+
+def test_dbdusthandler_process_failure_cleanup(dbdust_config_full_tester, tmpdir):
+    dbdust_tmp_dir = tmpdir.mkdir('dbdust-tmp')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock()
+    handler._save = Mock(side_effect=Exception('upload error'))
+
+    with pytest.raises(Exception):
+        handler.process(str(dbdust_tmp_dir))
+
+    assert dbdust_tmp_dir.listdir() == []
+
+
+def test_dbdusthandler_process_failure_keep_and_resume(dbdust_config_full_tester, tmpdir):
+    dbdust_tmp_dir = tmpdir.mkdir('dbdust-tmp')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf, keep_failed_dump=True)
+
+    def dump(tmp_dir, tmp_file):
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('content')
+    handler._dump = dump
+    handler.storage_handler = Mock()
+    handler.storage_handler.save.side_effect = Exception('upload error')
+
+    with pytest.raises(Exception):
+        handler.process(str(dbdust_tmp_dir))
+
+    journals = journal.UploadJournal.list(str(dbdust_tmp_dir))
+    assert len(journals) == 1
+    assert journals[0].state['file_name'] == handler.file_name
+    tmp_file = journals[0].state['tmp_file']
+    assert open(tmp_file).read() == 'content'
+
+    resume_handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf, keep_failed_dump=True)
+    resume_handler.storage_handler = Mock()
+    resume_handler.resume(journals[0])
+
+    assert resume_handler.file_name == handler.file_name
+    resume_handler.storage_handler.save.assert_called_once_with(tmp_file, journals[0])
+    resume_handler.storage_handler.rotate.assert_called_once_with()
+    assert dbdust_tmp_dir.listdir() == []
+
+
+def test_dbdusthandler_resume_already_stored(dbdust_config_full_tester, tmpdir):
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'dump-1.txt', stored=True,
+                                                  tmp_file=str(tmpdir.join('dbdust-x', 'dump-1.txt')))
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler.storage_handler = Mock()
+
+    handler.resume(upload_journal)
+
+    assert handler.storage_handler.save.call_count == 0
+    handler.storage_handler.rotate.assert_called_once_with()
+
+
+def test_get_preflight_config(dbdust_config_tester):
+    result = admin.get_preflight_config(dbdust_config_tester)
+    assert result.enabled is False
+    assert result.fallback_tmp_dirs == []
+    assert result.margin == 1.2
+
+    dbdust_config_tester.read_dict({'general': {'preflight': 'yes', 'fallback_tmp_dirs': '/mnt/a, /mnt/b',
+                                                'space_margin': '1.5'}})
+    result = admin.get_preflight_config(dbdust_config_tester)
+    assert result.enabled is True
+    assert result.fallback_tmp_dirs == ['/mnt/a', '/mnt/b']
+    assert result.margin == 1.5
+
+
+@pytest.fixture
+def preflight_handler(dbdust_config_full_tester, tmpdir):
+    dbdust_config_full_tester.read_dict({'general': {'preflight': 'yes', 'fallback_tmp_dirs': '/mnt/fallback',
+                                                     'space_margin': '2'}})
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    dbdust_catalog = catalog.Catalog(str(tmpdir.join('catalog.jsonl')))
+    dbdust_catalog.record({'job': 'dump-', 'dump_size': 100, 'dump_duration': 10})
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf, catalog=dbdust_catalog,
+                                        preflight_conf=admin.get_preflight_config(dbdust_config_full_tester))
+    handler.storage_handler.storage_impl.free_space = Mock(return_value=None)
+    return handler
+
+
+def _disk_usage(free_per_path):
+    def disk_usage(path):
+        return Mock(free=free_per_path[path])
+    return disk_usage
+
+
+def test_dbdusthandler_preflight_tmp_dir(preflight_handler, monkeypatch):
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 200}))
+    assert preflight_handler._preflight('/tmp') == ('/tmp', False)
+    assert preflight_handler.report['estimated_size'] == 100
+
+
+def test_dbdusthandler_preflight_fallback_tmp_dir(preflight_handler, monkeypatch):
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 199, '/mnt/fallback': 200}))
+    assert preflight_handler._preflight('/tmp') == ('/mnt/fallback', False)
+
+
+def test_dbdusthandler_preflight_streaming(preflight_handler, monkeypatch):
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 10, '/mnt/fallback': 10}))
+    assert preflight_handler._preflight('/tmp') == ('/tmp', True)
+
+
+def test_dbdusthandler_preflight_abort(preflight_handler, monkeypatch):
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 10, '/mnt/fallback': 10}))
+    monkeypatch.setattr(preflight_handler.storage_handler.storage_impl, 'supports_stream', False)
+    with pytest.raises(Exception) as excinfo:
+        preflight_handler._preflight('/tmp')
+    assert 'pre-flight : 200 bytes needed but not enough space in tmp dirs' == str(excinfo.value)
+
+
+def test_dbdusthandler_preflight_abort_destination(preflight_handler, monkeypatch):
+    monkeypatch.setattr(preflight_handler.storage_handler.storage_impl, 'free_space', Mock(return_value=150))
+    with pytest.raises(Exception) as excinfo:
+        preflight_handler._preflight('/tmp')
+    assert 'pre-flight : 200 bytes needed but only 150 bytes free in storage' == str(excinfo.value)
+
+
+def test_dbdusthandler_preflight_source_estimate(preflight_handler, monkeypatch):
+    preflight_handler.job = 'unknown'
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 1000}))
+    assert preflight_handler._preflight('/tmp') == ('/tmp', False)
+
+    assert 'estimated_size' not in preflight_handler.report
+
+    size_estimator = Mock(return_value=600)
+    preflight_handler.dump_conf = preflight_handler.dump_conf._replace(size_estimator=size_estimator,
+                                                                       cli_conf={'host': 'myhost'})
+    monkeypatch.setattr(admin.shutil, 'disk_usage', _disk_usage({'/tmp': 1000, '/mnt/fallback': 2000}))
+    assert preflight_handler._preflight('/tmp') == ('/mnt/fallback', False)
+    assert preflight_handler.report['estimated_size'] == 600
+    size_estimator.assert_called_once_with(host='myhost')
+
+
+def test_dbdusthandler_process_streaming(preflight_handler, tmpdir, monkeypatch):
+    monkeypatch.setattr(admin.sys, 'stdin', None)
+    monkeypatch.setattr(admin.sys, 'stdout', None)
+    monkeypatch.setattr(preflight_handler, '_preflight', Mock(return_value=(str(tmpdir), True)))
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        return ['printf', '012', '>', dump_file_path]
+    preflight_handler.dump_conf = preflight_handler.dump_conf._replace(cli_func=cli_func, cli_conf={})
+    preflight_handler.storage_handler.rotate = Mock()
+
+    preflight_handler.process(str(tmpdir))
+
+    stored = tmpdir.join('dbdust', preflight_handler.file_name)
+    assert stored.read() == '012'
+    assert preflight_handler.report['dump_size'] == 3
+    assert preflight_handler.storage_handler.rotate.call_count == 1
+    assert preflight_handler.catalog.history('dump-')[-1]['dump_size'] == 3
+
+
+def test_dbdusthandler_process_streaming_dump_error(preflight_handler, tmpdir, monkeypatch):
+    monkeypatch.setattr(admin.sys, 'stdin', None)
+    monkeypatch.setattr(admin.sys, 'stdout', None)
+    monkeypatch.setattr(preflight_handler, '_preflight', Mock(return_value=(str(tmpdir), True)))
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        return ['printf', '012', '>', dump_file_path, '&&', 'exit', '1']
+    preflight_handler.dump_conf = preflight_handler.dump_conf._replace(cli_func=cli_func, cli_conf={})
+
+    with pytest.raises(Exception) as excinfo:
+        preflight_handler.process(str(tmpdir))
+
+    assert 'dump command exited with error code 1' == str(excinfo.value)
+    assert not tmpdir.join('dbdust', preflight_handler.file_name).exists()
+
+
+def test_dbdusthandler_process_streaming_cli_error(preflight_handler, tmpdir, monkeypatch):
+    monkeypatch.setattr(preflight_handler, '_preflight', Mock(return_value=(str(tmpdir), True)))
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        raise Exception('bad dump configuration')
+    preflight_handler.dump_conf = preflight_handler.dump_conf._replace(cli_func=cli_func, cli_conf={})
+
+    # the dump fails before its pipeline runs, the storage thread must still get the end of the stream
+    with pytest.raises(Exception) as excinfo:
+        preflight_handler.process(str(tmpdir))
+
+    assert 'bad dump configuration' == str(excinfo.value)
+    assert not tmpdir.join('dbdust', preflight_handler.file_name).exists()
+
+
+@pytest.mark.parametrize('exit_code', [0, 1])
+def test_dbdusthandler_process_split(dbdust_config_full_tester, tmpdir, monkeypatch, exit_code):
+    monkeypatch.setattr(admin.sys, 'stdin', None)
+    monkeypatch.setattr(admin.sys, 'stdout', None)
+    dbdust_config_full_tester.read_dict({'general': {'split_size': '4', 'split_uploads': '2'}})
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+
+    def cli_func(bin_path, zip_path, dump_dir_path, dump_file_path):
+        return ['printf', '0123456789', '>', dump_file_path, '&&', 'exit', str(exit_code)]
+    dump_conf = dump_conf._replace(cli_func=cli_func, cli_conf={})
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    assert (storage_conf.split_size, storage_conf.split_uploads) == (4, 2)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler.storage_handler.rotate = Mock()
+    dbdust_tmp_dir = tmpdir.mkdir('dbdust-tmp')
+    store_dir = tmpdir.join('dbdust')
+
+    if exit_code:
+        with pytest.raises(Exception):
+            handler.process(str(dbdust_tmp_dir))
+        assert not [name for name in os.listdir(str(store_dir)) if name.startswith(handler.file_name)]
+    else:
+        handler.process(str(dbdust_tmp_dir))
+        items = [item for item in handler.storage_handler._group_split_backups(
+            handler.storage_handler.storage_impl.list()) if item['file_name'] == handler.file_name]
+        assert items[0]['manifest'] == '{}.manifest'.format(handler.file_name)
+        with handler.storage_handler.open_stream(items[0]) as stream:
+            assert stream.read() == b'0123456789'
+        assert handler.report['parts'] == 3
+        assert handler.storage_handler.rotate.call_count == 1
+    assert dbdust_tmp_dir.listdir() == []
+
+
+def test_estimate_queued_job(tmpdir):
+    config = tmpdir.join('job.cfg')
+    config.write('[general]\nfile_prefix=db1-\ndatabase=mysql\ncatalog={}\n[mysql]\nhost=mysql-1\n'.format(
+        tmpdir.join('catalog.jsonl')))
+    assert admin.estimate_queued_job(str(config)) == {'size': None, 'duration': None, 'host': 'mysql-1'}
+
+    dbdust_catalog = catalog.Catalog(str(tmpdir.join('catalog.jsonl')))
+    dbdust_catalog.record({'job': 'db1-', 'dump_size': 100, 'job_duration': 12})
+    assert admin.estimate_queued_job(str(config)) == {'size': 100, 'duration': 12, 'host': 'mysql-1'}
+
+
+def test_run_worker(tmpdir, monkeypatch):
+    process = Mock()
+    monkeypatch.setattr(admin.DbDustBackupHandler, 'process', process)
+    queue_dir = tmpdir.join('queue')
+    storage_dir = tmpdir.mkdir('storage')
+    job_config = tmpdir.join('job.cfg')
+    job_config.write("""[general]
+        database=dbdust_tester.sh
+        storage=local
+        file_prefix=dump-
+        tmp_dir={}
+
+        [dbdust_tester.sh]
+        loop=2
+
+        [local]
+        path = {}
+        """.format(tmpdir, storage_dir))
+    dbdust.workqueue.WorkQueue(str(queue_dir)).submit('db1', str(job_config))
+
+    assert admin.run_worker(admin.DbDustConfig(), str(queue_dir)) == 0
+    assert queue_dir.join('done').listdir() == [queue_dir.join('done', 'db1.cfg')]
+    process.assert_called_once_with(str(tmpdir))
+
+
+def test_dbdusthandler_dump_tables(dbdust_config_full_tester, tmpdir):
+    def read(read_at, **tables):
+        return {name: dict(values, read_at=read_at, checksum=None) for name, values in tables.items()}
+
+    # `busy` was written in the second its indicators were read : a later write in that second is not visible
+    indicators = read('2019-01-02 10:00:00', archive={'update_time': '2019-01-01 10:00:00', 'rows': 1000},
+                      busy={'update_time': '2019-01-02 10:00:00', 'rows': 3},
+                      live={'update_time': '2019-01-02 09:00:00', 'rows': 10},
+                      unknown={'update_time': None, 'rows': 5})
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        table_indicators=Mock(return_value=indicators))
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    storage_conf = storage_conf._replace(file_prefix='tables-', date_format='%Y%m%d')
+    dumped = []
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        dumped.append(cli_conf['table'])
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('{}-{};'.format(cli_conf['table'], len(dumped)))
+
+    with freeze_time('2019-01-02'):
+        first = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+        first._dump = Mock(side_effect=dump)
+        first._dump_tables(str(tmpdir), str(tmpdir.join(first.file_name)))
+    assert dumped == ['archive', 'busy', 'live', 'unknown']
+    assert (first.report['tables_dumped'], first.report['tables_reused']) == (4, 0)
+
+    indicators = read('2019-01-03 10:00:00', archive={'update_time': '2019-01-01 10:00:00', 'rows': 1000},
+                      busy={'update_time': '2019-01-02 10:00:00', 'rows': 3},
+                      live={'update_time': '2019-01-03 09:00:00', 'rows': 11},
+                      unknown={'update_time': None, 'rows': 5})
+    dump_conf.table_indicators.return_value = indicators
+    with freeze_time('2019-01-03'):
+        second = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+        second._dump = Mock(side_effect=dump)
+        second._dump_tables(str(tmpdir), str(tmpdir.join(second.file_name)))
+    assert dumped == ['archive', 'busy', 'live', 'unknown', 'busy', 'live', 'unknown']
+    assert (second.report['tables_dumped'], second.report['tables_reused']) == (3, 1)
+    assert second._dump.call_args_list[0][1]['cli_conf'] == {'host': 'value1', 'port': 'value2', 'table': 'busy'}
+
+    storage_handler = second.storage_handler
+    item = storage_handler._get_sorted_backup_files_list()[0]
+    assert item['file_name'] == second.file_name
+    with storage_handler.open_stream(item) as stream:
+        assert stream.read() == b'archive-1;busy-5;live-6;unknown-7;'
+    assert [part['file_name'] for part in storage_handler.read_manifest(item)['parts']] == [
+        'tables-20190102.txt.part0000', 'tables-20190103.txt.part0001', 'tables-20190103.txt.part0002',
+        'tables-20190103.txt.part0003']
+
+
+@pytest.mark.parametrize("previous,current,unchanged", [
+    ({'update_time': '10:00:00', 'rows': 1, 'read_at': '10:00:01', 'checksum': None},
+     {'update_time': '10:00:00', 'rows': 1, 'read_at': '11:00:00', 'checksum': None}, True),
+    ({'update_time': '10:00:00', 'rows': 1, 'read_at': '10:00:01', 'checksum': None},
+     {'update_time': '10:00:00', 'rows': 2, 'read_at': '11:00:00', 'checksum': None}, False),
+    # written in the second of the previous read
+    ({'update_time': '10:00:00', 'rows': 1, 'read_at': '10:00:00', 'checksum': None},
+     {'update_time': '10:00:00', 'rows': 1, 'read_at': '11:00:00', 'checksum': None}, False),
+    # indicators recorded before the read time was
+    ({'update_time': '10:00:00', 'rows': 1, 'checksum': None},
+     {'update_time': '10:00:00', 'rows': 1, 'read_at': '11:00:00', 'checksum': None}, False),
+    ({'update_time': None, 'rows': 1, 'read_at': '10:00:01', 'checksum': None},
+     {'update_time': None, 'rows': 1, 'read_at': '11:00:00', 'checksum': None}, False),
+    ({'update_time': '10:00:00', 'rows': 1, 'read_at': '10:00:00', 'checksum': '12'},
+     {'update_time': '10:00:00', 'rows': 1, 'read_at': '11:00:00', 'checksum': '12'}, True),
+    ({'update_time': None, 'rows': 1, 'checksum': '12'}, {'update_time': None, 'rows': 1, 'checksum': '12'}, True),
+])
+def test_dbdusthandler_table_unchanged(previous, current, unchanged):
+    assert admin.DbDustBackupHandler._table_unchanged(previous, current) is unchanged
+
+
+def test_get_dump_config_skip_unchanged_tables(dbdust_config_full_tester):
+    dbdust_config_full_tester.set('general', 'skip_unchanged_tables', 'yes')
+    with pytest.raises(Exception) as excinfo:
+        admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert 'skip_unchanged_tables not supported by dbdust_tester.sh database' == str(excinfo.value)
+
+
+def test_get_dump_config_key_ranges(dbdust_config_full_tester, monkeypatch):
+    dbdust_config_full_tester.set('general', 'key_ranges', '4')
+    with pytest.raises(Exception) as excinfo:
+        admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert 'key_ranges not supported by dbdust_tester.sh database' == str(excinfo.value)
+
+    key_ranges = Mock()
+    monkeypatch.setitem(dumper.dumper_config['dbdust_tester.sh'], 'key_ranges', key_ranges)
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert (result.key_ranges, result.key_range_count, result.key_range_workers) == (key_ranges, 4, 4)
+    dbdust_config_full_tester.set('general', 'key_range_workers', '2')
+    assert admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester).key_range_workers == 2
+
+
+def test_dbdusthandler_dump_ranges(dbdust_config_full_tester, tmpdir):
+    ranges = [{'query': 'q{}'.format(index)} for index in range(3)]
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        key_ranges=Mock(return_value=ranges), key_range_count=3, key_range_workers=2)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('{};'.format(cli_conf['query']))
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    handler._dump_ranges(str(tmpdir), str(tmpdir.join(handler.file_name)))
+
+    dump_conf.key_ranges.assert_called_once_with(3, host='value1', port='value2')
+    assert sorted(c[1]['cli_conf']['query'] for c in handler._dump.call_args_list) == ['q0', 'q1', 'q2']
+    assert (handler.report['parts'], handler.report['dump_size']) == (3, 9)
+    storage_handler = handler.storage_handler
+    item = storage_handler._get_sorted_backup_files_list()[0]
+    with storage_handler.open_stream(item) as stream:
+        assert stream.read() == b'q0;q1;q2;'
+    manifest = storage_handler.read_manifest(item)
+    assert manifest['ranges'] is True
+    assert [part['range'] for part in manifest['parts']] == ranges
+
+
+def test_dbdusthandler_dump_ranges_failure(dbdust_config_full_tester, tmpdir):
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        key_ranges=Mock(return_value=[{'query': 'q0'}, {'query': 'q1'}]), key_range_count=2, key_range_workers=1)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        if cli_conf['query'] == 'q1':
+            raise Exception('dump command exited with error code 1')
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('ok')
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    with pytest.raises(Exception) as excinfo:
+        handler._dump_ranges(str(tmpdir), str(tmpdir.join(handler.file_name)))
+    assert 'dump command exited with error code 1' == str(excinfo.value)
+    assert [item['file_name'] for item in handler.storage_handler.storage_impl.list()] == ['config.cfg']
+
+
+def test_dbdusthandler_dump_segments_retry(dbdust_config_full_tester, tmpdir, monkeypatch):
+    sleep = Mock()
+    monkeypatch.setattr(admin.time, 'sleep', sleep)
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        key_ranges=Mock(return_value=[{'query': 'q0'}, {'query': 'q1'}]), key_range_count=2, key_range_workers=1,
+        segment_retries=2, segment_retry_delay=10)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    failures = {'q1': 2}
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('partial')
+        if failures.get(cli_conf['query']):
+            failures[cli_conf['query']] -= 1
+            raise Exception('connection lost')
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write(cli_conf['query'])
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    handler._dump_ranges(str(tmpdir), str(tmpdir.join(handler.file_name)))
+
+    assert handler._dump.call_count == 4
+    assert [c[0][0] for c in sleep.call_args_list] == [10, 20]
+    item = handler.storage_handler._get_sorted_backup_files_list()[0]
+    with handler.storage_handler.open_stream(item) as stream:
+        assert stream.read() == b'q0q1'
+    assert dbdust.journal.SegmentJournal.list(str(tmpdir)) == []
+
+
+def test_dbdusthandler_resume_segments(dbdust_config_full_tester, tmpdir):
+    tmp_dir = tmpdir.mkdir('tmp')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        key_ranges=Mock(return_value=[{'query': 'q0'}, {'query': 'q1'}, {'query': 'q2'}]), key_range_count=3,
+        key_range_workers=1)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    failing = ['q2']
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        if cli_conf['query'] in failing:
+            raise Exception('connection lost')
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write(cli_conf['query'])
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf, keep_failed_dump=True)
+    handler._dump = Mock(side_effect=dump)
+    with pytest.raises(Exception):
+        handler._dump_ranges(str(tmp_dir), str(tmp_dir.join(handler.file_name)))
+    checkpoints = dbdust.journal.SegmentJournal.list(str(tmp_dir))
+    assert len(checkpoints) == 1
+    assert sorted(checkpoints[0].state['parts']) == ['0', '1']
+
+    failing.clear()
+    resumed = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf, keep_failed_dump=True)
+    resumed._dump = Mock(side_effect=dump)
+    resumed.resume_segments(str(tmp_dir), checkpoints[0])
+
+    assert [c[1]['cli_conf']['query'] for c in resumed._dump.call_args_list] == ['q2']
+    assert resumed.report['parts'] == 3
+    item = resumed.storage_handler._get_sorted_backup_files_list()[0]
+    with resumed.storage_handler.open_stream(item) as stream:
+        assert stream.read() == b'q0q1q2'
+    assert dbdust.journal.SegmentJournal.list(str(tmp_dir)) == []
+    assert os.listdir(str(tmp_dir)) == []
+
+
+def test_get_dump_config_pack_databases(dbdust_config_full_tester):
+    assert admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester).pack_databases == []
+    dbdust_config_full_tester.set('general', 'pack_databases', 'db1, db2,')
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert result.pack_databases == ['db1', 'db2']
+    assert result.file_ext.endswith('.pack')
+
+
+def test_dbdusthandler_dump_pack(dbdust_config_full_tester, tmpdir, monkeypatch):
+    monkeypatch.setattr(admin.time, 'sleep', Mock())
+    dbdust_config_full_tester.set('general', 'pack_databases', 'db1,db2')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(segment_retries=1)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    failures = {'db2': 1}
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        if failures.get(cli_conf['database']):
+            failures[cli_conf['database']] -= 1
+            raise Exception('connection lost')
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('dump of {}'.format(cli_conf['database']))
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    tmp_dir = tmpdir.mkdir('tmp')
+    tmp_file = str(tmp_dir.join(handler.file_name))
+    handler._dump_pack(str(tmp_dir), tmp_file)
+
+    assert handler._dump.call_count == 3
+    assert handler.report['members'] == 2
+    assert handler.report['dump_size'] == os.path.getsize(tmp_file)
+    assert tmp_dir.listdir() == [tmp_dir.join(handler.file_name)]
+
+    handler.storage_handler.save(tmp_file)
+    output_dir = tmpdir.mkdir('out')
+    paths = admin.unpack_stored(handler.storage_handler, handler.file_name, str(output_dir))
+    member_ext = dump_conf.file_ext[:-len('.pack')]
+    assert [os.path.basename(path) for path in paths] == ['db1.{}'.format(member_ext), 'db2.{}'.format(member_ext)]
+    assert output_dir.join('db2.{}'.format(member_ext)).read() == 'dump of db2'
+
+    with pytest.raises(Exception) as excinfo:
+        admin.unpack_stored(handler.storage_handler, 'unknown.pack', str(output_dir))
+    assert 'unknown.pack not found in the storage' == str(excinfo.value)
+
+
+def test_dbdusthandler_dump_pack_failure(dbdust_config_full_tester, tmpdir):
+    dbdust_config_full_tester.set('general', 'pack_databases', 'db1,db2')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write('partial')
+        if cli_conf['database'] == 'db2':
+            raise Exception('dump command exited with error code 1')
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    tmp_dir = tmpdir.mkdir('tmp')
+    with pytest.raises(Exception) as excinfo:
+        handler._dump_pack(str(tmp_dir), str(tmp_dir.join(handler.file_name)))
+    assert 'dump command exited with error code 1' == str(excinfo.value)
+    assert tmp_dir.listdir() == []
+
+
+def test_get_io_config(dbdust_config_tester):
+    result = admin.get_io_config(dbdust_config_tester)
+    assert (result.mode, result.sync_size, result.report) == ('buffered', None, False)
+
+    dbdust_config_tester.read_dict({'general': {'io_mode': 'direct', 'io_sync_size': '4M', 'page_cache_report': 'yes'}})
+    result = admin.get_io_config(dbdust_config_tester)
+    assert (result.mode, result.sync_size, result.report) == ('direct', 4 * 1024 * 1024, True)
+
+    dbdust_config_tester.set('general', 'io_mode', 'mmap')
+    with pytest.raises(Exception) as excinfo:
+        admin.get_io_config(dbdust_config_tester)
+    assert 'io_mode must be one of buffered, nocache, direct' == str(excinfo.value)
+
+
+def test_dbdusthandler_build_pipeline_io_mode(dbdust_config_full_tester, tmpdir, monkeypatch):
+    open_writer = Mock()
+    monkeypatch.setattr(admin.dbdust.cacheio, 'open_writer', open_writer)
+    dbdust_config_full_tester.set('general', 'io_mode', 'nocache')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler.report['estimated_size'] = 1000
+
+    pipeline = handler._build_pipeline(str(tmpdir.join(handler.file_name)))
+    assert pipeline.dest_file is open_writer.return_value
+    open_writer.assert_called_once_with(str(tmpdir.join(handler.file_name)), 'nocache', None, 1000)
+
+    # the size of a part is unknown
+    handler._build_pipeline(str(tmpdir.join('dump.part0000')))
+    open_writer.assert_called_with(str(tmpdir.join('dump.part0000')), 'nocache', None, None)
+
+    handler.dump_conf = dump_conf._replace(io_conf=dump_conf.io_conf._replace(mode='buffered'))
+    assert handler._build_pipeline(str(tmpdir.join(handler.file_name))) is None
+
+
+def test_dbdusthandler_process_page_cache_report(dbdust_config_full_tester, tmpdir):
+    dbdust_config_full_tester.set('general', 'page_cache_report', 'yes')
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        with open(tmp_file, 'wb') as dump_file:
+            dump_file.write(b'x' * 10000)
+
+    handler._dump = Mock(side_effect=dump)
+    handler._save = Mock()
+    handler.process(str(tmpdir.mkdir('tmp')))
+
+    page_cache = handler.report['page_cache']
+    assert page_cache['io_mode'] == 'buffered'
+    assert set(page_cache) >= {'cached_before', 'cached_after'}
+    if 'dump_pages' in page_cache:
+        assert page_cache['dump_pages'] == 3
+
+
+def test_get_dump_config_replicas(dbdust_config_full_tester, monkeypatch):
+    dbdust_config_full_tester.set('dbdust_tester.sh', 'replicas', 'replica1:3307, replica2')
+    with pytest.raises(Exception) as excinfo:
+        admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert 'replicas not supported by dbdust_tester.sh database' == str(excinfo.value)
+
+    replica_status = Mock()
+    monkeypatch.setitem(dumper.dumper_config['dbdust_tester.sh'], 'replica_status', replica_status)
+    dbdust_config_full_tester.set('dbdust_tester.sh', 'max_replica_lag', '30')
+    result = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    assert result.replicas == [{'host': 'replica1', 'port': '3307'}, {'host': 'replica2'}]
+    assert (result.max_replica_lag, result.replica_status) == (30, replica_status)
+    assert result.cli_conf == {'host': 'value1', 'port': 'value2'}
+
+
+def _replica_status(host=None, port=None):
+    return {'replica1': {'replica': True, 'lag': 1, 'load': 9},
+            'replica2': {'replica': True, 'lag': 2, 'load': 1},
+            'late': {'replica': True, 'lag': 600, 'load': 0}}[host]
+
+
+def test_dbdusthandler_process_replicas(dbdust_config_full_tester, tmpdir):
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        replicas=[{'host': 'replica1', 'port': '3307'}, {'host': 'replica2'}], replica_status=_replica_status)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock()
+    handler._save = Mock()
+
+    handler.process(str(tmpdir.mkdir('tmp')))
+
+    assert handler.dump_conf.cli_conf == {'host': 'replica2', 'port': 'value2'}
+    assert handler.report['source_host'] == 'replica2'
+
+    # no replica within the lag threshold : the configured host is used
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf._replace(replicas=[{'host': 'late'}]),
+                                        storage_conf)
+    handler._dump = Mock()
+    handler._save = Mock()
+    handler.process(str(tmpdir.join('tmp')))
+    assert handler.dump_conf.cli_conf == {'host': 'value1', 'port': 'value2'}
+    assert handler.report['source_host'] == 'value1'
+
+
+def test_dbdusthandler_dump_ranges_replicas(dbdust_config_full_tester, tmpdir):
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)._replace(
+        key_ranges=Mock(return_value=[{'query': 'q{}'.format(index)} for index in range(3)]), key_range_count=3,
+        key_range_workers=1, replicas=[{'host': 'replica1', 'port': '3307'}, {'host': 'replica2'}],
+        replica_status=_replica_status)
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+
+    def dump(tmp_dir, tmp_file, dest_file=None, cli_conf=None):
+        with open(tmp_file, 'w') as dump_file:
+            dump_file.write(cli_conf['query'])
+
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler._dump = Mock(side_effect=dump)
+    handler._select_replicas()
+    handler._dump_ranges(str(tmpdir), str(tmpdir.join(handler.file_name)))
+
+    sources = sorted((c[1]['cli_conf']['query'], c[1]['cli_conf']['host'], c[1]['cli_conf']['port'])
+                     for c in handler._dump.call_args_list)
+    assert sources == [('q0', 'replica2', 'value2'), ('q1', 'replica1', '3307'), ('q2', 'replica2', 'value2')]
+
+
+def _rotation_job(tmpdir, name, file_prefix, storage_dir):
+    job_config = tmpdir.join('{}.cfg'.format(name))
+    job_config.write("""[general]
+        database=dbdust_tester.sh
+        storage=local
+        file_prefix={}
+        date_format=%%Y%%m%%d
+        daily=1
+        weekly=0
+        monthly=0
+        rotate=no
+
+        [local]
+        path = {}
+        """.format(file_prefix, storage_dir))
+    return job_config
+
+
+def test_run_rotation(tmpdir, monkeypatch):
+    storage_dir = tmpdir.mkdir('storage')
+    for name in ('db1-20120114.sql', 'db1-20120113.sql', 'db1-db2-20120114.sql', 'db1-db2-20120101.sql'):
+        storage_dir.join(name).write(name)
+    queue = dbdust.workqueue.WorkQueue(str(tmpdir.join('queue')))
+    queue.submit('db1', str(_rotation_job(tmpdir, 'db1', 'db1-', storage_dir)))
+    queue.submit('db2', str(_rotation_job(tmpdir, 'db2', 'db1-db2-', storage_dir)))
+    listed = []
+    local_list = dbdust.storage.LocalStorage.list
+
+    def counted_list(self, *args, **kwargs):
+        listed.append(self.local_path)
+        return local_list(self, *args, **kwargs)
+    monkeypatch.setattr(dbdust.storage.LocalStorage, 'list', counted_list)
+
+    with freeze_time('2012-01-14'):
+        assert admin.run_rotation(admin.DbDustConfig(), str(tmpdir.join('queue'))) == 0
+
+    # both jobs share the storage location : it is listed once
+    assert listed == [str(storage_dir)]
+    assert sorted(os.listdir(str(storage_dir))) == ['db1-20120114.sql', 'db1-db2-20120114.sql']
+
+
+def test_dbdusthandler_rotate_disabled(dbdust_config_full_tester):
+    dbdust_config_full_tester.read_dict({'general': {'rotate': 'no'}})
+    storage_conf = admin.get_storage_config('local', dbdust_config_full_tester)
+    assert storage_conf.rotate is False
+    dump_conf = admin.get_dump_config('dbdust_tester.sh', dbdust_config_full_tester)
+    handler = admin.DbDustBackupHandler(admin.logger, dump_conf, storage_conf)
+    handler.storage_handler = Mock()
+    handler._rotate()
+    handler.storage_handler.rotate.assert_not_called()
@@ -0,0 +1,91 @@
+import io
+import os
+
+import pytest
+
+from dbdust import cacheio
+
+DATA = bytes(range(256)) * 4096
+
+
+@pytest.fixture
+def droppable(tmpdir):
+    """ Skip the test if the page cache of the tmp dir filesystem can not be measured or dropped (ex : tmpfs) """
+    probe = tmpdir.join('probe')
+    probe.write_binary(DATA)
+    with open(str(probe), 'rb') as probe_file:
+        os.fsync(probe_file.fileno())
+        cacheio.drop_cache(probe_file.fileno())
+    residency = cacheio.residency(str(probe))
+    probe.remove()
+    if residency is None or residency[0]:
+        pytest.skip('page cache of {} can not be dropped'.format(tmpdir))
+
+
+@pytest.mark.parametrize('io_mode', cacheio.IO_MODES)
+def test_open_writer(tmpdir, io_mode):
+    path = str(tmpdir.join('dump'))
+    with cacheio.open_writer(path, io_mode, sync_size=10000, preallocate_size=len(DATA) * 2) as dump_file:
+        dump_file.write(DATA)
+        dump_file.write(memoryview(b'tail'))
+
+    with cacheio.open_reader(path, io_mode, sync_size=10000) as dump_file:
+        assert dump_file.read() == DATA + b'tail'
+
+
+def test_open_buffered():
+    assert isinstance(cacheio.open_writer(os.devnull), io.BufferedWriter)
+    assert isinstance(cacheio.open_reader(os.devnull), io.BufferedReader)
+
+
+def test_no_cache_writer_append(tmpdir):
+    path = tmpdir.join('dump')
+    path.write_binary(b'0123456789')
+    with cacheio.NoCacheWriter(str(path), 'ab', direct=True) as dump_file:
+        assert dump_file.direct is False
+        dump_file.truncate(4)
+        dump_file.write(b'abc')
+    assert path.read_binary() == b'0123abc'
+
+
+def test_no_cache_writer_sync(tmpdir, monkeypatch):
+    ranges = []
+    monkeypatch.setattr(cacheio, 'drop_cache', lambda fd, offset, size: ranges.append((offset, size)))
+    with cacheio.NoCacheWriter(str(tmpdir.join('dump')), sync_size=4096) as dump_file:
+        dump_file.write(b'x' * 3000)
+        dump_file.write(b'x' * 3000)
+        dump_file.write(b'x' * 10)
+    assert ranges == [(0, 6000), (6000, 10)]
+
+
+def test_no_cache_reader_drop(tmpdir, monkeypatch):
+    ranges = []
+    monkeypatch.setattr(cacheio, 'drop_cache', lambda fd, offset, size: ranges.append((offset, size)))
+    tmpdir.join('dump').write_binary(b'x' * 100)
+    with cacheio.NoCacheReader(str(tmpdir.join('dump')), sync_size=30) as dump_file:
+        dump_file.read(20)
+        dump_file.read(20)
+        dump_file.seek(80)
+        dump_file.readinto(bytearray(10))
+    assert ranges == [(0, 40), (80, 10)]
+
+
+@pytest.mark.parametrize('io_mode,cached', [('buffered', True), ('nocache', False), ('direct', False)])
+def test_residency(tmpdir, droppable, io_mode, cached):
+    path = str(tmpdir.join('dump'))
+    with cacheio.open_writer(path, io_mode, sync_size=len(DATA) // 4) as dump_file:
+        for _ in range(4):
+            dump_file.write(DATA)
+    resident, pages = cacheio.residency(path)
+    assert pages == len(DATA) * 4 // 4096
+    assert (resident == pages) is cached
+
+    with cacheio.open_reader(path, io_mode) as dump_file:
+        dump_file.read()
+    assert (cacheio.residency(path)[0] > 0) is cached
+
+
+def test_cached_bytes():
+    if not os.path.exists('/proc/meminfo'):
+        pytest.skip('no /proc/meminfo')
+    assert cacheio.cached_bytes() > 0
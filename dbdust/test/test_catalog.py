@@ -0,0 +1,44 @@
+import json
+
+from dbdust import catalog
+
+
+def test_catalog_record_and_history(tmpdir):
+    catalog_file = tmpdir.join('catalog.jsonl')
+    dbdust_catalog = catalog.Catalog(str(catalog_file))
+    assert dbdust_catalog.history('job1') == []
+
+    dbdust_catalog.record({'job': 'job1', 'dump_size': 10, 'date': '2019-01-01T00:00:00'})
+    dbdust_catalog.record({'job': 'job2', 'dump_size': 20})
+    dbdust_catalog.record({'job': 'job1', 'dump_size': 30})
+    catalog_file.write('not json\n', mode='a')
+
+    history = dbdust_catalog.history('job1')
+    assert [e['dump_size'] for e in history] == [10, 30]
+    assert history[0]['date'] == '2019-01-01T00:00:00'
+    assert 'date' in history[1]
+    assert len(catalog_file.readlines()) == 4
+    assert json.loads(catalog_file.readlines()[1])['job'] == 'job2'
+
+
+def test_catalog_estimate(tmpdir):
+    dbdust_catalog = catalog.Catalog(str(tmpdir.join('catalog.jsonl')))
+    assert dbdust_catalog.estimate('job1') is None
+
+    for size, duration in [(1000, 100), (10, 1), (20, 2), (30, 3), (40, 4), (50, 5)]:
+        dbdust_catalog.record({'job': 'job1', 'dump_size': size, 'dump_duration': duration})
+    dbdust_catalog.record({'job': 'job1', 'dump_size': None})
+    dbdust_catalog.record({'job': 'job2', 'dump_size': 5000, 'dump_duration': 500})
+
+    assert dbdust_catalog.estimate('job1') == {'size': 50, 'duration': 3}
+
+
+def test_catalog_expected_duration(tmpdir):
+    dbdust_catalog = catalog.Catalog(str(tmpdir.join('catalog.jsonl')))
+    assert dbdust_catalog.expected_duration('job1') is None
+
+    dbdust_catalog.record({'job': 'job1', 'dump_duration': 10, 'upload_duration': 4})
+    dbdust_catalog.record({'job': 'job1', 'dump_duration': 10})
+    dbdust_catalog.record({'job': 'job1', 'dump_duration': 10, 'job_duration': 18})
+    dbdust_catalog.record({'job': 'job2', 'job_duration': 100})
+    assert dbdust_catalog.expected_duration('job1') == 14
@@ -0,0 +1,270 @@
+import collections
+import gzip
+import logging
+import os
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from dbdust import continuous, dumper, storage
+
+DumpConfig = collections.namedtuple('DumpConfig', 'type bin_path zip_path file_ext cli_func cli_conf')
+
+
+@pytest.fixture
+def streamer(tmpdir):
+    storage_impl = storage.LocalStorage(logging.getLogger(), str(tmpdir.mkdir('storage')))
+    storage_handler = storage.StorageHandler(storage_impl, 'binlog-', '%Y%m%d%H%M%S', 1, 1, 1, 1)
+    dump_conf = DumpConfig(type='mysql_binlog', bin_path='mysqlbinlog', zip_path=None, file_ext='gz',
+                           cli_func=dumper.mysql_binlog_cli_builder, cli_conf={'host': 'myhost'})
+    return continuous.BinlogStreamer(logging.getLogger(), dump_conf, storage_handler, str(tmpdir.mkdir('tmp')),
+                                     full_backup_prefix='backup-')
+
+
+def _stored(streamer):
+    local_path = streamer.storage_handler.storage_impl.local_path
+    return {name.split('.', 1)[1]: gzip.decompress(open(os.path.join(local_path, name), 'rb').read())
+            for name in os.listdir(local_path) if name.startswith('binlog-')}
+
+
+def test_binlog_streamer_build_cli(streamer, monkeypatch):
+    monkeypatch.setitem(dumper.dumper_config['mysql_binlog'], 'current_position', lambda **kwargs: 'mysql-bin.000007')
+
+    assert streamer.build_cli()[-1] == 'mysql-bin.000007'
+    assert streamer._load_state() == {'binlog_file': 'mysql-bin.000007', 'offset': 0}
+
+    streamer.state['binlog_file'] = 'mysql-bin.000008'
+    assert streamer.build_cli() == ['mysqlbinlog', '--read-from-remote-server', '--raw', '--stop-never',
+                                    '--result-file={}/'.format(streamer.spool_dir), '-h', 'myhost',
+                                    'mysql-bin.000008']
+
+
+def test_binlog_streamer_ship(streamer):
+    spool = streamer.spool_dir
+    streamer.state = {'binlog_file': 'mysql-bin.000002', 'offset': 0}
+    with open(os.path.join(spool, 'mysql-bin.000001'), 'wb') as binlog:
+        binlog.write(b'already stored')
+    with open(os.path.join(spool, 'mysql-bin.000002'), 'wb') as binlog:
+        binlog.write(b'0123')
+
+    streamer.ship()
+    with open(os.path.join(spool, 'mysql-bin.000002'), 'ab') as binlog:
+        binlog.write(b'456')
+    with open(os.path.join(spool, 'mysql-bin.000003'), 'wb') as binlog:
+        binlog.write(b'789')
+    streamer.ship()
+    streamer.ship()
+
+    assert _stored(streamer) == {'mysql-bin.000002.000000000000.gz': b'0123',
+                                 'mysql-bin.000002.000000000004.gz': b'456',
+                                 'mysql-bin.000003.000000000000.gz': b'789'}
+    assert sorted(os.listdir(spool)) == ['mysql-bin.000003']
+    assert streamer._load_state() == {'binlog_file': 'mysql-bin.000003', 'offset': 3}
+
+
+def test_binlog_streamer_rotate(streamer):
+    local_path = streamer.storage_handler.storage_impl.local_path
+    for name in ['backup-20190506000000.sql.gz', 'backup-20190507000000.sql.gz',
+                 'binlog-20190504000000.mysql-bin.000001.000000000000.gz',
+                 'binlog-20190504230000.mysql-bin.000001.000000000100.gz',
+                 'binlog-20190505000000.mysql-bin.000002.000000000000.gz',
+                 'binlog-20190505230000.mysql-bin.000003.000000000000.gz',
+                 'binlog-20190506010000.mysql-bin.000004.000000000000.gz']:
+        open(os.path.join(local_path, name), 'w').close()
+
+    streamer.rotate()
+
+    assert sorted(os.listdir(local_path)) == ['backup-20190506000000.sql.gz', 'backup-20190507000000.sql.gz',
+                                              'binlog-20190505230000.mysql-bin.000003.000000000000.gz',
+                                              'binlog-20190506010000.mysql-bin.000004.000000000000.gz']
+
+
+def test_binlog_streamer_rotate_split_binlog(streamer):
+    local_path = streamer.storage_handler.storage_impl.local_path
+    # the segments of mysql-bin.000002 are on both sides of the oldest full backup
+    names = ['backup-20190506000000.sql.gz',
+             'binlog-20190504000000.mysql-bin.000001.000000000000.gz',
+             'binlog-20190505000000.mysql-bin.000002.000000000000.gz',
+             'binlog-20190505220000.mysql-bin.000002.000000000100.gz',
+             'binlog-20190505230000.mysql-bin.000002.000000000200.gz',
+             'binlog-20190506010000.mysql-bin.000002.000000000300.gz']
+    for name in names:
+        open(os.path.join(local_path, name), 'w').close()
+
+    streamer.rotate()
+
+    assert sorted(os.listdir(local_path)) == names[:1] + names[2:]
+
+
+def test_binlog_streamer_run(streamer, monkeypatch):
+    monkeypatch.setattr(streamer, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(streamer, 'build_cli', lambda: [
+        'sh', '-c', 'printf 012 > mysql-bin.000001; sleep 0.1; printf 345 > mysql-bin.000002; sleep 30'])
+    streamer.state = {'binlog_file': 'mysql-bin.000001', 'offset': 0}
+    timer = threading.Timer(0.5, streamer.stop)
+    timer.start()
+
+    streamer.run()
+
+    assert streamer.process.returncode != 0
+    assert _stored(streamer) == {'mysql-bin.000001.000000000000.gz': b'012',
+                                 'mysql-bin.000002.000000000000.gz': b'345'}
+
+
+class FakeOplog(object):
+    def __init__(self, entries, stop=None):
+        self.entries = entries
+        self.queries = []
+        self.alive = True
+        self.stop = stop
+
+    def get_collection(self, name, codec_options=None):
+        assert name == 'oplog.rs'
+        return self
+
+    def find(self, query=None, cursor_type=None):
+        self.queries.append(query)
+        return self
+
+    def sort(self, *args):
+        self.alive = True
+        return self
+
+    def limit(self, count):
+        return iter(self.entries[-count:])
+
+    def max_await_time_ms(self, value):
+        return self
+
+    def __iter__(self):
+        entries = [e for e in self.entries if e['ts'] > self.queries[-1]['ts']['$gt']]
+        yield from entries[:-1]
+        # the streamer is stopped with the last entry, without stop the cursor is closed
+        if self.stop is not None:
+            self.stop()
+        else:
+            self.alive = False
+        yield from entries[-1:]
+
+
+def _oplog_entry(time, inc):
+    bson = pytest.importorskip('bson')
+    from bson.raw_bson import RawBSONDocument
+    return RawBSONDocument(bson.encode({'ts': bson.Timestamp(time, inc), 'op': 'i', 'ns': 'db.col',
+                                        'o': {'_id': inc}}))
+
+
+@pytest.fixture
+def oplog_streamer(tmpdir):
+    pytest.importorskip('pymongo')
+    storage_impl = storage.LocalStorage(logging.getLogger(), str(tmpdir.mkdir('storage')))
+    storage_handler = storage.StorageHandler(storage_impl, 'oplog-', '%Y%m%d%H%M%S', 1, 1, 1, 1)
+    dump_conf = DumpConfig(type='mongo_oplog', bin_path=None, zip_path=None, file_ext='bson.gz',
+                           cli_func=None, cli_conf={'database': 'db'})
+    return continuous.OplogStreamer(logging.getLogger(), dump_conf, storage_handler, str(tmpdir.mkdir('tmp')))
+
+
+def test_oplog_streamer_tail_and_ship(oplog_streamer):
+    entries = [_oplog_entry(100, 1), _oplog_entry(100, 2), _oplog_entry(101, 1)]
+    oplog = FakeOplog(entries, oplog_streamer.stop)
+    oplog_streamer.connect = lambda: type('Client', (), {'local': oplog})()
+    oplog_streamer.state = {'ts': [100, 1]}
+
+    oplog_streamer._tail()
+    oplog_streamer.ship()
+    oplog_streamer.ship()
+
+    assert oplog_streamer.error is None
+    assert oplog.queries[-1] == {'ts': {'$gt': entries[0]['ts']},
+                                 '$or': [{'ns': {'$regex': '^db\\.'}},
+                                         {'ns': 'admin.$cmd', 'o.applyOps': {'$exists': True}}]}
+    stored = oplog_streamer.storage_handler.storage_impl.list()
+    assert len(stored) == 1
+    assert stored[0]['file_name'].endswith('.oplog.0000000100-000002.bson.gz')
+    with open(stored[0]['path'], 'rb') as segment:
+        assert gzip.decompress(segment.read()) == entries[1].raw + entries[2].raw
+    assert oplog_streamer._load_state() == {'ts': [101, 1]}
+    assert os.listdir(oplog_streamer.spool_dir) == []
+
+
+def test_oplog_streamer_first_run_starts_at_last_entry(oplog_streamer):
+    entries = [_oplog_entry(100, 1), _oplog_entry(100, 2)]
+    oplog = FakeOplog(entries, oplog_streamer.stop)
+    oplog_streamer.connect = lambda: type('Client', (), {'local': oplog})()
+
+    oplog_streamer._tail()
+
+    assert oplog.queries[-1]['ts'] == {'$gt': entries[1]['ts']}
+    # saved before the first segment
+    assert oplog_streamer._load_state() == {'ts': [100, 2]}
+    oplog_streamer.ship()
+    assert oplog_streamer.storage_handler.storage_impl.list() == []
+
+
+def test_oplog_streamer_cursor_closed(oplog_streamer):
+    entries = [_oplog_entry(100, 1), _oplog_entry(100, 2)]
+    oplog_streamer.connect = lambda: type('Client', (), {'local': FakeOplog(entries)})()
+    oplog_streamer.state = {'ts': [100, 1]}
+
+    oplog_streamer._tail()
+
+    # the entries received are kept for the next segment, the streamer is restarted
+    assert oplog_streamer.source_exit_reason() == 'DbDustDumpException: mongo oplog : the tailable cursor was closed'
+    assert oplog_streamer.last_ts == entries[1]['ts']
+
+
+def test_oplog_streamer_error(oplog_streamer):
+    oplog_streamer.connect = lambda: (_ for _ in ()).throw(Exception('connection refused'))
+    oplog_streamer.start_source()
+    oplog_streamer.stop_source()
+    assert oplog_streamer.source_alive() is False
+    assert oplog_streamer.source_exit_reason() == 'Exception: connection refused'
+
+
+def _transaction_entry(time, namespaces):
+    bson = pytest.importorskip('bson')
+    from bson.raw_bson import RawBSONDocument
+    return RawBSONDocument(bson.encode({
+        'ts': bson.Timestamp(time, 1), 'op': 'c', 'ns': 'admin.$cmd', 'lsid': {'id': 1}, 'txnNumber': bson.Int64(3),
+        'o': {'applyOps': [{'op': 'i', 'ns': ns, 'o': {'_id': index}} for index, ns in enumerate(namespaces)]}}))
+
+
+def test_oplog_streamer_transactions(oplog_streamer):
+    bson = pytest.importorskip('bson')
+    entries = [_transaction_entry(100, ['db.col', 'other.col', 'db.col2']), _transaction_entry(101, ['other.col']),
+               _transaction_entry(102, ['db.col'])]
+    oplog = FakeOplog(entries, oplog_streamer.stop)
+    oplog_streamer.connect = lambda: type('Client', (), {'local': oplog})()
+    oplog_streamer.state = {'ts': [99, 1]}
+
+    oplog_streamer._tail()
+    oplog_streamer.ship()
+
+    stored = oplog_streamer.storage_handler.storage_impl.list()
+    with open(stored[0]['path'], 'rb') as segment:
+        documents = bson.decode_all(gzip.decompress(segment.read()))
+    # the operations on other databases are removed, the transaction without any is skipped
+    assert [[operation['ns'] for operation in document['o']['applyOps']] for document in documents] == [
+        ['db.col', 'db.col2'], ['db.col']]
+    assert documents[0]['txnNumber'] == bson.Int64(3)
+    assert bson.encode(documents[1]) == entries[2].raw
+
+
+def test_oplog_streamer_run_error_exits(oplog_streamer, monkeypatch):
+    class IdleOplog(FakeOplog):
+        def __iter__(self):
+            return iter([])
+
+    monkeypatch.setattr(oplog_streamer, 'POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(oplog_streamer, 'segment_duration', 0)
+    oplog_streamer.connect = lambda: type('Client', (), {'local': IdleOplog([])})()
+    oplog_streamer.state = {'ts': [99, 1]}
+    oplog_streamer.ship = Mock(side_effect=Exception('storage down'))
+
+    # the tailing thread is stopped and the error of ship is raised, ship is not called again
+    with pytest.raises(Exception) as excinfo:
+        oplog_streamer.run()
+    assert 'storage down' == str(excinfo.value)
+    assert oplog_streamer.source_alive() is False
+    assert oplog_streamer.ship.call_count == 1
@@ -0,0 +1,139 @@
+import base64
+import io
+import os
+import subprocess
+
+import pytest
+
+from dbdust import crypto, pipeline
+
+KEY = bytes(range(32))
+
+
+def _encrypt(data, segment_size=4, chunk_size=3, workers=2):
+    stage = crypto.EncryptStage(KEY, segment_size, workers)
+    output = b''
+    for start in range(0, len(data), chunk_size):
+        output += stage.process(data[start:start + chunk_size])
+    return output + stage.flush()
+
+
+def _decrypt(data, workers=2):
+    return crypto.DecryptingReader(io.BytesIO(data), {crypto.key_id(KEY): KEY}, workers).read()
+
+
+@pytest.mark.parametrize('data', [b'', b'012', b'0123', b'0123456789', b'01234567'])
+def test_encrypt_stage_roundtrip(data):
+    encrypted = _encrypt(data)
+
+    assert encrypted.startswith(crypto.MAGIC)
+    assert _decrypt(encrypted) == data
+    assert _decrypt(encrypted, workers=1) == data
+
+
+def test_encrypt_stage_segment_views():
+    stage = crypto.EncryptStage(KEY, 4, 1)
+    encrypt = stage._encrypt
+    segments = []
+
+    def record(index, data, last):
+        segments.append((type(data), bytes(data)))
+        return encrypt(index, data, last)
+    stage._encrypt = record
+
+    # segments spanning several chunks and several segments in a chunk
+    encrypted = b''.join([stage.process(b'01'), stage.process(b'2345678901'), stage.process(b'23'), stage.flush()])
+
+    assert segments == [(memoryview, b'0123'), (memoryview, b'4567'), (memoryview, b'8901'), (bytearray, b'23')]
+    assert _decrypt(encrypted) == b'01234567890123'
+
+
+def test_encrypt_stage_report():
+    stage = crypto.EncryptStage(KEY)
+    assert stage.report() == {'encryption': 'aes-gcm', 'encryption_key_id': crypto.key_id(KEY)}
+
+
+def test_decrypting_reader_sized_reads():
+    reader = crypto.DecryptingReader(io.BytesIO(_encrypt(b'0123456789')), {crypto.key_id(KEY): KEY})
+    assert reader.read(3) == b'012'
+    assert reader.read(5) == b'34567'
+    assert reader.read(5) == b'89'
+    assert reader.read(5) == b''
+
+
+def test_decrypting_reader_truncated():
+    encrypted = _encrypt(b'0123456789')
+    header_size = len(encrypted) - 3 * crypto.TAG_SIZE - 10
+    # drop the last segment : the previous one is not flagged as the last one
+    truncated = encrypted[:header_size + 2 * (4 + crypto.TAG_SIZE)]
+
+    with pytest.raises(crypto.DbDustCryptoException) as excinfo:
+        _decrypt(truncated)
+    assert 'segment 1 is corrupted or the file is truncated' == str(excinfo.value)
+
+
+def test_decrypting_reader_tampered():
+    encrypted = bytearray(_encrypt(b'0123456789'))
+    encrypted[-1] ^= 1
+
+    with pytest.raises(crypto.DbDustCryptoException):
+        _decrypt(bytes(encrypted))
+
+
+def test_decrypting_reader_unknown_key():
+    with pytest.raises(crypto.DbDustCryptoException) as excinfo:
+        crypto.DecryptingReader(io.BytesIO(_encrypt(b'012')), {})
+    assert 'key {} needed to decrypt the file'.format(crypto.key_id(KEY)) == str(excinfo.value)
+
+    with pytest.raises(crypto.DbDustCryptoException):
+        crypto.DecryptingReader(io.BytesIO(b'not encrypted'), {})
+
+
+def test_load_key(tmpdir):
+    raw_key = tmpdir.join('raw.key')
+    raw_key.write_binary(KEY)
+    b64_key = tmpdir.join('b64.key')
+    b64_key.write(base64.b64encode(KEY).decode() + '\n')
+    bad_key = tmpdir.join('bad.key')
+    bad_key.write('bad')
+
+    assert crypto.load_key(str(raw_key)) == KEY
+    assert crypto.load_keys([str(b64_key)]) == {crypto.key_id(KEY): KEY}
+    with pytest.raises(crypto.DbDustCryptoException):
+        crypto.load_key(str(bad_key))
+
+
+def test_encrypt_stage_in_pipeline(tmpdir):
+    dest = tmpdir.join('dump.txt.enc')
+    data = os.urandom(100000)
+    src = tmpdir.join('src')
+    src.write_binary(data)
+    dump_pipeline = pipeline.DumpPipeline(str(dest), chunk_size=3000,
+                                          stages=[crypto.EncryptStage(KEY, 1024, 4), pipeline.ChecksumStage()])
+    fifo_path = dump_pipeline.prepare()
+    process = subprocess.Popen('cat {} > {}'.format(src, fifo_path), shell=True)
+
+    assert dump_pipeline.run(process) == 0
+    decrypted = tmpdir.join('dump.txt')
+    crypto.decrypt_file(str(dest), str(decrypted), {crypto.key_id(KEY): KEY}, workers=3)
+    assert decrypted.read_binary() == data
+    assert dump_pipeline.report()['bytes_written'] == dest.size()
+
+
+def test_encrypt_stage_closed_on_failed_dump(tmpdir):
+    stage = crypto.EncryptStage(KEY, 1024, 2)
+
+    def chunks():
+        yield os.urandom(10000)
+        raise IOError('dump failed')
+    dump_pipeline = pipeline.DumpPipeline(str(tmpdir.join('dump.txt.enc')), chunk_size=3000, stages=[stage])
+
+    with pytest.raises(IOError):
+        dump_pipeline.consume(chunks())
+
+    # not flushed : the pending segments are dropped and the threads of the pool end
+    assert not stage.pending
+    assert stage.executor._shutdown
+    for thread in list(stage.executor._threads):
+        thread.join(5)
+        assert not thread.is_alive()
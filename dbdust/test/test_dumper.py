@@ -1,4 +1,7 @@
+import datetime
+
 import pytest
+from unittest.mock import Mock
 
 import dbdust.dumper as dumper
 
@@ -120,3 +123,200 @@ def test_dumper_config():
     for config_key, config_dict in dumper.dumper_config.items():
         if not all(k in config_dict for k in ("bin_name", "zip_name", "file_ext", "cli_builder")):
             pytest.fail('key {} is missing dumper config'.format(config_key))
+
+
+def test_mysql_size_estimator_no_client(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value=None))
+    assert dumper.mysql_size_estimator(host='myhost') is None
+
+
+def test_mysql_size_estimator(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value='/usr/bin/mysql'))
+    check_output = Mock(return_value=b'123456\n')
+    monkeypatch.setattr(dumper.subprocess, 'check_output', check_output)
+
+    assert dumper.mysql_size_estimator(host='myhost', port='123', username='myuser', password='mypass',
+                                       database="my'db") == 123456
+    assert check_output.call_args[0][0] == ['/usr/bin/mysql', '-N', '-B', '-h', 'myhost', '-P', '123',
+                                            '-u', 'myuser', '-pmypass', '-e',
+                                            "SELECT COALESCE(SUM(data_length), 0) FROM information_schema.tables "
+                                            "WHERE table_schema = 'my\\'db'"]
+
+    dumper.mysql_size_estimator(all_databases=True)
+    assert check_output.call_args[0][0][-1].endswith(
+        "table_schema NOT IN ('information_schema', 'performance_schema', 'sys')")
+
+
+def test_mongo_size_estimator(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(side_effect=[None, '/usr/bin/mongo']))
+    check_output = Mock(return_value=b'some warning\n1.5E3\n')
+    monkeypatch.setattr(dumper.subprocess, 'check_output', check_output)
+
+    assert dumper.mongo_size_estimator(host='myhost', database='mydb', collection='mycol') == 1500
+    assert check_output.call_args[0][0] == ['/usr/bin/mongo', '--quiet', '--host', 'myhost', 'mydb', '--eval',
+                                            'print(db.getCollection("mycol").stats().size)']
+
+
+def test_mongo_size_estimator_no_shell(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value=None))
+    assert dumper.mongo_size_estimator(uri='uristr') is None
+
+
+def test_mysql_binlog_cli_builder():
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mysql_binlog_cli_builder('mysqlbinlog', None, '/spool', None, host='myhost')
+    assert dumper.mysql_binlog_cli_builder('mysqlbinlog', None, '/spool', None, host='myhost', port='123',
+                                           username='myuser', password='mypass', server_id='99',
+                                           start_file='mysql-bin.000042') == [
+        'mysqlbinlog', '--read-from-remote-server', '--raw', '--stop-never', '--result-file=/spool/',
+        '-h', 'myhost', '-P', '123', '-u', 'myuser', '-pmypass', '--connection-server-id=99', 'mysql-bin.000042']
+
+
+def test_mysql_binlog_current_file(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value='/usr/bin/mysql'))
+    check_output = Mock(side_effect=[dumper.subprocess.CalledProcessError(1, 'mysql'),
+                                     b'mysql-bin.000042\t1234\t\t\t\n'])
+    monkeypatch.setattr(dumper.subprocess, 'check_output', check_output)
+
+    assert dumper.mysql_binlog_current_file(host='myhost', start_file='ignored') == 'mysql-bin.000042'
+    assert check_output.call_args[0][0] == ['/usr/bin/mysql', '-N', '-B', '-h', 'myhost', '-e', 'SHOW MASTER STATUS']
+
+    check_output.side_effect = [b'', b'']
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mysql_binlog_current_file()
+
+
+def test_mysql_cli_builder_table():
+    assert dumper.mysql_cli_builder("mysqldump", None, None, "mydumpfile", database="mydb", table="mytable") == [
+        'mysqldump', 'mydb', 'mytable', '>', 'mydumpfile']
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mysql_cli_builder("mysqldump", None, None, "mydumpfile", all_databases=True, table="mytable")
+
+
+def test_mysql_table_indicators(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value='/usr/bin/mysql'))
+    check_output = Mock(side_effect=[b'archive\t2019-01-01 10:00:00\t1000\t2019-01-02 00:00:00\n'
+                                     b'live\tNULL\t20\t2019-01-02 00:00:00\n',
+                                     b'my`db.archive\t12345\nmy`db.live\t678\n'])
+    monkeypatch.setattr(dumper.subprocess, 'check_output', check_output)
+
+    assert dumper.mysql_table_indicators(host='myhost', database='my`db', checksum=True) == {
+        'archive': {'update_time': '2019-01-01 10:00:00', 'rows': 1000, 'read_at': '2019-01-02 00:00:00',
+                    'checksum': '12345'},
+        'live': {'update_time': None, 'rows': 20, 'read_at': '2019-01-02 00:00:00', 'checksum': '678'}}
+    assert check_output.call_args_list[0][0][0][-1] == (
+        "SELECT table_name, COALESCE(update_time, 'NULL'), COALESCE(table_rows, 'NULL'), NOW() "
+        "FROM information_schema.tables WHERE table_schema = 'my`db' AND table_type = 'BASE TABLE'")
+    assert check_output.call_args_list[1][0][0][-1] == 'CHECKSUM TABLE `my``db`.`archive`, `my``db`.`live`'
+
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mysql_table_indicators(host='myhost')
+
+
+def test_mongo_cli_builder_query():
+    assert dumper.mongo_cli_builder("mongodump", None, None, "mydumpfile", database="mydb", collection="mycol",
+                                    query='{"_id": {"$gte": 1}}') == [
+        'mongodump', '--db', 'mydb', '--collection', 'mycol', '--query', '\'{"_id": {"$gte": 1}}\'', '--gzip',
+        '--archive=mydumpfile']
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mongo_cli_builder("mongodump", None, None, "mydumpfile", database="mydb", query='{}')
+
+
+def test_mongo_range_queries():
+    assert dumper.mongo_range_queries([]) == ['{}']
+    assert dumper.mongo_range_queries([10, 20]) == [
+        '{"_id": {"$not": {"$gte": {"$numberInt": "10"}}}}',
+        '{"_id": {"$gte": {"$numberInt": "10"}, "$lt": {"$numberInt": "20"}}}',
+        '{"_id": {"$gte": {"$numberInt": "20"}}}']
+
+
+def test_mongo_key_ranges_split_vector(monkeypatch):
+    client = Mock()
+    db = client.__getitem__ = Mock()
+    db.return_value.name = 'mydb'
+    db.return_value.command.side_effect = [{'size': 1000},
+                                           {'splitKeys': [{'_id': i} for i in (5, 10, 15, 20, 25, 30, 35)]}]
+    mongo_client = Mock(return_value=client)
+    monkeypatch.setattr(dumper, 'mongo_client', mongo_client)
+
+    ranges = dumper.mongo_key_ranges(4, host='myhost', database='mydb', collection='mycol')
+
+    assert db.return_value.command.call_args_list[1][0] == ('splitVector', 'mydb.mycol')
+    assert db.return_value.command.call_args_list[1][1] == {'keyPattern': {'_id': 1}, 'maxChunkSizeBytes': 250}
+    assert ranges == [{'query': query} for query in dumper.mongo_range_queries([10, 20, 30])]
+    mongo_client.assert_called_once_with(host='myhost')
+    client.close.assert_called_once_with()
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mongo_key_ranges(4, host='myhost', database='mydb')
+
+
+def test_mongo_key_ranges_sampled(monkeypatch):
+    client = Mock()
+    db = client.__getitem__ = Mock()
+    db.return_value.command.side_effect = dumper.pymongo.errors.OperationFailure('not authorized')
+    db.return_value.__getitem__ = Mock()
+    collection = db.return_value.__getitem__.return_value
+    collection.aggregate.return_value = [{'_id': i} for i in (8, 2, 'x', 6, 4)]
+    monkeypatch.setattr(dumper, 'mongo_client', Mock(return_value=client))
+
+    ranges = dumper.mongo_key_ranges(2, database='mydb', collection='mycol')
+
+    assert collection.aggregate.call_args[0][0][0] == {'$sample': {'size': 2 * dumper.MONGO_SAMPLES_PER_RANGE}}
+    assert ranges == [{'query': query} for query in dumper.mongo_range_queries([6])]
+
+
+def test_mysql_native_dumper(monkeypatch):
+    pymysql = Mock()
+    monkeypatch.setattr(dumper.dbdust.native, 'pymysql', pymysql)
+    result = dumper.mysql_native_dumper(host='myhost', port='3307', username='me', database='mydb', workers='4',
+                                        statement_size='2M', table='mytable')
+
+    assert result.database == 'mydb'
+    assert result.workers == 4
+    assert result.statement_size == 2 * 1024 * 1024
+    assert result.tables == ['mytable']
+    result.connect()
+    pymysql.connect.assert_called_once_with(host='myhost', port=3307, user='me', password='', charset='utf8mb4')
+
+    with pytest.raises(dumper.DbDustDumpException):
+        dumper.mysql_native_dumper(host='myhost')
+    monkeypatch.setattr(dumper.dbdust.native, 'pymysql', None)
+    with pytest.raises(dumper.DbDustDumpException) as excinfo:
+        dumper.mysql_native_dumper(database='mydb')
+    assert 'mysql native : pymysql package is needed' == str(excinfo.value)
+
+
+def test_mysql_replica_status(monkeypatch):
+    monkeypatch.setattr(dumper.shutil, 'which', Mock(return_value='/usr/bin/mysql'))
+    check_output = Mock(side_effect=[dumper.subprocess.CalledProcessError(1, 'mysql'),
+                                     b'Slave_IO_State\tSeconds_Behind_Master\nWaiting\t12\n',
+                                     b'Threads_running\t7\n'])
+    monkeypatch.setattr(dumper.subprocess, 'check_output', check_output)
+
+    assert dumper.mysql_replica_status(host='replica1', port='3307', database='mydb') == {
+        'replica': True, 'lag': 12, 'load': 7}
+    assert check_output.call_args_list[0][0][0] == ['/usr/bin/mysql', '-B', '-h', 'replica1', '-P', '3307',
+                                                    '--connect-timeout=10', '-e', 'SHOW REPLICA STATUS']
+
+    # the primary, and a replica with the replication stopped
+    check_output.side_effect = [b'', b'Threads_running\t3\n',
+                                b'Replica_IO_State\tSeconds_Behind_Source\n\tNULL\n', b'Threads_running\t1\n']
+    assert dumper.mysql_replica_status(host='primary') == {'replica': False, 'lag': None, 'load': 3}
+    assert dumper.mysql_replica_status(host='replica2') == {'replica': True, 'lag': None, 'load': 1}
+
+
+def test_mongo_replica_status(monkeypatch):
+    client = Mock()
+    now = datetime.datetime(2019, 5, 6, 11, 9, 52)
+    members = [{'stateStr': 'PRIMARY', 'optimeDate': now},
+               {'stateStr': 'SECONDARY', 'optimeDate': now - datetime.timedelta(seconds=5), 'self': True}]
+    client.admin.command.side_effect = [{'globalLock': {'activeClients': {'total': 4}}}, {'members': members}]
+    mongo_client = Mock(return_value=client)
+    monkeypatch.setattr(dumper, 'mongo_client', mongo_client)
+
+    assert dumper.mongo_replica_status(host='replica1', database='mydb') == {'replica': True, 'lag': 5, 'load': 4}
+    mongo_client.assert_called_once_with(direct_connection=True, host='replica1', database='mydb')
+    client.close.assert_called_once_with()
+
+    client.admin.command.side_effect = [{}, dumper.pymongo.errors.OperationFailure('not running with --replSet')]
+    assert dumper.mongo_replica_status(host='standalone') == {'replica': False, 'lag': None, 'load': None}
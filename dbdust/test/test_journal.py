@@ -0,0 +1,45 @@
+import json
+
+from dbdust import journal
+
+
+def test_upload_journal_create_and_load(tmpdir):
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql', tmp_file='/tmp/backup-1.sql')
+
+    assert upload_journal.path == str(tmpdir.join('dbdust-backup-1.sql.journal'))
+    assert json.loads(tmpdir.join('dbdust-backup-1.sql.journal').read()) == {'file_name': 'backup-1.sql',
+                                                                             'tmp_file': '/tmp/backup-1.sql'}
+    loaded = journal.UploadJournal.load(upload_journal.path)
+    assert loaded.state == upload_journal.state
+
+
+def test_upload_journal_update(tmpdir):
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+    upload_journal.update(upload={'offset': 10})
+
+    assert journal.UploadJournal.load(upload_journal.path).state == {'file_name': 'backup-1.sql',
+                                                                     'upload': {'offset': 10}}
+    assert tmpdir.listdir() == [tmpdir.join('dbdust-backup-1.sql.journal')]
+
+
+def test_upload_journal_list_and_delete(tmpdir):
+    tmpdir.mkdir('dbdust-abcd')
+    tmpdir.join('other.journal').write('')
+    journal.UploadJournal.create(str(tmpdir), 'backup-2.sql')
+    journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+
+    journals = journal.UploadJournal.list(str(tmpdir))
+    assert [j.state['file_name'] for j in journals] == ['backup-1.sql', 'backup-2.sql']
+
+    journals[0].delete()
+    journals[0].delete()
+    assert [j.state['file_name'] for j in journal.UploadJournal.list(str(tmpdir))] == ['backup-2.sql']
+
+
+def test_segment_journal_list(tmpdir):
+    journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+    checkpoint = journal.SegmentJournal.create(str(tmpdir), 'backup-2.sql', segments=[], parts={})
+
+    assert checkpoint.path == str(tmpdir.join('dbdust-backup-2.sql.checkpoint'))
+    assert [j.state['file_name'] for j in journal.SegmentJournal.list(str(tmpdir))] == ['backup-2.sql']
+    assert [j.state['file_name'] for j in journal.UploadJournal.list(str(tmpdir))] == ['backup-1.sql']
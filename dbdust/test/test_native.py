@@ -0,0 +1,208 @@
+import re
+
+import pytest
+
+from dbdust import native
+
+
+class FakeServer(object):
+    """ Answer the queries of the native dumper from tables kept in memory """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+        self.connections = []
+
+    def connect(self):
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def answer(self, query, args):
+        self.queries.append(query)
+        match = re.match(r'SHOW (CREATE TABLE|COLUMNS FROM) `db`\.`(\w+)`', query)
+        if query.startswith('SHOW FULL TABLES'):
+            return [(name, table.get('type', 'BASE TABLE')) for name, table in self.tables.items()]
+        if match and match.group(1) == 'CREATE TABLE':
+            return [(match.group(2), 'CREATE TABLE `{}` (...)'.format(match.group(2)))]
+        if match:
+            return [(name, column_type, 'NO', key, None, extra)
+                    for name, column_type, key, extra in self.tables[match.group(2)]['columns']]
+        if 'information_schema' in query:
+            return [(len(self.tables[args[1]]['rows']),)]
+        match = re.match(r'SELECT MIN\(`id`\), MAX\(`id`\) FROM `db`\.`(\w+)`', query)
+        if match:
+            ids = [row[0] for row in self.tables[match.group(1)]['rows']]
+            return [(min(ids), max(ids))]
+        match = re.match(r'SELECT .* FROM `db`\.`(\w+)`(?: WHERE `id` >= (\d+) AND `id` <= (\d+))?$', query)
+        if match:
+            rows = self.tables[match.group(1)]['rows']
+            if match.group(2):
+                rows = [row for row in rows if int(match.group(2)) <= row[0] <= int(match.group(3))]
+            return [row[:2] for row in rows]
+        return []
+
+
+class FakeCursor(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.rows = list(self.server.answer(query, args))
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.server)
+
+    def literal(self, value):
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bytes):
+            return "_binary'{}'".format(value.decode('ascii', 'surrogateescape'))
+        if isinstance(value, str):
+            return "'{}'".format(value.replace("'", "\\'"))
+        return str(value)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_server():
+    columns = [('id', 'int(11) unsigned', 'PRI', ''), ('name', 'varchar(20)', '', ''),
+               ('upper_name', 'varchar(20)', '', 'VIRTUAL GENERATED')]
+    return FakeServer({
+        'small': {'columns': columns, 'rows': [(1, "o'neil", None), (2, None, None)]},
+        'big': {'columns': columns, 'rows': [(i, 'n{}'.format(i), None) for i in range(1, 11)]},
+        'names': {'type': 'VIEW'},
+    })
+
+
+def test_quote_identifier():
+    assert native.quote_identifier('my`table') == '`my``table`'
+
+
+@pytest.mark.parametrize('low, high, count, expected', [
+    (1, 10, 3, [(1, 3), (4, 6), (7, 10)]),
+    (1, 10, 1, [(1, 10)]),
+    (5, 6, 4, [(5, 5), (6, 6)]),
+    (-2, 2, 0, [(-2, 2)]),
+])
+def test_split_ranges(low, high, count, expected):
+    assert native.split_ranges(low, high, count) == expected
+
+
+def test_encode_inserts():
+    literal = FakeConnection(None).literal
+    rows = [(1, 'a'), (2, None), (3, b'\xff\x00')]
+    statements = list(native.encode_inserts('t`1', ['id', 'name'], rows, literal, max_size=60))
+
+    assert statements == [b"INSERT INTO `t``1` (`id`,`name`) VALUES (1,'a'),(2,NULL);\n",
+                          b"INSERT INTO `t``1` (`id`,`name`) VALUES (3,_binary'\xff\x00');\n"]
+    assert list(native.encode_inserts('t', ['id'], [], literal)) == []
+
+
+def test_fetch_rows():
+    cursor = FakeCursor(None)
+    cursor.rows = [(1,), (2,), (3,)]
+    assert list(native.fetch_rows(cursor, 2)) == [(1,), (2,), (3,)]
+
+
+def test_table_unit_query():
+    assert native.TableUnit('db', 't', ['id', 'name']).query() == 'SELECT `id`,`name` FROM `db`.`t`'
+    assert native.TableUnit('db', 't', ['id'], 'id', 1, 5).query() == (
+        'SELECT `id` FROM `db`.`t` WHERE `id` >= 1 AND `id` <= 5')
+
+
+def test_mysql_native_dumper_single_worker(fake_server):
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', batch_rows=1)
+    dump = b''.join(dumper.chunks()).decode()
+
+    assert dump.startswith('-- dbdust native dump of `db`\n')
+    assert dump.endswith('-- Dump completed\n')
+    assert 'DROP TABLE IF EXISTS `small`;\nCREATE TABLE `small` (...);' in dump
+    assert "INSERT INTO `small` (`id`,`name`) VALUES (1,'o\\'neil'),(2,NULL);" in dump
+    assert 'names' not in dump
+    assert 'FLUSH TABLES WITH READ LOCK' not in fake_server.queries
+    assert 'START TRANSACTION WITH CONSISTENT SNAPSHOT' in fake_server.queries
+    assert [c.closed for c in fake_server.connections] == [True]
+
+
+def test_mysql_native_dumper_time_zone(fake_server):
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', workers=2, split_rows=4)
+    dump = b''.join(dumper.chunks()).decode()
+
+    # the TIMESTAMP values are read and loaded in UTC, whatever the time zone of the servers
+    assert fake_server.queries.count("SET SESSION time_zone = '+00:00'") == 2
+    assert fake_server.queries.index("SET SESSION time_zone = '+00:00'") < fake_server.queries.index(
+        'START TRANSACTION WITH CONSISTENT SNAPSHOT')
+    assert "/*!40103 SET TIME_ZONE='+00:00' */;\n" in dump
+    assert dump.index("SET TIME_ZONE='+00:00'") < dump.index('INSERT INTO')
+    assert dump.endswith('/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;\nSET SQL_MODE=@OLD_SQL_MODE;\n'
+                         'SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;\nSET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;\n'
+                         '-- Dump completed\n')
+
+
+def test_mysql_native_dumper_split_tables(fake_server):
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', workers=2, split_rows=4)
+    dump = b''.join(dumper.chunks()).decode()
+
+    assert fake_server.queries[0] == 'FLUSH TABLES WITH READ LOCK'
+    assert fake_server.queries.index('UNLOCK TABLES') > fake_server.queries.index(
+        'START TRANSACTION WITH CONSISTENT SNAPSHOT')
+    assert 'SELECT `id`,`name` FROM `db`.`big` WHERE `id` >= 1 AND `id` <= 3' in fake_server.queries
+    assert 'SELECT `id`,`name` FROM `db`.`big` WHERE `id` >= 7 AND `id` <= 10' in fake_server.queries
+    assert 'SELECT `id`,`name` FROM `db`.`small`' in fake_server.queries
+    inserted = re.findall(r"\((\d+),'n\d+'\)", dump)
+    assert sorted(int(i) for i in inserted) == list(range(1, 11))
+    assert dump.index('CREATE TABLE `small`') < dump.index('INSERT INTO')
+    assert len(fake_server.connections) == 3
+    assert all(c.closed for c in fake_server.connections)
+
+
+def test_mysql_native_dumper_tables(fake_server):
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', tables=['small'])
+    dump = b''.join(dumper.chunks()).decode()
+    assert '`big`' not in dump
+
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', tables=['unknown'])
+    with pytest.raises(native.DbDustNativeException) as excinfo:
+        b''.join(dumper.chunks())
+    assert 'mysql native : tables unknown not found in db' == str(excinfo.value)
+
+
+def test_mysql_native_dumper_worker_error(fake_server):
+    def fail(query, args):
+        if query.startswith('SELECT `id`'):
+            raise RuntimeError('lost connection')
+        return answer(query, args)
+    answer = fake_server.answer
+    fake_server.answer = fail
+    dumper = native.MySQLNativeDumper(fake_server.connect, 'db', workers=2)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        b''.join(dumper.chunks())
+    assert 'lost connection' == str(excinfo.value)
+    assert all(c.closed for c in fake_server.connections)
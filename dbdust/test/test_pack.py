@@ -0,0 +1,77 @@
+import io
+
+import pytest
+
+from dbdust import pack
+
+
+@pytest.fixture
+def pack_file(tmpdir):
+    writer = pack.PackWriter(str(tmpdir.join('backup.pack')))
+    for name, content in [('db1.sql', b'dump of db1'), ('db2.sql', b'')]:
+        member_file = tmpdir.join(name)
+        member_file.write_binary(content)
+        writer.add(name, str(member_file), database=name[:3])
+    writer.close()
+    return tmpdir.join('backup.pack')
+
+
+def test_pack_writer(pack_file):
+    with open(str(pack_file), 'rb') as fileobj:
+        members = pack.read_index(pack.file_range_reader(fileobj))
+
+    assert [(m['name'], m['offset'], m['size'], m['database']) for m in members] == [
+        ('db1.sql', 0, 11, 'db1'), ('db2.sql', 11, 0, 'db2')]
+    assert pack_file.read_binary().startswith(b'dump of db1{"members"')
+
+
+def test_pack_writer_abort(tmpdir):
+    writer = pack.PackWriter(str(tmpdir.join('backup.pack')))
+    writer.abort()
+    assert tmpdir.listdir() == []
+
+
+def test_read_index_not_a_pack():
+    fileobj = io.BytesIO(b'x' * 100)
+    with pytest.raises(pack.DbDustPackException) as excinfo:
+        pack.read_index(pack.file_range_reader(fileobj))
+    assert 'not a dbdust pack' == str(excinfo.value)
+    with pytest.raises(pack.DbDustPackException):
+        pack.read_index(lambda offset, size: b'short')
+
+
+def test_find_member():
+    assert pack.find_member([{'name': 'a'}, {'name': 'b'}], 'b') == {'name': 'b'}
+    with pytest.raises(pack.DbDustPackException) as excinfo:
+        pack.find_member([], 'c')
+    assert 'c not found in the pack' == str(excinfo.value)
+
+
+def test_member_reader():
+    fileobj = io.BytesIO(b'0123456789')
+    reader = pack.MemberReader(fileobj, 4)
+    assert reader.read(3) == b'012'
+    reader.drain()
+    assert reader.read() == b''
+    assert fileobj.read() == b'456789'
+
+    with pytest.raises(pack.DbDustPackException) as excinfo:
+        pack.MemberReader(io.BytesIO(b'01'), 4).drain()
+    assert 'pack truncated, 2 bytes of the member missing' == str(excinfo.value)
+
+
+def test_extract(pack_file, tmpdir):
+    output_dir = tmpdir.mkdir('out')
+    assert pack.extract(str(pack_file), str(output_dir), ['db1.sql']) == [str(output_dir.join('db1.sql'))]
+    assert output_dir.join('db1.sql').read_binary() == b'dump of db1'
+
+    pack.extract(str(pack_file), str(output_dir))
+    assert sorted(p.basename for p in output_dir.listdir()) == ['db1.sql', 'db2.sql']
+
+
+def test_extract_corrupted(pack_file, tmpdir):
+    content = pack_file.read_binary()
+    pack_file.write_binary(b'D' + content[1:])
+    with pytest.raises(pack.DbDustPackException) as excinfo:
+        pack.extract(str(pack_file), str(tmpdir.mkdir('out')))
+    assert 'db1.sql is corrupted' == str(excinfo.value)
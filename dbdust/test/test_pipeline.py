@@ -0,0 +1,249 @@
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import subprocess
+import threading
+
+import pytest
+import zstandard
+from unittest.mock import Mock
+
+from dbdust import pipeline
+
+
+def _run(dest, cmd, **kwargs):
+    dump_pipeline = pipeline.DumpPipeline(str(dest), **kwargs)
+    fifo_path = dump_pipeline.prepare()
+    process = subprocess.Popen(cmd.format(fifo_path), shell=True)
+    return dump_pipeline, dump_pipeline.run(process)
+
+
+def test_dump_pipeline_copy(tmpdir):
+    dest = tmpdir.join('dump.txt')
+    bucket = Mock()
+    dump_pipeline, returncode = _run(dest, 'printf "0123456789" > {}', bucket=bucket, chunk_size=4)
+
+    assert returncode == 0
+    assert dest.read() == '0123456789'
+    assert dump_pipeline.bytes_read == 10
+    assert sum(c[0][0] for c in bucket.consume.call_args_list) == 10
+    assert tmpdir.listdir() == [dest]
+
+
+def test_dump_pipeline_command_never_opens_pipe(tmpdir):
+    dest = tmpdir.join('dump.txt')
+    dump_pipeline, returncode = _run(dest, 'exit 3')
+
+    assert returncode == 3
+    assert dest.read() == ''
+
+
+def test_dump_pipeline_cleanup(tmpdir):
+    dest = io.BytesIO()
+    dump_pipeline = pipeline.DumpPipeline(str(tmpdir.join('dump.sql')), dest_file=dest)
+    fifo_path = dump_pipeline.prepare()
+    fds = (dump_pipeline._read_fd, dump_pipeline._keepalive_fd)
+
+    dump_pipeline.cleanup()
+
+    assert not os.path.exists(fifo_path)
+    for fd in fds:
+        with pytest.raises(OSError):
+            os.fstat(fd)
+    assert dest.closed
+
+
+def test_dump_pipeline_reader_error_kills_command(tmpdir):
+    dest = tmpdir.join('dump.txt')
+    bucket = Mock()
+    bucket.consume.side_effect = IOError('boom')
+    with pytest.raises(IOError):
+        _run(dest, 'yes > {}', bucket=bucket)
+    assert tmpdir.listdir() == [dest]
+
+
+@pytest.mark.parametrize("codec,decompress", [
+    ("gzip", gzip.decompress),
+    ("bzip2", bz2.decompress),
+    ("zstd", lambda data: zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()),
+])
+def test_compress_stage_fixed_level(codec, decompress):
+    stage = pipeline.CompressStage(codec, '1')
+    result = stage.process(b'a' * 1000) + stage.process(b'b' * 1000) + stage.flush()
+    assert decompress(result) == b'a' * 1000 + b'b' * 1000
+    assert stage.report() == {'codec': codec, 'compression_levels': {1: 2}}
+
+
+def test_compress_stage_default_level():
+    assert pipeline.CompressStage('gzip').level == 6
+    assert pipeline.CompressStage('bzip2').level == 9
+    assert pipeline.CompressStage('zstd').level == 3
+
+
+def test_compress_stage_unknown_codec():
+    with pytest.raises(pipeline.DbDustPipelineException) as excinfo:
+        pipeline.CompressStage('lz4')
+    assert 'pipeline : lz4 compression not supported' == str(excinfo.value)
+
+
+def test_compress_stage_adaptive():
+    stage = pipeline.CompressStage('gzip', 'adaptive', min_level='5', max_level='7')
+    assert stage.level == 6
+
+    stage.process(b'data')
+    stage.last_compress_time = 0.1
+    stage.feedback(1.0, 0.0)
+    assert stage.level == 7
+    stage.process(b'data')
+    stage.last_compress_time = 0.1
+    stage.feedback(0.0, 1.0)
+    assert stage.level == 7
+
+    stage.process(b'data')
+    stage.last_compress_time = 2.0
+    stage.feedback(1.0, 0.5)
+    assert stage.level == 6
+    assert stage.report() == {'codec': 'gzip', 'compression_levels': {6: 1, 7: 2}}
+
+
+@pytest.mark.parametrize("compress_time,read_time,write_time,level", [
+    (1.0, 2.5, 0.1, 4),
+    (1.0, 0.1, 3.0, 4),
+    (1.0, 0.5, 0.1, 2),
+    (1.0, 1.5, 0.1, 3),
+])
+def test_adaptive_level_update(compress_time, read_time, write_time, level):
+    adaptive = pipeline.AdaptiveLevel(3, 1, 9)
+    assert adaptive.update(compress_time, read_time, write_time) == level
+
+
+def test_adaptive_level_bounds():
+    adaptive = pipeline.AdaptiveLevel(1, 1, 2)
+    assert adaptive.update(5, 1, 1) == 1
+    assert adaptive.update(0, 1, 1) == 2
+    assert adaptive.update(0, 1, 1) == 2
+
+
+def test_dump_pipeline_with_stages(tmpdir):
+    dest = tmpdir.join('dump.sql.gz')
+    dump_pipeline, returncode = _run(dest, 'printf "0123456789" > {}', chunk_size=4,
+                                     stages=[pipeline.CompressStage('gzip', 'adaptive')])
+
+    assert returncode == 0
+    assert gzip.decompress(dest.read_binary()) == b'0123456789'
+    report = dump_pipeline.report()
+    assert report['bytes_read'] == 10
+    assert report['bytes_written'] == len(dest.read_binary())
+    assert report['codec'] == 'gzip'
+    assert sum(report['compression_levels'].values()) == 3
+
+
+def test_checksum_stage():
+    stage = pipeline.ChecksumStage()
+    assert stage.process(b'0123') == b'0123'
+    assert stage.process(b'456') == b'456'
+    assert stage.report() == {'sha256': hashlib.sha256(b'0123456').hexdigest()}
+
+
+def test_buffer_pool_reuses_buffers():
+    pool = pipeline.BufferPool(4, 2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert len(first) == len(second) == 4
+    assert first is not second
+
+    pool.release(first)
+    assert pool.acquire() is first
+    with pytest.raises(ValueError):
+        pipeline.BufferPool(4, 0)
+
+
+def test_buffer_pool_waits_for_release():
+    pool = pipeline.BufferPool(4, 1)
+    buffer = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, (buffer,))
+    timer.start()
+    assert pool.acquire() is buffer
+    timer.join()
+
+
+def test_get_shared_pool():
+    pool = pipeline.get_shared_pool(12345, 3)
+    assert pipeline.get_shared_pool(12345) is pool
+    assert pool.count == 3
+    assert pipeline.get_shared_pool(12346).count == pipeline.DEFAULT_POOL_BUFFERS
+
+
+def test_readinto_full():
+    reader = Mock()
+    reader.readinto.side_effect = [2, 1, 0]
+    assert pipeline.readinto_full(reader, memoryview(bytearray(4))) == 3
+
+
+def test_dump_pipeline_stages_get_pooled_views(tmpdir):
+    dest = tmpdir.join('dump.txt')
+    pool = pipeline.BufferPool(4, 1)
+    stage = pipeline.ChecksumStage()
+    chunks = []
+
+    def process(chunk):
+        chunks.append(type(chunk))
+        return stage.process(chunk)
+
+    stage_mock = Mock(process=process, flush=stage.flush, report=stage.report, feedback=stage.feedback)
+    dump_pipeline, returncode = _run(dest, 'printf "0123456789" > {}', chunk_size=8, pool=pool,
+                                     stages=[stage_mock])
+
+    assert returncode == 0
+    assert dest.read() == '0123456789'
+    assert chunks == [memoryview] * 3
+    assert dump_pipeline.report()['sha256'] == hashlib.sha256(b'0123456789').hexdigest()
+    assert len(pool.buffers) == 1
+
+
+def test_dump_pipeline_consume(tmpdir):
+    dest = tmpdir.join('dump.sql.gz')
+    pool = pipeline.BufferPool(4, 1)
+    dump_pipeline = pipeline.DumpPipeline(str(dest), chunk_size=4, pool=pool,
+                                          stages=[pipeline.CompressStage('gzip', 1)])
+    dump_pipeline.consume([b'01', b'23456', b'', b'789'])
+
+    assert gzip.decompress(dest.read_binary()) == b'0123456789'
+    report = dump_pipeline.report()
+    assert report['bytes_read'] == 10
+    assert report['compression_levels'] == {1: 3}
+    assert len(pool.buffers) == 1
+
+
+def test_dump_pipeline_closes_stages(tmpdir):
+    stage = Mock(wraps=pipeline.Stage())
+    bucket = Mock()
+    bucket.consume.side_effect = IOError('boom')
+    with pytest.raises(IOError):
+        _run(tmpdir.join('dump.txt'), 'yes > {}', bucket=bucket, stages=[stage])
+    assert stage.close.call_count == 1
+
+    stage.reset_mock()
+    pipeline.DumpPipeline(str(tmpdir.join('dump2.txt')), stages=[stage]).consume([b'012'])
+    assert stage.close.call_count == 1
+
+
+def test_dump_pipeline_consume_releases_buffer_between_chunks(tmpdir):
+    pool = pipeline.BufferPool(4, 1)
+    second = threading.Thread(target=lambda: pipeline.DumpPipeline(
+        str(tmpdir.join('second.txt')), chunk_size=4, pool=pool).consume([b'abcdef']))
+
+    def chunks():
+        yield b'0123'
+        # the other dump gets the only buffer while this one waits for its next chunk
+        second.start()
+        second.join(5)
+        assert not second.is_alive()
+        yield b'45'
+    pipeline.DumpPipeline(str(tmpdir.join('first.txt')), chunk_size=4, pool=pool).consume(chunks())
+
+    assert tmpdir.join('first.txt').read() == '012345'
+    assert tmpdir.join('second.txt').read() == 'abcdef'
+    assert len(pool.buffers) == 1
@@ -0,0 +1,45 @@
+import logging
+
+import pytest
+
+from dbdust import replicas
+
+
+def test_parse_hosts():
+    assert replicas.parse_hosts('db2:3307, db3,') == [{'host': 'db2', 'port': '3307'}, {'host': 'db3'}]
+    assert replicas.parse_hosts(None) == []
+
+
+@pytest.fixture
+def replica_status():
+    servers = {
+        'primary': {'replica': False, 'lag': None, 'load': 1},
+        'busy': {'replica': True, 'lag': 0, 'load': 50},
+        'idle': {'replica': True, 'lag': 10, 'load': 2},
+        'late': {'replica': True, 'lag': 3600, 'load': 0},
+        'stopped': {'replica': True, 'lag': None, 'load': 0},
+    }
+
+    def status(host=None, port=None, username=None):
+        assert username == 'backup'
+        if host == 'down':
+            raise ConnectionError('connection refused')
+        return servers[host]
+    return status
+
+
+def test_select(replica_status):
+    candidates = replicas.parse_hosts('primary,busy,idle:3307,late,stopped,down')
+    selected = replicas.select(logging.getLogger(), candidates, replica_status,
+                               {'host': 'primary', 'port': '3306', 'username': 'backup'}, max_lag=60)
+    assert selected == [{'host': 'idle', 'port': '3307'}, {'host': 'busy'}]
+
+    assert replicas.select(logging.getLogger(), candidates, replica_status, {'username': 'backup'}, max_lag=0) == [
+        {'host': 'busy'}]
+
+
+def test_probe_errors(replica_status):
+    statuses = replicas.probe(logging.getLogger(), [{'host': 'down'}], replica_status, {'username': 'backup'})
+    assert statuses == [{'host': 'down', 'replica': False, 'lag': None, 'load': None,
+                         'error': 'connection refused'}]
+    assert replicas.eligible(statuses) == []
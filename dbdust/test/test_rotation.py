@@ -0,0 +1,85 @@
+import datetime
+import logging
+import os
+from unittest.mock import Mock
+
+import pytest
+from freezegun import freeze_time
+
+from dbdust import rotation, storage
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('backup-20120114.sql', 'backup-'),
+    ('backup-db2-20120114.sql', 'backup-db2-'),
+    ('backup-db3-20120114.sql', 'backup-'),
+    ('backup-db', 'backup-'),
+    ('archive-20120114.sql', 'archive-'),
+    ('zz-20120114.sql', None),
+    ('back', None),
+])
+def test_prefix_index_match(name, expected):
+    index = rotation.PrefixIndex(['backup-', 'backup-db2-', 'backup-db2-x-', 'archive-'])
+    assert index.match(name) == expected
+
+
+def test_prefix_index_split():
+    index = rotation.PrefixIndex(['a-', 'a-b-'])
+    groups = index.split([{'file_name': 'a-1'}, {'file_name': 'a-b-1'}, {'file_name': 'c-1'}])
+    assert groups == {'a-': [{'file_name': 'a-1'}], 'a-b-': [{'file_name': 'a-b-1'}]}
+
+
+def _write(folder, names):
+    for name in names:
+        folder.join(name).write(name)
+
+
+@freeze_time("2012-01-14")
+def test_rotation_coordinator_single_listing(tmpdir):
+    _write(tmpdir, ['backup-20120114000000.sql', 'backup-20120113000000.sql', 'backup-20120101000000.sql',
+                    'backup-db2-20120114.sql', 'backup-db2-20120113.sql', 'backup-db2-20120112.sql',
+                    'notes.txt'])
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir))
+    local_storage.list = Mock(wraps=local_storage.list)
+    local_storage.delete = Mock(wraps=local_storage.delete)
+    handlers = [storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 2, 0, 0, 1),
+                storage.StorageHandler(local_storage, 'backup-db2-', "%Y%m%d", 1, 0, 0, 1),
+                storage.StorageHandler(local_storage, 'backup-db2-', "%Y%m%d", 1, 0, 0, 1)]
+
+    coordinator = rotation.RotationCoordinator(logging.getLogger(), handlers)
+    assert coordinator.run() == 3
+
+    assert local_storage.list.call_count == 1
+    assert sorted(os.listdir(str(tmpdir))) == ['backup-20120113000000.sql', 'backup-20120114000000.sql',
+                                               'backup-db2-20120114.sql', 'notes.txt']
+
+
+@freeze_time("2012-01-14")
+def test_rotation_coordinator_bulk_delete():
+    storage_impl = Mock(supports_bulk_delete=True, supports_demote=False, supports_partitions=False)
+    storage_impl.list.return_value = [{'id': name, 'file_name': name} for name in (
+        'a-20120114.sql', 'a-20120101.sql', 'a-b-20120114.sql', 'a-b-20120102.sql', 'a-b-20120103.sql')]
+    handlers = [storage.StorageHandler(storage_impl, prefix, "%Y%m%d", 1, 0, 0, 1) for prefix in ('a-', 'a-b-')]
+
+    assert rotation.RotationCoordinator(logging.getLogger(), handlers).run() == 3
+
+    storage_impl.list.assert_called_once_with()
+    storage_impl.delete_many.assert_called_once_with(['a-20120101.sql', 'a-b-20120103.sql', 'a-b-20120102.sql'])
+
+
+def test_rotation_coordinator_partitions(tmpdir):
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir), layout='date')
+    handlers = [storage.StorageHandler(local_storage, prefix, "%Y%m%d", 1, 0, 0, 1) for prefix in ('a-', 'b-')]
+    _write(tmpdir, ['a-20120114.sql', 'a-20120101.sql', 'b-20120102.sql', 'b-20120114.sql'])
+    local_storage.list_days = Mock(wraps=local_storage.list_days)
+
+    with freeze_time("2012-01-14"):
+        handlers[0].days_to_keep = handlers[0]._build_day_to_keep(1, 0, 0)
+        handlers[1].days_to_keep = handlers[1]._build_day_to_keep(1, 0, 0)
+        rotation.RotationCoordinator(logging.getLogger(), handlers).run()
+
+    # each job lists its own partitions
+    assert [args for args, _ in local_storage.list_days.call_args_list] == [('a-',), ('b-',)]
+    assert sorted(item['id'] for item in local_storage.list()) == ['a-/2012/01/14/a-20120114.sql',
+                                                                   'b-/2012/01/14/b-20120114.sql']
+    assert local_storage.list_days('a-') == [datetime.date(2012, 1, 14)]
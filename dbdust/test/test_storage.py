@@ -1,12 +1,14 @@
 import datetime
+import io
+import json
 import logging
 import os
-from unittest.mock import Mock
+from unittest.mock import Mock, call
 
 import pytest
 from freezegun import freeze_time
 
-from dbdust import storage
+from dbdust import cacheio, journal, pack, storage
 
 
 @freeze_time("2012-01-14")
@@ -84,6 +86,13 @@ def test_storage_handler_get_sorted_backup_files_list():
                       {'date': datetime.datetime(2018, 4, 16, 9, 56, 43), 'file_name': 'backup_20180416095643.sql'}]
 
 
+def test_storage_handler_backups_of_foreign_prefix():
+    handler = storage.StorageHandler(None, 'backup_', "%Y%m%d", 1, 1, 1, None)
+    # files of the job `backup_db2_` start with the prefix of the job
+    result = handler.backups_of([{'file_name': 'backup_db2_20190506.gz'}, {'file_name': 'backup_20190506.gz'}])
+    assert result == [{'date': datetime.datetime(2019, 5, 6), 'file_name': 'backup_20190506.gz'}]
+
+
 def test_storage_handler_save():
     mock_storage_impl = Mock()
     handler = storage.StorageHandler(mock_storage_impl, 'backup_', "%Y%m%d%H%M%S", 1, 1, 1, None)
@@ -161,3 +170,647 @@ def test_local_storage_delete(tmpdir):
     local_storage = storage.LocalStorage(logging.getLogger(), str(local_path))
     local_storage.delete('myfile1.txt')
     assert len(local_path.listdir()) == 0
+
+
+def test_local_storage_store_throttled(tmpdir):
+    local_path = tmpdir.mkdir("dbdust_localpath")
+    src_path = tmpdir.mkdir("dbdust_srcpath")
+    file_path = src_path.join('myfile.txt')
+    file_path.write('content')
+
+    local_storage = storage.LocalStorage(logging.getLogger(), str(local_path))
+    local_storage.bucket = Mock()
+    local_storage.store(str(file_path))
+
+    assert local_path.listdir() == [local_path.join('myfile.txt')]
+    assert local_path.join('myfile.txt').read() == 'content'
+    assert len(src_path.listdir()) == 0
+    local_storage.bucket.consume.assert_called_once_with(7)
+
+
+def test_storage_handler_save_with_journal():
+    mock_storage_impl = Mock()
+    upload_journal = Mock()
+    handler = storage.StorageHandler(mock_storage_impl, 'backup_', "%Y%m%d%H%M%S", 1, 1, 1, None)
+    handler.save('mypath', upload_journal)
+
+    mock_storage_impl.store.assert_called_once_with('mypath', journal=upload_journal)
+
+
+@pytest.fixture
+def azure_storage(monkeypatch):
+    monkeypatch.setattr(storage, 'BlockBlobService', Mock())
+    return storage.AzureBlocStorage(logging.getLogger(), 'account', 'container', account_key='key', block_size='4')
+
+
+def test_azure_storage_store_blocks(azure_storage, tmpdir):
+    file_path = tmpdir.join('backup-1.sql')
+    file_path.write('0123456789')
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+
+    azure_storage.store(str(file_path), journal=upload_journal)
+
+    # the blocks are sent concurrently, in any order
+    blocks = sorted((c[0][3], c[0][2]) for c in azure_storage.service.put_block.call_args_list)
+    assert [data for _, data in blocks] == [b'0123', b'4567', b'89']
+    block_ids = [block_id for block_id, _ in blocks]
+    assert len(set(block_ids)) == 3
+    assert upload_journal.state['upload'] == {'block_size': 4, 'blocks': dict(zip(['0', '1', '2'], block_ids))}
+    put_block_list_args = azure_storage.service.put_block_list.call_args[0]
+    assert put_block_list_args[:2] == ('container', 'backup-1.sql')
+    assert [block.id for block in put_block_list_args[2]] == block_ids
+
+
+def test_azure_storage_store_blocks_resume(azure_storage, tmpdir):
+    file_path = tmpdir.join('backup-1.sql')
+    file_path.write('0123456789')
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql',
+                                                  upload={'block_size': 4, 'blocks': {'1': 'MDAwMDAwMDE='}})
+
+    azure_storage.store(str(file_path), journal=upload_journal)
+
+    assert sorted(c[0][2] for c in azure_storage.service.put_block.call_args_list) == [b'0123', b'89']
+    assert len(upload_journal.state['upload']['blocks']) == 3
+    assert upload_journal.state['upload']['blocks']['1'] == 'MDAwMDAwMDE='
+    assert [block.id for block in azure_storage.service.put_block_list.call_args[0][2]] == [
+        'MDAwMDAwMDA=', 'MDAwMDAwMDE=', 'MDAwMDAwMDI=']
+
+
+def test_azure_storage_store_blocks_other_size(azure_storage, tmpdir):
+    file_path = tmpdir.join('backup-1.sql')
+    file_path.write('0123456789')
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql',
+                                                  upload={'blocks': ['MDAwMDAwMDA='], 'offset': 8})
+
+    azure_storage.store(str(file_path), journal=upload_journal)
+
+    # blocks recorded with another block size (or without it) are sent again
+    assert sorted(c[0][2] for c in azure_storage.service.put_block.call_args_list) == [b'0123', b'4567', b'89']
+    assert len(upload_journal.state['upload']['blocks']) == 3
+
+
+def test_azure_storage_store_blocks_error(azure_storage, tmpdir):
+    file_path = tmpdir.join('backup-1.sql')
+    file_path.write('0123456789')
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+
+    def put_block(container, name, data, block_id):
+        if data == b'4567':
+            raise Exception('network error')
+    azure_storage.service.put_block.side_effect = put_block
+
+    with pytest.raises(Exception):
+        azure_storage.store(str(file_path), journal=upload_journal)
+
+    # the blocks sent by the other workers are recorded
+    saved = journal.UploadJournal.load(upload_journal.path)
+    assert sorted(saved.state['upload']['blocks']) == ['0', '2']
+    azure_storage.service.put_block_list.assert_not_called()
+
+
+def test_local_storage_store_throttled_resume(tmpdir):
+    local_path = tmpdir.mkdir("dbdust_localpath")
+    local_path.join('myfile.txt.partial').write('cont')
+    src_path = tmpdir.mkdir("dbdust_srcpath")
+    file_path = src_path.join('myfile.txt')
+    file_path.write('content')
+
+    local_storage = storage.LocalStorage(logging.getLogger(), str(local_path))
+    local_storage.bucket = Mock()
+    local_storage.store(str(file_path), journal=Mock())
+
+    assert local_path.listdir() == [local_path.join('myfile.txt')]
+    assert local_path.join('myfile.txt').read() == 'content'
+    local_storage.bucket.consume.assert_called_once_with(3)
+
+
+def test_local_storage_store_stream(tmpdir):
+    local_path = tmpdir.mkdir("dbdust_localpath")
+    local_storage = storage.LocalStorage(logging.getLogger(), str(local_path))
+    assert local_storage.supports_stream is True
+
+    local_storage.store_stream(io.BytesIO(b'content'), 'myfile.txt')
+
+    assert local_path.listdir() == [local_path.join('myfile.txt')]
+    assert local_path.join('myfile.txt').read() == 'content'
+
+
+def test_local_storage_free_space(tmpdir):
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir))
+    assert local_storage.free_space() > 0
+
+
+def test_azure_storage_store_stream(azure_storage):
+    assert azure_storage.supports_stream is True
+    assert azure_storage.free_space() is None
+    stream = io.BytesIO(b'content')
+    azure_storage.store_stream(stream, 'myfile.txt')
+    azure_storage.service.create_blob_from_stream.assert_called_once_with('container', 'myfile.txt', stream,
+                                                                          max_connections=1)
+
+
+def test_azure_blob_reader():
+    content = b'0123456789'
+    service = Mock()
+    service.get_blob_properties.return_value.properties.content_length = len(content)
+    service.get_blob_to_bytes.side_effect = lambda container, name, start_range, end_range: Mock(
+        content=content[start_range:end_range + 1])
+
+    reader = io.BufferedReader(storage.AzureBlobReader(service, 'container', 'myfile.txt'), buffer_size=4)
+
+    assert reader.read(4) == b'0123'
+    assert reader.read(4) == b'4567'
+    assert reader.read(4) == b'89'
+    assert reader.read(4) == b''
+    ranges = [(c[1]['start_range'], c[1]['end_range']) for c in service.get_blob_to_bytes.call_args_list]
+    assert ranges == [(0, 3), (4, 7), (8, 9)]
+
+
+def test_local_storage_open_stream(tmpdir):
+    tmpdir.join('myfile.txt').write('content')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir))
+    with local_storage.open_stream('myfile.txt') as stream:
+        assert stream.read() == b'content'
+
+
+def test_storage_handler_rotate_bulk_delete(monkeypatch):
+    mock_storage_impl = Mock()
+    mock_storage_impl.supports_bulk_delete = True
+    handler = storage.StorageHandler(mock_storage_impl, 'backup_', "%Y%m%d%H%M%S", 1, 1, 1, 1)
+    monkeypatch.setattr(handler, '_get_sorted_backup_files_list', Mock(return_value=[
+        {'id': 10, 'date': datetime.datetime(2012, 1, 14, 18, 9, 52)},
+        {'id': 20, 'date': datetime.datetime(2012, 1, 14, 11, 42, 34)},
+        {'id': 30, 'date': datetime.datetime(2011, 1, 14, 11, 42, 34)}]))
+
+    with freeze_time("2012-01-14"):
+        handler.days_to_keep = handler._build_day_to_keep(1, 1, 1)
+        handler.rotate()
+
+    mock_storage_impl.delete_many.assert_called_once_with([20, 30])
+    assert mock_storage_impl.delete.call_count == 0
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    import moto.s3.models
+    monkeypatch.setattr(moto.s3.models, 'S3_UPLOAD_PART_MIN_SIZE', 4)
+    with moto.mock_aws():
+        import boto3
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='dbdust')
+        yield storage.S3Storage(logging.getLogger(), 'dbdust', prefix='backups/', part_size='4', parallelism='2')
+
+
+def test_s3_storage__init__bucket_does_not_exists(s3_storage):
+    with pytest.raises(storage.DbDustStorageException) as excinfo:
+        storage.S3Storage(logging.getLogger(), 'unknown')
+    assert 's3 storage : unknown bucket does not exist' == str(excinfo.value)
+
+
+def _s3_content(s3_storage, key):
+    return s3_storage.client.get_object(Bucket='dbdust', Key=key)['Body'].read()
+
+
+def test_s3_storage_store(s3_storage, tmpdir):
+    small_file = tmpdir.join('backup-1.sql')
+    small_file.write('0123')
+    big_file = tmpdir.join('backup-2.sql')
+    big_file.write('0123456789')
+
+    s3_storage.store(str(small_file))
+    s3_storage.store(str(big_file))
+
+    assert _s3_content(s3_storage, 'backups/backup-1.sql') == b'0123'
+    assert _s3_content(s3_storage, 'backups/backup-2.sql') == b'0123456789'
+    assert sorted(s3_storage.list(), key=lambda i: i['id']) == [
+        {'id': 'backups/backup-1.sql', 'file_name': 'backup-1.sql'},
+        {'id': 'backups/backup-2.sql', 'file_name': 'backup-2.sql'}]
+
+
+def test_s3_storage_store_resume(s3_storage, tmpdir):
+    big_file = tmpdir.join('backup-1.sql')
+    big_file.write('0123456789')
+    upload_journal = journal.UploadJournal.create(str(tmpdir), 'backup-1.sql')
+    s3_storage.client.upload_part = Mock(side_effect=[{'ETag': 'a'}, Exception('network error'),
+                                                      Exception('network error')])
+    s3_storage.parallelism = 1
+
+    with pytest.raises(Exception):
+        s3_storage.store(str(big_file), journal=upload_journal)
+    assert upload_journal.state['upload']['parts'] == {'1': 'a'}
+
+    del s3_storage.client.upload_part
+    upload_journal.state['upload']['parts'] = {}
+    s3_storage.store(str(big_file), journal=upload_journal)
+    assert sorted(upload_journal.state['upload']['parts']) == ['1', '2', '3']
+    assert _s3_content(s3_storage, 'backups/backup-1.sql') == b'0123456789'
+
+
+def test_s3_storage_store_stream(s3_storage):
+    s3_storage.store_stream(io.BytesIO(b'012'), 'backup-1.sql')
+    s3_storage.store_stream(io.BytesIO(b'0123456789'), 'backup-2.sql')
+    s3_storage.store_stream(io.BytesIO(b''), 'backup-3.sql')
+
+    assert _s3_content(s3_storage, 'backups/backup-1.sql') == b'012'
+    assert _s3_content(s3_storage, 'backups/backup-2.sql') == b'0123456789'
+    assert _s3_content(s3_storage, 'backups/backup-3.sql') == b''
+    with s3_storage.open_stream('backups/backup-2.sql') as stream:
+        assert stream.read() == b'0123456789'
+
+
+def test_s3_storage_store_stream_part_error(s3_storage, monkeypatch):
+    upload_part = Mock(side_effect=Exception('access denied'))
+    monkeypatch.setattr(s3_storage.client, 'upload_part', upload_part)
+    abort = Mock(wraps=s3_storage.client.abort_multipart_upload)
+    monkeypatch.setattr(s3_storage.client, 'abort_multipart_upload', abort)
+    stream = io.BytesIO(b'0123' * 100)
+
+    with pytest.raises(Exception) as excinfo:
+        s3_storage.store_stream(stream, 'backup-1.sql')
+
+    assert 'access denied' == str(excinfo.value)
+    # the upload stops at the first failed part (with 2 parts at a time), the rest of the stream is not read
+    assert upload_part.call_count in (1, 2)
+    assert stream.tell() <= 4 * 4
+    assert abort.call_count == 1
+
+
+def test_s3_storage_list_and_delete_many(s3_storage, monkeypatch):
+    for i in range(5):
+        s3_storage.client.put_object(Bucket='dbdust', Key='backups/backup-{}.sql'.format(i), Body=b'')
+    s3_storage.client.put_object(Bucket='dbdust', Key='other/backup-9.sql', Body=b'')
+
+    assert len(s3_storage.list()) == 5
+
+    monkeypatch.setattr(s3_storage, 'DELETE_BATCH_SIZE', 2)
+    monkeypatch.setattr(s3_storage.client, 'delete_objects', Mock(wraps=s3_storage.client.delete_objects))
+    s3_storage.delete_many(['backups/backup-{}.sql'.format(i) for i in range(4)])
+    assert s3_storage.client.delete_objects.call_count == 2
+    s3_storage.delete('backups/backup-4.sql')
+    assert s3_storage.list() == []
+
+
+def test_storage_handler_rotate_demote(monkeypatch):
+    mock_storage_impl = Mock()
+    mock_storage_impl.supports_bulk_delete = False
+    mock_storage_impl.supports_demote = True
+    handler = storage.StorageHandler(mock_storage_impl, 'backup_', "%Y%m%d%H%M%S", 2, 2, 1, 1)
+    monkeypatch.setattr(handler, '_get_sorted_backup_files_list', Mock(return_value=[
+        {'id': 10, 'date': datetime.datetime(2012, 1, 14, 18, 9, 52)},
+        {'id': 20, 'date': datetime.datetime(2012, 1, 9, 11, 42, 34)},
+        {'id': 30, 'date': datetime.datetime(2012, 1, 2, 11, 42, 34), 'cold': True},
+        {'id': 40, 'date': datetime.datetime(2012, 1, 1, 11, 42, 34)},
+        {'id': 50, 'date': datetime.datetime(2011, 12, 1, 11, 42, 34)}]))
+
+    with freeze_time("2012-01-14"):
+        handler.days_to_keep = handler._build_day_to_keep(2, 2, 1)
+        handler.hot_days = handler._build_day_to_keep(2, 0, 0)
+        handler.rotate()
+
+    mock_storage_impl.delete.assert_called_once_with(50)
+    assert mock_storage_impl.demote.call_args_list == [call(20), call(40)]
+
+
+def test_local_storage_demote(tmpdir):
+    hot_dir = tmpdir.mkdir('hot')
+    cold_dir = tmpdir.mkdir('cold')
+    hot_dir.join('backup-1.sql').write('012')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(hot_dir), cold_path=str(cold_dir))
+    assert local_storage.supports_demote is True
+
+    local_storage.demote('backup-1.sql')
+
+    assert hot_dir.listdir() == []
+    assert cold_dir.join('backup-1.sql').read() == '012'
+    cold_id = str(cold_dir.join('backup-1.sql'))
+    assert local_storage.list() == [{'id': cold_id, 'file_name': 'backup-1.sql', 'cold': True, 'path': cold_id}]
+    with local_storage.open_stream(cold_id) as stream:
+        assert stream.read() == b'012'
+    local_storage.delete(cold_id)
+    assert cold_dir.listdir() == []
+
+
+def test_local_storage__init__cold_folder_does_not_exists(tmpdir):
+    with pytest.raises(storage.DbDustStorageException) as excinfo:
+        storage.LocalStorage(logging.getLogger(), str(tmpdir), cold_path='/not/exists')
+    assert 'local storage : /not/exists folder does not exist' == str(excinfo.value)
+
+
+def test_azure_storage_demote(monkeypatch):
+    monkeypatch.setattr(storage, 'BlockBlobService', Mock())
+    with pytest.raises(storage.DbDustStorageException):
+        storage.AzureBlocStorage(logging.getLogger(), 'account', 'container', account_key='key', cold_tier='hot')
+    azure_storage = storage.AzureBlocStorage(logging.getLogger(), 'account', 'container', account_key='key',
+                                             cold_tier='archive')
+    blobs = [Mock(properties=Mock(blob_tier='Hot')), Mock(properties=Mock(blob_tier='Archive'))]
+    blobs[0].name = 'backup-1.sql'
+    blobs[1].name = 'backup-2.sql'
+    azure_storage.service.list_blobs.return_value = blobs
+
+    assert azure_storage.list() == [{'id': 'backup-1.sql', 'file_name': 'backup-1.sql'},
+                                    {'id': 'backup-2.sql', 'file_name': 'backup-2.sql', 'cold': True}]
+    azure_storage.demote('backup-1.sql')
+    azure_storage.service.set_standard_blob_tier.assert_called_once_with('container', 'backup-1.sql', 'Archive')
+
+
+def test_s3_storage_demote(s3_storage):
+    s3_storage.cold_storage_class = 'GLACIER'
+    s3_storage.client.put_object(Bucket='dbdust', Key='backups/backup-1.sql', Body=b'012')
+
+    s3_storage.demote('backups/backup-1.sql')
+
+    assert s3_storage.client.head_object(Bucket='dbdust', Key='backups/backup-1.sql')['StorageClass'] == 'GLACIER'
+    assert s3_storage.list() == [{'id': 'backups/backup-1.sql', 'file_name': 'backup-1.sql', 'cold': True}]
+
+
+def test_split_writer(tmpdir):
+    store_dir = tmpdir.mkdir('storage')
+    tmp_dir = tmpdir.mkdir('tmp')
+    handler = storage.StorageHandler(storage.LocalStorage(logging.getLogger(), str(store_dir)),
+                                     'backup-', '%Y%m%d%H%M%S', 1, 1, 1, 1)
+
+    with handler.split_writer(str(tmp_dir.join('backup-20190506110952.sql')), 4, 2) as writer:
+        writer.write(b'012')
+        writer.write(b'3456789')
+    manifest = writer.commit()
+
+    assert tmp_dir.listdir() == []
+    assert sorted(os.listdir(str(store_dir))) == ['backup-20190506110952.sql.manifest',
+                                                  'backup-20190506110952.sql.part0000',
+                                                  'backup-20190506110952.sql.part0001',
+                                                  'backup-20190506110952.sql.part0002']
+    assert manifest['size'] == 10
+    assert [part['size'] for part in manifest['parts']] == [4, 4, 2]
+
+    items = handler._get_sorted_backup_files_list()
+    assert len(items) == 1
+    assert items[0]['file_name'] == 'backup-20190506110952.sql'
+    assert items[0]['id'] == 'backup-20190506110952.sql.manifest'
+    assert items[0]['parts'] == ['backup-20190506110952.sql.part{:04d}'.format(i) for i in range(3)]
+    with handler.open_stream(items[0]) as stream:
+        assert stream.read() == b'0123456789'
+
+
+def test_split_writer_abort(tmpdir):
+    store_dir = tmpdir.mkdir('storage')
+    store_dir.join('backup-20190506110952.sql').write('other backup')
+    handler = storage.StorageHandler(storage.LocalStorage(logging.getLogger(), str(store_dir)),
+                                     'backup-', '%Y%m%d%H%M%S', 1, 1, 1, 1)
+
+    writer = handler.split_writer(str(tmpdir.join('backup-20190506110952.sql')), 4)
+    writer.write(b'0123456789')
+    writer.abort()
+
+    assert os.listdir(str(store_dir)) == ['backup-20190506110952.sql']
+
+
+def test_split_writer_upload_error(tmpdir):
+    handler = Mock()
+    handler.save.side_effect = Exception('upload error')
+    writer = storage.SplitWriter(handler, str(tmpdir.join('backup-1.sql')), 2, 1)
+
+    with pytest.raises(Exception) as excinfo:
+        for _ in range(10):
+            writer.write(b'01')
+    assert 'upload error' == str(excinfo.value)
+
+
+def test_storage_handler_split_backup_incomplete_and_rotate(monkeypatch):
+    mock_storage_impl = Mock()
+    mock_storage_impl.supports_bulk_delete = True
+    mock_storage_impl.list.return_value = [
+        {'id': 'a1', 'file_name': 'backup_20120114180952.sql.part0001'},
+        {'id': 'a0', 'file_name': 'backup_20120114180952.sql.part0000'},
+        {'id': 'b0', 'file_name': 'backup_20110114180952.sql.part0000'},
+        {'id': 'bm', 'file_name': 'backup_20110114180952.sql.manifest'}]
+    handler = storage.StorageHandler(mock_storage_impl, 'backup_', "%Y%m%d%H%M%S", 1, 1, 1, 1)
+
+    items = handler._get_sorted_backup_files_list()
+    assert items[0]['parts'] == ['a0', 'a1']
+    assert items[0]['manifest'] is None
+    with pytest.raises(storage.DbDustStorageException) as excinfo:
+        handler.open_stream(items[0])
+    assert 'backup_20120114180952.sql has no manifest, the upload is incomplete' == str(excinfo.value)
+
+    with freeze_time("2012-01-14"):
+        handler.days_to_keep = handler._build_day_to_keep(1, 1, 1)
+        handler.rotate()
+    mock_storage_impl.delete_many.assert_called_once_with(['b0', 'bm'])
+
+
+def _store_table_backup(store_dir, file_name, parts):
+    manifest_parts = []
+    for part_name, content in parts:
+        if part_name.startswith(file_name):
+            store_dir.join(part_name).write(content)
+        manifest_parts.append({'file_name': part_name, 'size': len(content)})
+    store_dir.join('{}.manifest'.format(file_name)).write(json.dumps({'file_name': file_name,
+                                                                      'parts': manifest_parts, 'tables': True}))
+
+
+def test_storage_handler_shared_parts(tmpdir):
+    store_dir = tmpdir.mkdir('store')
+    handler = storage.StorageHandler(storage.LocalStorage(logging.getLogger(), str(store_dir)), 'backup-',
+                                     "%Y%m%d%H%M%S", 1, 0, 0, 1)
+    _store_table_backup(store_dir, 'backup-20120112000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120112000000.sql.part0001', 'b1')])
+    _store_table_backup(store_dir, 'backup-20120113000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120113000000.sql.part0001', 'b2')])
+    _store_table_backup(store_dir, 'backup-20120114000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120114000000.sql.part0001', 'b3')])
+
+    items = handler._get_sorted_backup_files_list()
+    with handler.open_stream(items[0]) as stream:
+        assert stream.read() == b'a1b3'
+
+    with freeze_time("2012-01-14"):
+        handler.days_to_keep = handler._build_day_to_keep(1, 0, 0)
+        handler.rotate()
+    # the first backup is kept as its first table is still used
+    assert sorted(os.listdir(str(store_dir))) == ['backup-20120112000000.sql.manifest',
+                                                  'backup-20120112000000.sql.part0000',
+                                                  'backup-20120112000000.sql.part0001',
+                                                  'backup-20120114000000.sql.manifest',
+                                                  'backup-20120114000000.sql.part0001']
+
+    store_dir.join('backup-20120112000000.sql.part0000').remove()
+    with pytest.raises(storage.DbDustStorageException) as excinfo:
+        handler.open_stream(handler._get_sorted_backup_files_list()[0])
+    assert 'needs backup-20120112000000.sql.part0000 which is not in the storage' in str(excinfo.value)
+
+
+def _store_pack(store_dir, file_name, members):
+    writer = pack.PackWriter(str(store_dir.join(file_name)))
+    for name, content in members:
+        member_file = store_dir.join(name)
+        member_file.write_binary(content)
+        writer.add(name, str(member_file))
+        member_file.remove()
+    writer.close()
+
+
+def test_local_storage_read_range(tmpdir):
+    tmpdir.join('myfile.txt').write('0123456789')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir))
+    assert local_storage.read_range('myfile.txt', 2, 3) == b'234'
+    assert local_storage.read_range('myfile.txt', -2, 2) == b'89'
+
+
+def test_s3_storage_read_range(s3_storage):
+    s3_storage.store_stream(io.BytesIO(b'0123456789'), 'backup-1.sql')
+    assert s3_storage.read_range('backups/backup-1.sql', 2, 3) == b'234'
+    assert s3_storage.read_range('backups/backup-1.sql', -2, 2) == b'89'
+
+
+def test_storage_handler_read_member(tmpdir):
+    _store_pack(tmpdir, 'backup-20120114000000.sql.pack', [('db1.sql', b'dump1'), ('db2.sql', b'dump2')])
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir))
+    handler = storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 1, 0, 0, 1)
+    item = handler._get_sorted_backup_files_list()[0]
+
+    assert [member['name'] for member in handler.read_pack_index(item)] == ['db1.sql', 'db2.sql']
+    assert handler.read_member(item, 'db2.sql') == b'dump2'
+
+    # a storage without range reads reads the whole pack
+    handler.storage_impl = Mock(wraps=local_storage, supports_range=False)
+    assert handler.read_member(item, 'db1.sql') == b'dump1'
+    assert handler.storage_impl.read_range.call_count == 0
+
+    content = tmpdir.join(item['file_name']).read_binary()
+    tmpdir.join(item['file_name']).write_binary(content[:5] + b'X' + content[6:])
+    with pytest.raises(pack.DbDustPackException) as excinfo:
+        handler.read_member(item, 'db2.sql')
+    assert 'db2.sql is corrupted' == str(excinfo.value)
+
+
+def test_local_storage_nocache(tmpdir, monkeypatch):
+    dropped = []
+    monkeypatch.setattr(cacheio, 'drop_cache', lambda fd, offset=0, size=0: dropped.append(size))
+    local_path = tmpdir.mkdir("dbdust_localpath")
+    local_path.join('myfile.txt.partial').write('cont')
+    file_path = tmpdir.mkdir("dbdust_srcpath").join('myfile.txt')
+    file_path.write('content')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(local_path))
+    local_storage.io_mode = 'nocache'
+    local_storage.bucket = Mock()
+
+    local_storage.store(str(file_path), journal=Mock())
+    local_storage.store_stream(io.BytesIO(b'streamed'), 'myfile2.txt')
+
+    assert local_path.join('myfile.txt').read() == 'content'
+    with local_storage.open_stream('myfile2.txt') as stream:
+        assert isinstance(stream, cacheio.NoCacheReader)
+        assert stream.read() == b'streamed'
+    # the range read and written by the resumed copy, the streamed file, the file read
+    assert dropped == [3, 3, 8, 8]
+
+
+def _tree(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), str(folder))
+                  for root, _, names in os.walk(str(folder)) for name in names)
+
+
+def test_local_storage_layout_error(tmpdir):
+    with pytest.raises(storage.DbDustStorageException) as excinfo:
+        storage.LocalStorage(logging.getLogger(), str(tmpdir), layout='tree')
+    assert 'local storage : layout must be one of flat, date' == str(excinfo.value)
+
+
+def test_local_storage_date_layout(tmpdir):
+    store_dir = tmpdir.mkdir('store')
+    src_dir = tmpdir.mkdir('src')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(store_dir), layout='date')
+    handler = storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 1, 0, 0, 1)
+    assert handler.partitioned is True
+    for name in ('backup-20120113000000.sql', 'backup-20120114000000.sql', 'notes.txt'):
+        src_dir.join(name).write(name)
+        handler.save(str(src_dir.join(name)))
+    handler.save_stream(io.BytesIO(b'streamed'), 'backup-20120114120000.sql')
+
+    assert _tree(store_dir) == ['backup-/2012/01/13/backup-20120113000000.sql',
+                                'backup-/2012/01/14/backup-20120114000000.sql',
+                                'backup-/2012/01/14/backup-20120114120000.sql', 'notes.txt']
+    assert local_storage.list_days('backup-') == [datetime.date(2012, 1, 13), datetime.date(2012, 1, 14)]
+    items = sorted(local_storage.list(days=[datetime.date(2012, 1, 13)]), key=lambda item: item['id'])
+    assert items == [{'id': 'backup-/2012/01/13/backup-20120113000000.sql', 'file_name': 'backup-20120113000000.sql',
+                      'path': str(store_dir.join('backup-/2012/01/13/backup-20120113000000.sql'))},
+                     {'id': 'notes.txt', 'file_name': 'notes.txt', 'path': str(store_dir.join('notes.txt'))}]
+    with local_storage.open_stream('backup-/2012/01/14/backup-20120114120000.sql') as stream:
+        assert stream.read() == b'streamed'
+
+    # the empty partition folders are removed
+    local_storage.delete('backup-/2012/01/13/backup-20120113000000.sql')
+    assert store_dir.join('backup-', '2012', '01').listdir() == [store_dir.join('backup-', '2012', '01', '14')]
+    local_storage.delete_day('backup-', datetime.date(2012, 1, 14))
+    assert store_dir.listdir() == [store_dir.join('notes.txt')]
+
+
+def test_local_storage_date_layout_migration_and_demote(tmpdir):
+    hot_dir = tmpdir.mkdir('hot')
+    cold_dir = tmpdir.mkdir('cold')
+    hot_dir.join('backup-20120101000000.sql').write('old')
+    hot_dir.join('backup-20120114000000.sql.partial').write('partial')
+    hot_dir.join('other-20120114000000.sql').write('other job')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(hot_dir), cold_path=str(cold_dir), layout='date')
+    storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 1, 0, 0, 1)
+
+    assert sorted(item['id'] for item in local_storage.list()) == [
+        'backup-/2012/01/01/backup-20120101000000.sql', 'backup-20120114000000.sql.partial', 'other-20120114000000.sql']
+    local_storage.demote('backup-/2012/01/01/backup-20120101000000.sql')
+
+    assert _tree(hot_dir) == ['backup-20120114000000.sql.partial', 'other-20120114000000.sql']
+    assert _tree(cold_dir) == ['backup-/2012/01/01/backup-20120101000000.sql']
+    cold_id = str(cold_dir.join('backup-/2012/01/01/backup-20120101000000.sql'))
+    assert [item for item in local_storage.list() if item.get('cold')] == [
+        {'id': cold_id, 'file_name': 'backup-20120101000000.sql', 'cold': True, 'path': cold_id}]
+    assert local_storage.list_days('backup-') == [datetime.date(2012, 1, 1)]
+    local_storage.delete(cold_id)
+    assert cold_dir.listdir() == []
+
+
+def test_storage_handler_rotate_partitions(tmpdir):
+    store_dir = tmpdir.mkdir('store')
+    local_storage = storage.LocalStorage(logging.getLogger(), str(store_dir), layout='date')
+    handler = storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 1, 0, 0, 1)
+    _store_table_backup(store_dir, 'backup-20120112000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120112000000.sql.part0001', 'b1')])
+    _store_table_backup(store_dir, 'backup-20120113000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120113000000.sql.part0001', 'b2')])
+    _store_table_backup(store_dir, 'backup-20120114000000.sql', [('backup-20120112000000.sql.part0000', 'a1'),
+                                                                 ('backup-20120114000000.sql.part0001', 'b3')])
+    store_dir.join('backup-20120113120000.sql').write('expired')
+    store_dir.join('backup-20120110000000.sql').write('expired')
+
+    with freeze_time("2012-01-14"):
+        handler.days_to_keep = handler._build_day_to_keep(1, 0, 0)
+        local_storage.list = Mock(wraps=local_storage.list)
+        handler.rotate()
+    # only the kept day and the day of the shared part are listed
+    assert local_storage.list.call_args_list == [call(days=[datetime.date(2012, 1, 14)], file_prefix='backup-'),
+                                                 call(days=None, file_prefix='backup-'),
+                                                 call(days=[datetime.date(2012, 1, 12)], file_prefix='backup-')]
+    assert _tree(store_dir) == ['backup-/2012/01/12/backup-20120112000000.sql.manifest',
+                                'backup-/2012/01/12/backup-20120112000000.sql.part0000',
+                                'backup-/2012/01/12/backup-20120112000000.sql.part0001',
+                                'backup-/2012/01/14/backup-20120114000000.sql.manifest',
+                                'backup-/2012/01/14/backup-20120114000000.sql.part0001']
+    with handler.open_stream(handler._get_sorted_backup_files_list()[0]) as stream:
+        assert stream.read() == b'a1b3'
+
+
+def test_local_storage_date_layout_shared(tmpdir):
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir), layout='date')
+    handler = storage.StorageHandler(local_storage, 'backup-', "%Y%m%d%H%M%S", 1, 0, 0, 1)
+    db2_handler = storage.StorageHandler(local_storage, 'backup-db2-', "%Y%m%d", 1, 0, 0, 1)
+    tmpdir.join('backup-20120114000000.sql').write('1')
+    tmpdir.join('backup-db2-20120113.sql').write('2')
+
+    assert sorted(item['id'] for item in local_storage.list()) == [
+        'backup-/2012/01/14/backup-20120114000000.sql', 'backup-db2-/2012/01/13/backup-db2-20120113.sql']
+    assert [item['file_name'] for item in handler._get_sorted_backup_files_list()] == ['backup-20120114000000.sql']
+    assert local_storage.list_days('backup-db2-') == [datetime.date(2012, 1, 13)]
+    local_storage.delete_day('backup-', datetime.date(2012, 1, 13))
+    assert [item['file_name'] for item in db2_handler._get_sorted_backup_files_list()] == ['backup-db2-20120113.sql']
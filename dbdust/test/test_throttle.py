@@ -0,0 +1,65 @@
+import io
+import os
+
+from unittest.mock import Mock
+
+from dbdust import throttle
+
+
+def test_token_bucket_no_wait_within_burst(monkeypatch):
+    sleep = Mock()
+    monkeypatch.setattr(throttle.time, 'sleep', sleep)
+    bucket = throttle.TokenBucket(100)
+    assert bucket.consume(60) == 0
+    assert bucket.consume(40) == 0
+    assert sleep.call_count == 0
+
+
+def test_token_bucket_wait_when_in_debt(monkeypatch):
+    sleep = Mock()
+    monkeypatch.setattr(throttle.time, 'sleep', sleep)
+    monkeypatch.setattr(throttle.time, 'monotonic', Mock(return_value=10.0))
+    bucket = throttle.TokenBucket(100)
+    bucket.consume(100)
+    assert bucket.consume(50) == 0.5
+    assert bucket.consume(50) == 1.0
+    assert sleep.call_args_list == [((0.5,),), ((1.0,),)]
+
+
+def test_get_shared_bucket(monkeypatch):
+    monkeypatch.setattr(throttle, '_shared_buckets', {})
+    assert throttle.get_shared_bucket('dump', None) is None
+    bucket = throttle.get_shared_bucket('dump', 100)
+    assert throttle.get_shared_bucket('dump', 200) is bucket
+    assert bucket.rate == 100
+    assert throttle.get_shared_bucket('upload:local', 200) is not bucket
+
+
+def test_throttled_reader():
+    bucket = Mock()
+    reader = throttle.ThrottledReader(io.BytesIO(b'0123456789'), bucket)
+    assert reader.read(4) == b'0123'
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 4
+    assert reader.read() == b'89'
+    assert reader.read() == b''
+    assert reader.tell() == 10
+    assert bucket.consume.call_args_list == [((4,),), ((4,),), ((2,),)]
+
+
+def test_priority_prefix():
+    assert throttle.priority_prefix() == []
+    assert throttle.priority_prefix('3') == ['ionice', '-c', '3']
+    assert throttle.priority_prefix('2', '7') == ['ionice', '-c', '2', '-n', '7']
+
+
+def test_priority_preexec_fn(tmpdir, monkeypatch):
+    assert throttle.priority_preexec_fn() is None
+
+    nice = Mock()
+    monkeypatch.setattr(throttle.os, 'nice', nice)
+    cgroup = tmpdir.mkdir('cgroup')
+    throttle.priority_preexec_fn('10', str(cgroup))()
+
+    nice.assert_called_once_with(10)
+    assert cgroup.join('cgroup.procs').read() == str(os.getpid())
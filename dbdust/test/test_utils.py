@@ -0,0 +1,26 @@
+import pytest
+
+from dbdust import utils
+
+
+@pytest.mark.parametrize(
+    "value,result",
+    [
+        (None, None),
+        ("", None),
+        ("1024", 1024),
+        ("512k", 512 * 1024),
+        ("10M", 10 * 1024 ** 2),
+        ("10MB", 10 * 1024 ** 2),
+        ("1.5G", int(1.5 * 1024 ** 3)),
+        ("2t", 2 * 1024 ** 4),
+    ]
+)
+def test_parse_size(value, result):
+    assert utils.parse_size(value) == result
+
+
+@pytest.mark.parametrize("value", ["abc", "10X", "-5"])
+def test_parse_size_invalid(value):
+    with pytest.raises(ValueError):
+        utils.parse_size(value)
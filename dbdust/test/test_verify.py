@@ -0,0 +1,115 @@
+import bz2
+import gzip
+import hashlib
+import logging
+
+import pytest
+import zstandard
+
+from dbdust import catalog, crypto, pack, storage, verify
+
+MYSQL_DUMP = b'CREATE TABLE t (id int);\nINSERT INTO t VALUES (1);\n-- Dump completed on 2019-05-06 11:09:52\n'
+
+
+@pytest.fixture
+def storage_handler(tmpdir):
+    local_storage = storage.LocalStorage(logging.getLogger(), str(tmpdir.mkdir('storage')))
+    return storage.StorageHandler(local_storage, 'backup-', '%Y%m%d%H%M%S', 1, 1, 1, 1)
+
+
+def _store(storage_handler, file_name, content):
+    with open('{}/{}'.format(storage_handler.storage_impl.local_path, file_name), 'wb') as stored:
+        stored.write(content)
+    return hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.parametrize("file_name,content", [
+    ('backup-20190506110952.sql', MYSQL_DUMP),
+    ('backup-20190506110952.sql.gz', gzip.compress(MYSQL_DUMP[:20]) + gzip.compress(MYSQL_DUMP[20:])),
+    ('backup-20190506110952.sql.bz2', bz2.compress(MYSQL_DUMP[:20]) + bz2.compress(MYSQL_DUMP[20:])),
+    ('backup-20190506110952.sql.zst', zstandard.ZstdCompressor().compress(MYSQL_DUMP[:20]) +
+     zstandard.ZstdCompressor().compress(MYSQL_DUMP[20:])),
+])
+def test_verifier_mysql_ok(storage_handler, file_name, content):
+    sha256 = _store(storage_handler, file_name, content)
+    results = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()
+    assert results == [{'file_name': file_name, 'sha256': sha256, 'ok': True, 'error': None}]
+
+
+def test_verifier_mysql_truncated(storage_handler):
+    _store(storage_handler, 'backup-20190506110952.sql.gz', gzip.compress(MYSQL_DUMP)[:-10])
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()[0]
+    assert result['ok'] is False
+    assert result['error'].startswith('EOFError')
+
+
+def test_verifier_mysql_incomplete_dump(storage_handler):
+    _store(storage_handler, 'backup-20190506110952.sql.gz', gzip.compress(MYSQL_DUMP[:30]))
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()[0]
+    assert result['ok'] is False
+    assert result['error'] == 'DbDustVerifyException: mysqldump trailer `-- Dump completed` not found'
+
+
+def test_verifier_checksum(storage_handler, tmpdir):
+    sha256 = _store(storage_handler, 'backup-20190506110952.sql', MYSQL_DUMP)
+    _store(storage_handler, 'backup-20190507110952.sql', MYSQL_DUMP)
+    dbdust_catalog = catalog.Catalog(str(tmpdir.join('catalog.jsonl')))
+    dbdust_catalog.record({'job': 'job1', 'file_name': 'backup-20190506110952.sql', 'sha256': sha256})
+    dbdust_catalog.record({'job': 'job1', 'file_name': 'backup-20190507110952.sql', 'sha256': 'abcd'})
+
+    results = verify.Verifier(logging.getLogger(), storage_handler, 'mysql', dbdust_catalog, 'job1', 2).run()
+
+    assert [r['ok'] for r in results] == [False, True]
+    assert results[0]['error'] == 'DbDustVerifyException: checksum mismatch, expected abcd got {}'.format(sha256)
+
+
+def test_verifier_mongo_archive(storage_handler):
+    _store(storage_handler, 'backup-20190506110952.gz', verify.MONGO_ARCHIVE_MAGIC + b'data' +
+           verify.MONGO_ARCHIVE_TERMINATOR)
+    _store(storage_handler, 'backup-20190507110952.gz', verify.MONGO_ARCHIVE_MAGIC + b'data')
+    _store(storage_handler, 'backup-20190508110952.gz', b'data' + verify.MONGO_ARCHIVE_TERMINATOR)
+
+    results = verify.Verifier(logging.getLogger(), storage_handler, 'mongo_archive').run()
+
+    assert [r['error'] for r in results] == [
+        'DbDustVerifyException: mongodump archive magic number not found',
+        'DbDustVerifyException: mongodump archive terminator not found',
+        None]
+
+
+def test_verifier_no_content_check(storage_handler):
+    _store(storage_handler, 'backup-20190506110952.txt', b'content')
+    assert verify.Verifier(logging.getLogger(), storage_handler).run()[0]['ok'] is True
+
+
+def test_verifier_encrypted(storage_handler):
+    key = bytes(range(32))
+    stage = crypto.EncryptStage(key, 16)
+    _store(storage_handler, 'backup-20190506110952.sql.gz.enc',
+           stage.process(gzip.compress(MYSQL_DUMP)) + stage.flush())
+
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql',
+                             keys={crypto.key_id(key): key}).run()[0]
+    assert result['ok'] is True
+
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()[0]
+    assert result['error'] == 'DbDustCryptoException: key {} needed to decrypt the file'.format(crypto.key_id(key))
+
+
+def test_verifier_pack(storage_handler, tmpdir):
+    pack_path = '{}/backup-20190506110952.sql.gz.pack'.format(storage_handler.storage_impl.local_path)
+    writer = pack.PackWriter(pack_path)
+    for name, content in [('db1.sql.gz', gzip.compress(MYSQL_DUMP)), ('db2.sql.gz', gzip.compress(MYSQL_DUMP[:30]))]:
+        tmpdir.join(name).write_binary(content)
+        writer.add(name, str(tmpdir.join(name)))
+    writer.close()
+
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()[0]
+    assert result['sha256'] == writer.sha256()
+    assert result['error'] == 'DbDustVerifyException: db2.sql.gz : mysqldump trailer `-- Dump completed` not found'
+
+    content = open(pack_path, 'rb').read()
+    with open(pack_path, 'wb') as pack_file:
+        pack_file.write(content[:20] + b'X' + content[21:])
+    result = verify.Verifier(logging.getLogger(), storage_handler, 'mysql').run()[0]
+    assert result['ok'] is False
@@ -0,0 +1,138 @@
+import logging
+import os
+import time
+
+import pytest
+from unittest.mock import Mock
+
+from dbdust import workqueue
+
+
+def _queue(tmpdir, *names, lease_duration=60):
+    work_queue = workqueue.WorkQueue(str(tmpdir.join('queue')), lease_duration)
+    config = tmpdir.join('config.cfg')
+    config.write('[general]\n')
+    for name in names:
+        work_queue.submit(name, str(config))
+    return work_queue
+
+
+def test_work_queue_claim_is_exclusive(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', 'db2')
+
+    assert work_queue.pending() == ['db1', 'db2']
+    assert work_queue.claim('db1', 'node1') is True
+    assert work_queue.claim('db1', 'node2') is False
+    assert work_queue.lease_owner('db1') == 'node1'
+    assert work_queue.heartbeat('db1', 'node1') is True
+    assert work_queue.heartbeat('db1', 'node2') is False
+
+
+def test_work_queue_reclaim_expired_lease(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', lease_duration=10)
+    work_queue.claim('db1', 'node1')
+    past = time.time() - 20
+    os.utime(work_queue.lease_path('db1'), (past, past))
+
+    assert work_queue.claim('db1', 'node2') is True
+    assert work_queue.lease_owner('db1') == 'node2'
+    assert work_queue.heartbeat('db1', 'node1') is False
+    assert work_queue.complete('db1', 'node1') is False
+    assert os.listdir(os.path.join(work_queue.path, 'leases')) == ['db1.lease']
+
+
+def test_work_queue_complete(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', 'db2')
+    work_queue.claim('db1', 'node1')
+    work_queue.claim('db2', 'node1')
+
+    assert work_queue.complete('db1', 'node1') is True
+    assert work_queue.complete('db2', 'node1', success=False) is True
+    assert work_queue.pending() == []
+    assert os.listdir(os.path.join(work_queue.path, 'done')) == ['db1.cfg']
+    assert os.listdir(os.path.join(work_queue.path, 'failed')) == ['db2.cfg']
+    assert os.listdir(os.path.join(work_queue.path, 'leases')) == []
+    assert work_queue.claim('db1', 'node2') is False
+
+
+def test_work_queue_configs(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', 'db2')
+    work_queue.claim('db1', 'node1')
+    work_queue.complete('db1', 'node1')
+    assert work_queue.configs() == {'db1': os.path.join(work_queue.path, 'done', 'db1.cfg'),
+                                    'db2': os.path.join(work_queue.path, 'jobs', 'db2.cfg')}
+    # a job submitted again uses its new config
+    work_queue.submit('db1', str(tmpdir.join('config.cfg')))
+    assert work_queue.configs()['db1'] == work_queue.job_path('db1')
+
+
+def test_worker_runs_longest_jobs_first(tmpdir):
+    work_queue = _queue(tmpdir, 'small', 'big', 'medium', 'broken', 'unknown')
+    estimates = {'small': {'size': 10, 'duration': 1}, 'big': {'size': 1000, 'duration': None},
+                 'medium': {'size': 100, 'duration': 50}, 'broken': None, 'unknown': {}}
+    done = []
+
+    def run_job(path):
+        name = os.path.basename(path)[:-4]
+        assert work_queue.lease_owner(name) is not None
+        if name == 'broken':
+            raise Exception('dump failed')
+        done.append(name)
+
+    worker = workqueue.Worker(logging.getLogger(), work_queue, run_job,
+                              lambda path: estimates[os.path.basename(path)[:-4]])
+
+    assert worker.ordered_jobs() == ['big', 'medium', 'small', 'broken', 'unknown']
+    assert worker.expected_duration('big') == 1000 * 51 / 110
+    assert worker.predict() == 1000 * 51 / 110 + 51
+    assert worker.run() == ['broken']
+    assert done == ['big', 'medium', 'small', 'unknown']
+    assert work_queue.pending() == []
+
+
+def test_worker_respects_host_limit(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', 'db2', 'db3')
+    estimates = {'db1': {'duration': 30, 'host': 'mysql-1'}, 'db2': {'duration': 20, 'host': 'mysql-1'},
+                 'db3': {'duration': 10, 'host': 'mysql-2'}}
+    worker = workqueue.Worker(logging.getLogger(), work_queue, Mock(),
+                              lambda path: estimates[os.path.basename(path)[:-4]], slots=2, host_limit=1)
+
+    assert worker.predict() == 50
+    assert worker.next_job('slot-1') == ('db1', work_queue.host_lease_path('mysql-1', 0))
+    assert worker.next_job('slot-2') == ('db3', work_queue.host_lease_path('mysql-2', 0))
+    assert worker.next_job('slot-3') is None
+
+    worker.process('db1', 'slot-1', work_queue.host_lease_path('mysql-1', 0))
+    assert worker.next_job('slot-1') == ('db2', work_queue.host_lease_path('mysql-1', 0))
+
+
+@pytest.mark.parametrize("jobs,slots,host_limit,makespan", [
+    ([], 2, None, 0),
+    ([(30, None), (20, None), (10, None)], 1, None, 60),
+    ([(30, None), (20, None), (10, None), (10, None)], 2, None, 40),
+    ([(30, 'a'), (20, 'a'), (10, 'b')], 2, 1, 50),
+    ([(30, 'a'), (20, 'a'), (10, 'b')], 3, 2, 30),
+])
+def test_predict_makespan(jobs, slots, host_limit, makespan):
+    assert workqueue.predict_makespan(jobs, slots, host_limit) == makespan
+
+
+def test_worker_warns_when_window_exceeded(tmpdir):
+    work_queue = _queue(tmpdir, 'db1')
+    logger = Mock()
+    worker = workqueue.Worker(logger, work_queue, Mock(), lambda path: {'duration': 120}, window=60)
+
+    worker.run()
+
+    assert 'exceeds the 60 seconds window' in logger.warning.call_args[0][0]
+
+
+def test_worker_waits_for_leases_of_other_workers(tmpdir):
+    work_queue = _queue(tmpdir, 'db1', lease_duration=0.2)
+    work_queue.claim('db1', 'dead-node')
+    run_job = Mock()
+
+    worker = workqueue.Worker(logging.getLogger(), work_queue, run_job, poll_interval=0.05)
+
+    assert worker.run() == []
+    run_job.assert_called_once_with(work_queue.job_path('db1'))
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Throughput shaping and process priority to protect the production databases """
+
+import os
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Thread safe token bucket shaping a throughput in bytes per second
+
+    A consumer asking for more tokens than available goes into debt and sleeps
+    until the debt is paid, so several threads sharing the same bucket share the
+    same budget.
+
+    :param rate: number of bytes allowed per second
+    :type rate: int
+    :param burst: max number of bytes that can be accumulated when idle (default to rate)
+    :type burst: int
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('token bucket rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """ Take `amount` tokens from the bucket, sleeping if the budget is exhausted
+
+        :param amount: number of bytes about to be transferred
+        :type amount: int
+        :return: the number of seconds spent waiting
+        :rtype: float
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_shared_buckets = {}
+_shared_buckets_lock = threading.Lock()
+
+
+def get_shared_bucket(name, rate):
+    """ Get the process wide token bucket registered under `name`
+
+    Concurrent jobs asking for the same name share one global budget. The rate of
+    the first caller is used.
+
+    :param name: bucket name (ex : `dump`, `upload:azure_blob`)
+    :type name: str
+    :param rate: number of bytes allowed per second, None or 0 to disable throttling
+    :type rate: int
+    :return: the bucket or None if throttling is disabled
+    :rtype: dbdust.throttle.TokenBucket
+    """
+    if not rate:
+        return None
+    with _shared_buckets_lock:
+        if name not in _shared_buckets:
+            _shared_buckets[name] = TokenBucket(rate)
+        return _shared_buckets[name]
+
+
+class ThrottledReader(object):
+    """ File like wrapper consuming tokens from a bucket on each read
+
+    Any other attribute (seek, tell, close ...) is proxied to the wrapped file.
+
+    :param fileobj: the file object to read from
+    :param bucket: the token bucket to consume from
+    :type bucket: dbdust.throttle.TokenBucket
+    """
+
+    def __init__(self, fileobj, bucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data:
+            self.bucket.consume(len(data))
+        return data
+
+    def readinto(self, buffer):
+        count = self.fileobj.readinto(buffer)
+        if count:
+            self.bucket.consume(count)
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fileobj.close()
+
+
+def priority_prefix(ionice_class=None, ionice_level=None):
+    """ Build the command prefix to run the dump with a lower io priority
+
+    :param ionice_class: ionice scheduling class (1 realtime, 2 best-effort, 3 idle)
+    :type ionice_class: str
+    :param ionice_level: ionice priority in the class (0 to 7)
+    :type ionice_level: str
+    :return: the list of arguments to put in front of the dump command
+    :rtype: list
+    """
+    if ionice_class is None and ionice_level is None:
+        return []
+    cmd = ['ionice']
+    if ionice_class is not None:
+        cmd.extend(['-c', str(ionice_class)])
+    if ionice_level is not None:
+        cmd.extend(['-n', str(ionice_level)])
+    return cmd
+
+
+def priority_preexec_fn(nice=None, cgroup=None):
+    """ Build the function executed in the child process before the dump command
+
+    It lowers the cpu priority and moves the child to a cgroup. All processes of the
+    dump pipeline (dumper and compressor) inherit these settings.
+
+    :param nice: increment added to the niceness of the child
+    :type nice: int
+    :param cgroup: path of the cgroup directory (cgroup v2) the child must join
+    :type cgroup: str
+    :return: a callable for `subprocess.Popen(preexec_fn=...)` or None
+    :rtype: callable
+    """
+    if nice is None and cgroup is None:
+        return None
+
+    def preexec():
+        if cgroup is not None:
+            with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as procs:
+                procs.write(str(os.getpid()))
+        if nice is not None:
+            os.nice(int(nice))
+    return preexec
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Helpers shared by the different dbdust modules """
+
+#: multipliers accepted as suffix of a size in the configuration
+SIZE_UNITS = {
+    'k': 1024,
+    'm': 1024 ** 2,
+    'g': 1024 ** 3,
+    't': 1024 ** 4,
+}
+
+
+def parse_size(value):
+    """ Convert a size from the configuration to a number of bytes
+
+    `1024`, `512k`, `10M` or `2G` are accepted (suffixes are binary multiples).
+    An empty value or None returns None.
+
+    :param value: the size to convert
+    :type value: str
+    :raise ValueError: if the value is not a valid size
+    :return: the size in bytes
+    :rtype: int
+    """
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if not value:
+        return None
+    if value.endswith('b'):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in SIZE_UNITS:
+        multiplier = SIZE_UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        size = int(float(value) * multiplier)
+    except ValueError:
+        raise ValueError('invalid size {}'.format(value))
+    if size < 0:
+        raise ValueError('invalid size {}'.format(value))
+    return size
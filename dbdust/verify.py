@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Verification of the stored backups without writing them to disk """
+
+import bz2
+import concurrent.futures
+import gzip
+import hashlib
+import os
+
+from dbdust import crypto
+from dbdust import pack
+from dbdust import pipeline
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+#: size of the reads from the decompressed stream
+READ_SIZE = 4 * 1024 * 1024
+
+#: number of bytes kept from the end of the decompressed stream for the content checks
+TAIL_SIZE = 4096
+
+#: mongodump archive magic number (0x8199e26d little endian) and terminator
+MONGO_ARCHIVE_MAGIC = b'\x6d\xe2\x99\x81'
+MONGO_ARCHIVE_TERMINATOR = b'\xff\xff\xff\xff'
+
+
+class DbDustVerifyException(Exception):
+    """ Base exception for all verify exception """
+    pass
+
+
+class HashingReader(object):
+    """ File like wrapper computing the sha256 of the data read
+
+    :param fileobj: the file object to read from
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self.fileobj.readinto(buffer)
+        if count:
+            self.hash.update(memoryview(buffer)[:count])
+        return count
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.fileobj.close()
+
+
+def _zstd_reader(fileobj):
+    if zstandard is None:
+        raise DbDustVerifyException('zstandard package is needed to verify zstd backups')
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+
+
+#: decompressed reader factory per file extension
+DECOMPRESSORS = {
+    'gz': lambda fileobj: gzip.GzipFile(fileobj=fileobj),
+    'bz2': lambda fileobj: bz2.BZ2File(fileobj),
+    'zst': _zstd_reader,
+}
+
+
+def check_mysql_dump(head, tail):
+    """ mysqldump writes a `-- Dump completed` comment at the very end of a successful dump """
+    if b'-- Dump completed' not in tail:
+        raise DbDustVerifyException('mysqldump trailer `-- Dump completed` not found')
+
+
+def check_mongo_archive(head, tail):
+    """ a mongodump archive starts with a magic number and ends with a terminator """
+    if not head.startswith(MONGO_ARCHIVE_MAGIC):
+        raise DbDustVerifyException('mongodump archive magic number not found')
+    if not tail.endswith(MONGO_ARCHIVE_TERMINATOR):
+        raise DbDustVerifyException('mongodump archive terminator not found')
+
+
+#: content checks per dump format (see `dump_format` in :data:`dbdust.dumper.dumper_config`)
+CONTENT_CHECKS = {
+    'mysql': check_mysql_dump,
+    'mongo_archive': check_mongo_archive,
+}
+
+
+class Verifier(object):
+    """ Stream stored backups through the storage read path, decompress them and check them
+
+    Backups are verified concurrently by a bounded pool of workers. Decompression releases
+    the GIL so workers use several cores.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param storage_handler: the storage handler of the job
+    :type storage_handler: dbdust.storage.StorageHandler
+    :param dump_format: format of the dumps (key of :data:`CONTENT_CHECKS`) or None to skip the content checks
+    :type dump_format: str
+    :param catalog: catalog with the recorded checksums
+    :type catalog: dbdust.catalog.Catalog
+    :param job: name of the job in the catalog
+    :type job: str
+    :param workers: max number of backups verified at the same time
+    :type workers: int
+    :param keys: keys indexed by key id to decrypt the encrypted backups (see :func:`dbdust.crypto.load_keys`)
+    :type keys: dict
+    :param pool: pool of buffers the backups are read into (default to one buffer per worker)
+    :type pool: dbdust.pipeline.BufferPool
+    """
+
+    def __init__(self, logger, storage_handler, dump_format=None, catalog=None, job=None, workers=None,
+                 keys=None, pool=None):
+        self.logger = logger
+        self.storage_handler = storage_handler
+        self.dump_format = dump_format
+        self.content_check = CONTENT_CHECKS.get(dump_format)
+        self.catalog = catalog
+        self.job = job
+        self.workers = workers or os.cpu_count() or 1
+        self.keys = keys or {}
+        self.pool = pool or pipeline.BufferPool(READ_SIZE, self.workers)
+
+    def run(self):
+        """ Verify all the backups of the job
+
+        :return: one result per backup (dict with `file_name`, `sha256`, `ok` and `error` keys)
+        :rtype: dict[]
+        """
+        checksums = {}
+        if self.catalog is not None:
+            checksums = {e['file_name']: e.get('sha256') for e in self.catalog.history(self.job) if 'file_name' in e}
+        backups = self.storage_handler._get_sorted_backup_files_list()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.verify, item, checksums.get(item['file_name'])) for item in backups]
+            results = [future.result() for future in futures]
+
+        for result in results:
+            if result['ok']:
+                self.logger.info('verify : {} ok'.format(result['file_name']))
+            else:
+                self.logger.error('verify : {} failed : {}'.format(result['file_name'], result['error']))
+        return results
+
+    def verify(self, item, expected_sha256=None):
+        """ Verify a single backup
+
+        :param item: the backup item from the storage list
+        :type item: dict
+        :param expected_sha256: checksum recorded at backup time
+        :type expected_sha256: str
+        :rtype: dict
+        """
+        result = {'file_name': item['file_name'], 'sha256': None, 'ok': False, 'error': None}
+        buffer = self.pool.acquire()
+        try:
+            members = None
+            if item['file_name'].endswith('.{}'.format(pack.FILE_EXT)):
+                members = self.storage_handler.read_pack_index(item)
+            raw = HashingReader(self.storage_handler.open_stream(item))
+            try:
+                with memoryview(buffer) as view:
+                    if members is None:
+                        contents = [(item['file_name'], ) + self._read(self._decompressed(raw, item['file_name']),
+                                                                       view)]
+                    else:
+                        contents = self._read_members(raw, members, view)
+                    # data after the end of the compressed stream is part of the checksum
+                    while raw.readinto(view):
+                        pass
+            finally:
+                raw.close()
+            result['sha256'] = raw.hash.hexdigest()
+            if expected_sha256 is not None and expected_sha256 != result['sha256']:
+                raise DbDustVerifyException('checksum mismatch, expected {} got {}'.format(
+                    expected_sha256, result['sha256']))
+            if self.content_check is not None:
+                for name, head, tail in contents:
+                    try:
+                        self.content_check(head, tail)
+                    except DbDustVerifyException as e:
+                        if members is None:
+                            raise
+                        raise DbDustVerifyException('{} : {}'.format(name, str(e)))
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, str(e))
+        finally:
+            self.pool.release(buffer)
+        return result
+
+    def _read_members(self, raw, members, view):
+        """ Read the members of a pack in sequence and check their checksum
+
+        :param raw: the pack stream
+        :param members: the index of the pack
+        :type members: dict[]
+        :param view: the buffer the members are read into
+        :type view: memoryview
+        :return: the name, first and last bytes of each member
+        :rtype: list
+        """
+        contents = []
+        position = 0
+        for member in sorted(members, key=lambda m: m['offset']):
+            if member['offset'] != position:
+                raise DbDustVerifyException('pack index inconsistent at {}'.format(member['name']))
+            reader = pack.MemberReader(raw, member['size'])
+            head, tail = self._read(self._decompressed(reader, member['name']), view)
+            reader.drain()
+            if reader.hash.hexdigest() != member['sha256']:
+                raise DbDustVerifyException('{} : checksum mismatch'.format(member['name']))
+            contents.append((member['name'], head, tail))
+            position += member['size']
+        return contents
+
+    def _decompressed(self, raw, file_name):
+        """ Get a reader decompressing the backup according to its extension
+
+        .. note:: a mongodump archive (`.gz`) is not compressed as a whole, only its content
+        """
+        extension = file_name.rsplit('.', 1)[-1]
+        if extension == crypto.FILE_EXT:
+            raw = crypto.DecryptingReader(raw, self.keys)
+            file_name = file_name[:-len(extension) - 1]
+            extension = file_name.rsplit('.', 1)[-1]
+        if self.dump_format == 'mongo_archive':
+            return raw
+        decompressor = DECOMPRESSORS.get(extension)
+        return decompressor(raw) if decompressor is not None else raw
+
+    @staticmethod
+    def _read(reader, view):
+        """ Read the whole stream
+
+        :param reader: the decompressed stream
+        :param view: the buffer the stream is read into
+        :type view: memoryview
+        :return: the first and last bytes of the stream
+        :rtype: tuple
+        """
+        head = b''
+        tail = b''
+        while True:
+            count = reader.readinto(view)
+            if not count:
+                break
+            if len(head) < TAIL_SIZE:
+                head += view[:min(count, TAIL_SIZE - len(head))]
+            tail = (tail + view[max(0, count - TAIL_SIZE):count])[-TAIL_SIZE:]
+        return head, tail
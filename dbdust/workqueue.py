@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2019 3sLab
+#
+# This file is part of the dbdust application
+#
+# MIT License :
+# https://raw.githubusercontent.com/3slab/dbdust/master/LICENSE
+
+""" Queue of backup jobs shared by several dbdust workers on different hosts
+
+The queue is a directory on a filesystem shared by the workers (NFS, CIFS ...) :
+
+* `jobs/<name>.cfg` : the config file of a job waiting to be done
+* `leases/<name>.lease` : the lease of the worker doing the job
+* `hosts/<database host>.<slot>.lease` : the slots limiting the jobs run at the same time on a database host
+* `done/<name>.cfg` and `failed/<name>.cfg` : the finished jobs
+
+A worker claims a job by creating its lease file exclusively and keeps it alive by updating
+its modification time. A lease not updated for `lease_duration` seconds belongs to a dead
+worker and is reclaimed by another worker, which runs the job again.
+"""
+
+import heapq
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+
+
+class DbDustQueueException(Exception):
+    """ Base exception for all queue exception """
+    pass
+
+
+class WorkQueue(object):
+    """ Job queue stored in a shared directory
+
+    :param path: the queue directory
+    :type path: str
+    :param lease_duration: seconds without heartbeat after which a lease is reclaimed
+    :type lease_duration: int
+    """
+
+    #: default lease duration in seconds
+    DEFAULT_LEASE_DURATION = 60
+
+    JOB_SUFFIX = '.cfg'
+    LEASE_SUFFIX = '.lease'
+
+    def __init__(self, path, lease_duration=None):
+        self.path = path
+        self.lease_duration = float(lease_duration or self.DEFAULT_LEASE_DURATION)
+        for directory in ('jobs', 'leases', 'hosts', 'done', 'failed'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    def job_path(self, name):
+        return os.path.join(self.path, 'jobs', '{}{}'.format(name, self.JOB_SUFFIX))
+
+    def lease_path(self, name):
+        return os.path.join(self.path, 'leases', '{}{}'.format(name, self.LEASE_SUFFIX))
+
+    def submit(self, name, config_path):
+        """ Add a job to the queue
+
+        :param name: the job name, unique in the queue
+        :type name: str
+        :param config_path: the dbdust config file of the job
+        :type config_path: str
+        """
+        tmp_path = '{}.{}.tmp'.format(self.job_path(name), os.getpid())
+        shutil.copyfile(config_path, tmp_path)
+        os.replace(tmp_path, self.job_path(name))
+
+    def pending(self):
+        """ Get the names of the jobs waiting to be done (claimed or not)
+
+        :rtype: str[]
+        """
+        return sorted(f[:-len(self.JOB_SUFFIX)] for f in os.listdir(os.path.join(self.path, 'jobs'))
+                      if f.endswith(self.JOB_SUFFIX))
+
+    def configs(self):
+        """ Get the config file of each job of the queue, waiting or finished
+
+        :return: job name -> path of its config file (the waiting one if the job was submitted again)
+        :rtype: dict
+        """
+        configs = {}
+        for directory in ('failed', 'done', 'jobs'):
+            folder = os.path.join(self.path, directory)
+            for file_name in sorted(os.listdir(folder)):
+                if file_name.endswith(self.JOB_SUFFIX):
+                    configs[file_name[:-len(self.JOB_SUFFIX)]] = os.path.join(folder, file_name)
+        return configs
+
+    def host_lease_path(self, host, slot):
+        file_name = '{}.{}{}'.format(re.sub(r'[^\w.-]', '_', host), slot, self.LEASE_SUFFIX)
+        return os.path.join(self.path, 'hosts', file_name)
+
+    def lease_owner(self, name):
+        """ Get the worker holding the lease of a job
+
+        :return: the worker id or None if the job is not leased
+        :rtype: str
+        """
+        return self._owner(self.lease_path(name))
+
+    @staticmethod
+    def _owner(path):
+        try:
+            with open(path) as lease_file:
+                return json.load(lease_file).get('worker')
+        except (OSError, ValueError):
+            return None
+
+    def _expired(self, path):
+        try:
+            return os.stat(path).st_mtime + self.lease_duration < time.time()
+        except FileNotFoundError:
+            return False
+
+    def _acquire(self, path, worker_id):
+        """ Create a lease file exclusively
+
+        An expired lease is first moved aside with an atomic rename : when several workers
+        try to reclaim it, only one rename succeeds.
+
+        :return: whether the worker got the lease
+        :rtype: bool
+        """
+        if self._expired(path):
+            stale_path = '{}.{}.stale'.format(path, worker_id.replace(os.sep, '_'))
+            try:
+                os.rename(path, stale_path)
+            except FileNotFoundError:
+                return False
+            if not self._expired(stale_path):
+                # another worker renewed the lease in between, give it back
+                try:
+                    os.link(stale_path, path)
+                except FileExistsError:
+                    pass
+                os.remove(stale_path)
+                return False
+            os.remove(stale_path)
+
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        try:
+            os.write(fd, json.dumps({'worker': worker_id, 'claimed': time.time()}).encode())
+        finally:
+            os.close(fd)
+        return True
+
+    def _renew(self, path, worker_id):
+        if self._owner(path) != worker_id:
+            return False
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _drop(self, path, worker_id):
+        if self._owner(path) == worker_id:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def is_leased(self, name):
+        """ Whether a worker holds a live lease on a job
+
+        :rtype: bool
+        """
+        return os.path.exists(self.lease_path(name)) and not self._expired(self.lease_path(name))
+
+    def claim(self, name, worker_id):
+        """ Take the lease of a job
+
+        :param name: the job name
+        :type name: str
+        :param worker_id: unique id of the worker
+        :type worker_id: str
+        :return: whether the worker got the lease
+        :rtype: bool
+        """
+        if not self._acquire(self.lease_path(name), worker_id):
+            return False
+        if not os.path.exists(self.job_path(name)):
+            # the job was finished by another worker after it was listed
+            self.release(name, worker_id)
+            return False
+        return True
+
+    def claim_host(self, host, limit, worker_id):
+        """ Take one of the `limit` slots of a database host
+
+        :param host: the database host
+        :type host: str
+        :param limit: max number of jobs run at the same time on the host
+        :type limit: int
+        :param worker_id: unique id of the worker
+        :type worker_id: str
+        :return: the path of the slot lease or None if all the slots are taken
+        :rtype: str
+        """
+        for slot in range(limit):
+            path = self.host_lease_path(host, slot)
+            if self._acquire(path, worker_id):
+                return path
+        return None
+
+    def release_host(self, host_slot, worker_id):
+        """ Give a host slot back
+
+        :param host_slot: the path of the slot lease returned by :meth:`claim_host`
+        :type host_slot: str
+        """
+        self._drop(host_slot, worker_id)
+
+    def heartbeat(self, name, worker_id, host_slot=None):
+        """ Keep the lease of a job (and of its host slot) alive
+
+        :return: whether the worker still holds the lease
+        :rtype: bool
+        """
+        if host_slot is not None:
+            self._renew(host_slot, worker_id)
+        return self._renew(self.lease_path(name), worker_id)
+
+    def release(self, name, worker_id, host_slot=None):
+        """ Give the lease of a job (and of its host slot) back without finishing it """
+        if host_slot is not None:
+            self.release_host(host_slot, worker_id)
+        self._drop(self.lease_path(name), worker_id)
+
+    def complete(self, name, worker_id, success=True, host_slot=None):
+        """ Move a job to `done` or `failed` and release its lease
+
+        :param success: whether the job succeeded
+        :type success: bool
+        :param host_slot: the host slot lease taken for the job
+        :type host_slot: str
+        :return: False if the lease was lost and the job left to its new owner
+        :rtype: bool
+        """
+        if self.lease_owner(name) != worker_id:
+            if host_slot is not None:
+                self.release_host(host_slot, worker_id)
+            return False
+        try:
+            os.replace(self.job_path(name),
+                       os.path.join(self.path, 'done' if success else 'failed', os.path.basename(self.job_path(name))))
+        except FileNotFoundError:
+            pass
+        self.release(name, worker_id, host_slot)
+        return True
+
+
+def predict_makespan(jobs, slots, host_limit=None):
+    """ Simulate the run of the jobs in order on the worker slots
+
+    A job starts as soon as a slot is free, unless its database host already runs
+    `host_limit` jobs : the next job of another host starts instead.
+
+    :param jobs: (duration in seconds, database host or None) of each job in run order
+    :type jobs: tuple[]
+    :param slots: number of jobs run at the same time
+    :type slots: int
+    :param host_limit: max number of jobs run at the same time on a database host
+    :type host_limit: int
+    :return: the time in seconds to run all the jobs
+    :rtype: float
+    """
+    pending = list(jobs)
+    running = []
+    now = 0
+    makespan = 0
+    while pending:
+        busy_hosts = [host for _, host in running]
+        index = None
+        if len(running) < slots:
+            index = next((i for i, (_, host) in enumerate(pending)
+                          if host is None or not host_limit or busy_hosts.count(host) < host_limit), None)
+        if index is None:
+            now, _ = heapq.heappop(running)
+            continue
+        duration, host = pending.pop(index)
+        heapq.heappush(running, (now + duration, host or ''))
+        makespan = max(makespan, now + duration)
+    return makespan
+
+
+class Worker(object):
+    """ Claim jobs from a queue and run them until the queue is empty
+
+    Free workers take the longest job left first (by expected duration, or by expected size
+    for the jobs without duration history) so the long jobs start early and the short ones
+    fill the gaps on all the hosts. A job whose database host already runs `host_limit`
+    jobs is skipped until a slot of the host is released.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param queue: the shared job queue
+    :type queue: dbdust.workqueue.WorkQueue
+    :param run_job: function running a job from its config file path, it raises on failure
+    :type run_job: callable
+    :param estimate: function giving a dict with the expected `size`, `duration` and the database
+                     `host` of a job from its config file path (any of them may be None)
+    :type estimate: callable
+    :param slots: number of jobs run at the same time by this worker
+    :type slots: int
+    :param poll_interval: seconds between two looks at the queue when all jobs are leased
+    :type poll_interval: float
+    :param host_limit: max number of jobs run at the same time on a database host by all the workers
+    :type host_limit: int
+    :param window: seconds allowed to run all the jobs, a warning is logged if the predicted makespan is longer
+    :type window: float
+    """
+
+    def __init__(self, logger, queue, run_job, estimate=None, slots=None, poll_interval=None, host_limit=None,
+                 window=None):
+        self.logger = logger
+        self.queue = queue
+        self.run_job = run_job
+        self.estimate = estimate
+        self.slots = slots or 1
+        self.poll_interval = poll_interval if poll_interval is not None else queue.lease_duration / 4
+        self.host_limit = host_limit
+        self.window = window
+        self.worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.estimates = {}
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def _estimate(self, name):
+        if name not in self.estimates:
+            estimate = None
+            if self.estimate is not None:
+                try:
+                    estimate = self.estimate(self.queue.job_path(name))
+                except Exception as e:
+                    self.logger.debug('queue : no estimate for {} : {}'.format(name, str(e)))
+            self.estimates[name] = estimate or {}
+        return self.estimates[name]
+
+    def expected_duration(self, name):
+        """ Expected duration of a job, from its history or from its expected size and the
+        throughput of the jobs with a known duration
+
+        :return: the duration in seconds (0 when unknown)
+        :rtype: float
+        """
+        estimate = self._estimate(name)
+        if estimate.get('duration'):
+            return estimate['duration']
+        if not estimate.get('size'):
+            return 0
+        known = [e for e in self.estimates.values() if e.get('duration') and e.get('size')]
+        if not known:
+            return 0
+        return estimate['size'] * sum(e['duration'] for e in known) / sum(e['size'] for e in known)
+
+    def ordered_jobs(self):
+        """ Get the pending jobs, longest first
+
+        :rtype: str[]
+        """
+        pending = self.queue.pending()
+        for name in pending:
+            self._estimate(name)
+        return sorted(pending, key=lambda n: (-self.expected_duration(n), -(self._estimate(n).get('size') or 0), n))
+
+    def predict(self):
+        """ Predict the time needed by this worker alone to run the pending jobs
+
+        :return: the makespan in seconds
+        :rtype: float
+        """
+        jobs = [(self.expected_duration(name), self._estimate(name).get('host')) for name in self.ordered_jobs()]
+        return predict_makespan(jobs, self.slots, self.host_limit)
+
+    def next_job(self, worker_id):
+        """ Claim the longest job not leased whose host has a free slot
+
+        :return: the job name and the host slot lease (or None) or None if no job can be started
+        :rtype: tuple
+        """
+        with self.lock:
+            for name in self.ordered_jobs():
+                host = self._estimate(name).get('host')
+                host_slot = None
+                if self.host_limit and host:
+                    if self.queue.is_leased(name):
+                        continue
+                    host_slot = self.queue.claim_host(host, self.host_limit, worker_id)
+                    if host_slot is None:
+                        continue
+                if self.queue.claim(name, worker_id):
+                    return name, host_slot
+                if host_slot is not None:
+                    self.queue.release_host(host_slot, worker_id)
+        return None
+
+    def run(self):
+        """ Run jobs until there is no job left in the queue
+
+        :return: the names of the failed jobs
+        :rtype: str[]
+        """
+        makespan = self.predict()
+        self.logger.info('queue : {} jobs, predicted makespan {:.0f} seconds on {} slots'.format(
+            len(self.queue.pending()), makespan, self.slots))
+        if self.window is not None and makespan > self.window:
+            self.logger.warning('queue : predicted makespan {:.0f} seconds exceeds the {:.0f} seconds window'.format(
+                makespan, self.window))
+        threads = [threading.Thread(target=self._loop, args=('{}-{}'.format(self.worker_id, slot),))
+                   for slot in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.failed
+
+    def _loop(self, worker_id):
+        while self.queue.pending():
+            claimed = self.next_job(worker_id)
+            if claimed is None:
+                # jobs left are leased by other workers or their host is busy, wait for a release
+                time.sleep(self.poll_interval)
+                continue
+            self.process(claimed[0], worker_id, claimed[1])
+
+    def process(self, name, worker_id, host_slot=None):
+        """ Run a claimed job while keeping its lease alive
+
+        :param name: the job name
+        :type name: str
+        :param worker_id: the id holding the lease
+        :type worker_id: str
+        :param host_slot: the host slot lease taken for the job
+        :type host_slot: str
+        """
+        self.logger.info('queue : {} claimed by {}'.format(name, worker_id))
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(name, worker_id, host_slot, stop), daemon=True)
+        heartbeat.start()
+        success = False
+        try:
+            self.run_job(self.queue.job_path(name))
+            success = True
+        except Exception as e:
+            self.logger.error('queue : {} failed : {}'.format(name, str(e)))
+        finally:
+            stop.set()
+            heartbeat.join()
+        if not self.queue.complete(name, worker_id, success, host_slot):
+            self.logger.warning('queue : lease of {} lost, the job is left to its new owner'.format(name))
+        elif not success:
+            with self.lock:
+                self.failed.append(name)
+        else:
+            self.logger.info('queue : {} done'.format(name))
+
+    def _heartbeat(self, name, worker_id, host_slot, stop):
+        while not stop.wait(self.queue.lease_duration / 3):
+            if not self.queue.heartbeat(name, worker_id, host_slot):
+                self.logger.warning('queue : lease of {} lost'.format(name))
+                return
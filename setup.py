@@ -18,7 +18,13 @@ setup(
     long_description=read('README.md'),
     install_requires=('azure-storage-blob', 'python-dateutil',),
     extras_require={
-        'test': ['pytest', 'flake8', 'freezegun']
+        'zstd': ['zstandard'],
+        's3': ['boto3'],
+        'encryption': ['cryptography'],
+        'oplog': ['pymongo'],
+        'ranges': ['pymongo'],
+        'mysql': ['pymysql'],
+        'test': ['pytest', 'flake8', 'freezegun', 'zstandard', 'boto3', 'moto[s3]', 'cryptography', 'pymongo']
     },
     classifiers=[
         'Development Status :: 5 - Production/Stable',